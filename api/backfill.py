@@ -0,0 +1,181 @@
+# backfill.py
+#
+# Vuelve a pasar compras antiguas por el mismo camino que el webhook
+# (clasificación -> alta y correo en el outbox -> envío). Útil tras una caída
+# que perdió webhooks.
+#
+# Solo se procesan sesiones completadas y pagadas, venga la lista de Stripe o
+# de un JSONL. Las compras que ya tuvieron su correo (por el webhook o por otro
+# backfill) no lo repiten: el outbox recuerda cada session_id.
+#
+# Uso:
+#   python -m api.backfill --jsonl sesiones.jsonl --paralelo 8 --checkpoint backfill.ckpt
+#   python -m api.backfill --desde 2026-09-01 --hasta 2026-10-01 --simulacion
+#   python -m api.backfill --tienda otra --desde 2026-09-01     # otra tienda de api/tiendas.py
+#
+# El checkpoint guarda un session_id por línea; si el proceso se corta, al
+# relanzarlo con el mismo fichero se salta lo que ya se hizo.
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from api.webhook import extraer_trabajo, procesar_trabajo
+from api.tiendas import obtener_tienda
+
+
+def sesiones_desde_jsonl(ruta):
+    """
+    Lee una exportación JSONL. Cada línea puede ser la sesión de checkout o
+    el evento completo de Stripe que la contiene.
+    """
+    with open(ruta, 'r', encoding='utf-8') as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea:
+                continue
+            obj = json.loads(linea)
+            if obj.get('object') == 'event':
+                obj = obj['data']['object']
+            yield obj
+
+
+def sesiones_desde_stripe(cliente_stripe, desde=None, hasta=None):
+    yield from cliente_stripe.listar_sesiones(desde=desde, hasta=hasta)
+
+
+def sesion_pagada(session):
+    """Lo mismo que pide listar_sesiones a Stripe: completada y cobrada (o gratuita)."""
+    return session.get('status') == 'complete' and session.get('payment_status') in ('paid', 'no_payment_required')
+
+
+class Checkpoint:
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.hechas = set()
+        self._lock = threading.Lock()
+        self._fichero = None
+
+        if ruta:
+            if os.path.exists(ruta):
+                with open(ruta, 'r', encoding='utf-8') as f:
+                    self.hechas = {linea.strip() for linea in f if linea.strip()}
+            self._fichero = open(ruta, 'a', encoding='utf-8')
+
+    def __contains__(self, session_id):
+        return session_id in self.hechas
+
+    def marcar(self, session_id):
+        with self._lock:
+            self.hechas.add(session_id)
+            if self._fichero:
+                self._fichero.write(session_id + "\n")
+                self._fichero.flush()
+
+    def cerrar(self):
+        if self._fichero:
+            self._fichero.close()
+
+
+def procesar_sesion(session, simulacion=False, tienda=None):
+    # Le damos forma de evento para reutilizar extraer_trabajo tal cual
+    evento = {"id": f"backfill:{session.get('id')}", "data": {"object": session}}
+    trabajo = extraer_trabajo(evento, tienda)
+    return procesar_trabajo(trabajo, simulacion=simulacion)
+
+
+def ejecutar_backfill(sesiones, paralelo=4, checkpoint=None, simulacion=False, limite=None, tienda=None):
+    """
+    Procesa las sesiones con `paralelo` hilos. Devuelve un resumen con los contadores.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    resumen = {"procesadas": 0, "fallidas": 0, "saltadas": 0, "no_pagadas": 0}
+    lock = threading.Lock()
+    # Como mucho 2*paralelo sesiones en memoria: no cargamos 50k de golpe
+    huecos = threading.BoundedSemaphore(paralelo * 2)
+
+    def una(session):
+        try:
+            ok = procesar_sesion(session, simulacion=simulacion, tienda=tienda)
+        except Exception as e:
+            print(f"-> ERROR en la sesión {session.get('id')}: {e}")
+            ok = False
+        finally:
+            huecos.release()
+
+        with lock:
+            resumen["procesadas" if ok else "fallidas"] += 1
+        # Las fallidas no se marcan, para que se repitan al relanzar
+        if ok and not simulacion:
+            checkpoint.marcar(session.get('id'))
+
+    inicio = time.perf_counter()
+    enviadas = 0
+    with ThreadPoolExecutor(max_workers=paralelo) as hilos:
+        for session in sesiones:
+            if limite is not None and enviadas >= limite:
+                break
+            if session.get('id') in checkpoint:
+                resumen["saltadas"] += 1
+                continue
+            if not sesion_pagada(session):
+                resumen["no_pagadas"] += 1
+                continue
+            huecos.acquire()
+            hilos.submit(una, session)
+            enviadas += 1
+
+    resumen["segundos"] = round(time.perf_counter() - inicio, 2)
+    return resumen
+
+
+def _fecha_a_timestamp(texto):
+    """Fecha ISO a timestamp; sin zona horaria se toma como UTC, con ella se respeta."""
+    if texto is None:
+        return None
+    fecha = datetime.fromisoformat(texto)
+    if fecha.tzinfo is None:
+        return fecha.replace(tzinfo=timezone.utc).timestamp()
+    return fecha.astimezone(timezone.utc).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reprocesa compras antiguas de Stripe.")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--jsonl", help="exportación JSONL de sesiones o eventos")
+    origen.add_argument("--desde", help="fecha ISO (UTC) desde la que listar sesiones en Stripe")
+    parser.add_argument("--hasta", help="fecha ISO (UTC) hasta la que listar sesiones en Stripe")
+    parser.add_argument("--paralelo", type=int, default=4)
+    parser.add_argument("--checkpoint", help="fichero para poder reanudar")
+    parser.add_argument("--simulacion", action="store_true", help="renderiza pero no registra ni envía")
+    parser.add_argument("--limite", type=int, help="procesar como mucho N sesiones")
+    parser.add_argument("--tienda", help="tienda de api/tiendas.py (por defecto la principal)")
+    args = parser.parse_args(argv)
+
+    tienda = obtener_tienda(args.tienda)
+
+    if args.jsonl:
+        sesiones = sesiones_desde_jsonl(args.jsonl)
+    else:
+        from api.productos import obtener_resolutor_productos
+        cliente = obtener_resolutor_productos(tienda).cliente_stripe
+        sesiones = sesiones_desde_stripe(cliente, _fecha_a_timestamp(args.desde), _fecha_a_timestamp(args.hasta))
+
+    checkpoint = Checkpoint(args.checkpoint)
+    try:
+        resumen = ejecutar_backfill(sesiones, args.paralelo, checkpoint, args.simulacion, args.limite, tienda)
+    finally:
+        checkpoint.cerrar()
+
+    print(f"-> Backfill terminado: {json.dumps(resumen)}")
+    return 0 if resumen["fallidas"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
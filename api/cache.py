@@ -0,0 +1,43 @@
+# cache.py
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """LRU con caducidad por entrada. Segura entre hilos."""
+
+    def __init__(self, max_entradas=10000, ttl=3600):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (momento en que caduca, valor)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, por_defecto=None):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return por_defecto
+            if entrada[0] < time.monotonic():
+                del self._datos[clave]
+                return por_defecto
+            self._datos.move_to_end(clave)
+            return entrada[1]
+
+    def __contains__(self, clave):
+        return self.obtener(clave) is not None
+
+    def añadir(self, clave, valor=True):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def quitar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def __len__(self):
+        return len(self._datos)
@@ -0,0 +1,75 @@
+# cliente_stripe.py
+#
+# Envoltorio mínimo sobre el SDK de Stripe con solo las llamadas que usamos.
+# Así se puede cambiar por ClienteStripeFalso (api/stripe_falso.py) sin red.
+# El SDK se importa dentro de cada llamada: tarda en cargar y un arranque en
+# frío que solo verifica firmas no debería pagarlo.
+
+from api.config import obtener_config
+from api.eventos_stripe import id_producto
+
+
+_sdk_preparado = False
+
+
+def _preparar_sdk():
+    """
+    Timeout propio y sin reintentos del SDK: los reintentos y el cortocircuito
+    los pone api/resiliencia.py, para no multiplicar esperas.
+    """
+    global _sdk_preparado
+    import stripe
+
+    if not _sdk_preparado:
+        stripe.default_http_client = stripe.RequestsClient(timeout=obtener_config().stripe_timeout)
+        stripe.max_network_retries = 0
+        _sdk_preparado = True
+    return stripe
+
+
+class ClienteStripe:
+
+    def __init__(self, api_key):
+        # La clave de la tienda, siempre explícita: nunca la de otra
+        self.api_key = api_key
+
+    def listar_line_items(self, session_id, limit=5):
+        """
+        Devuelve los line items de la sesión como lista de diccionarios
+        {'description': ..., 'price_id': ..., 'product_id': ...}. Una sesión que no existe da
+        ValueError (es un problema del evento, no de Stripe).
+        """
+        stripe = _preparar_sdk()
+
+        try:
+            line_items = stripe.checkout.Session.list_line_items(session_id, limit=limit, api_key=self.api_key)
+        except stripe.error.InvalidRequestError as e:
+            raise ValueError(f"Stripe rechazó la consulta de la sesión {session_id}: {e}") from e
+        return [
+            {
+                "description": item.description,
+                "price_id": item.price.id if item.get('price') else None,
+                "product_id": id_producto(item.get('price')),
+            }
+            for item in line_items.data
+        ]
+
+    def listar_sesiones(self, desde=None, hasta=None, por_pagina=100):
+        """
+        Recorre todas las sesiones de checkout completadas, paginando con la
+        API de Stripe. `desde` y `hasta` son timestamps Unix.
+        """
+        stripe = _preparar_sdk()
+
+        creado = {}
+        if desde is not None:
+            creado['gte'] = int(desde)
+        if hasta is not None:
+            creado['lt'] = int(hasta)
+
+        parametros = {"limit": por_pagina, "status": "complete", "api_key": self.api_key}
+        if creado:
+            parametros["created"] = creado
+
+        for session in stripe.checkout.Session.list(**parametros).auto_paging_iter():
+            yield session
@@ -0,0 +1,235 @@
+# cola_envios.py
+
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+
+from api.config import obtener_config
+
+
+# Claves en Redis
+CLAVE_PENDIENTES = "cola_envios:pendientes"
+# Sorted set trabajo -> hora límite de quien lo procesa. Antes era la lista
+# cola_envios:procesando, que se vaciaba entera al arrancar cualquier worker.
+CLAVE_EN_CURSO = "cola_envios:en_curso"
+CLAVE_PROGRAMADOS = "cola_envios:programados"
+CLAVE_FALLIDOS = "cola_envios:fallidos"
+
+# Cada cuánto se vuelve a mirar la cola cuando está vacía
+ESPERA_SONDEO = 0.2
+
+# Saca el siguiente trabajo y lo deja en curso hasta la hora límite. Antes
+# devuelve a pendientes, delante de los nuevos, los reintentos cuya espera ya
+# venció y los trabajos en curso cuyo plazo venció sin confirmarse (su worker
+# murió o se colgó). Los que otro worker vivo tiene entre manos no se tocan.
+#   KEYS = pendientes, en curso, programados
+#   ARGV = ahora, hora límite para confirmar
+# Devuelve el trabajo (texto JSON) o nil si no hay ninguno.
+SCRIPT_OBTENER = """
+local pendientes, en_curso, programados = KEYS[1], KEYS[2], KEYS[3]
+local ahora, limite = ARGV[1], ARGV[2]
+
+for _, origen in ipairs({programados, en_curso}) do
+    for _, raw in ipairs(redis.call('ZRANGEBYSCORE', origen, '-inf', ahora, 'LIMIT', 0, 100)) do
+        redis.call('ZREM', origen, raw)
+        redis.call('RPUSH', pendientes, raw)
+    end
+end
+
+local raw = redis.call('RPOP', pendientes)
+if raw then
+    redis.call('ZADD', en_curso, limite, raw)
+end
+return raw
+"""
+
+
+class ColaRedis:
+    """
+    Cola duradera sobre Redis.
+
+    - Los trabajos nuevos entran en la lista de pendientes.
+    - Al obtener un trabajo pasa a "en curso" con un plazo para confirmarlo
+      (COLA_PLAZO). Si el worker muere a mitad, al vencer el plazo vuelve a
+      pendientes y lo recoge otro; los que están dentro de plazo no se tocan,
+      así que se pueden tener varios procesos worker a la vez.
+    - Los reintentos esperan en un sorted set con la hora a la que vuelven.
+    - Los que agotan los intentos terminan en la lista de fallidos (dead-letter).
+
+    Dos trabajos con el mismo texto comparten plazo; solo pasa si el mismo
+    evento se encola dos veces, y el outbox no repite su correo.
+    """
+
+    def __init__(self, client, plazo=None):
+        self.r = client
+        self.plazo = obtener_config().cola_plazo if plazo is None else plazo
+        self._obtener = client.register_script(SCRIPT_OBTENER)
+
+    def encolar(self, trabajo):
+        self.r.lpush(CLAVE_PENDIENTES, json.dumps(trabajo))
+
+    async def encolar_async(self, trabajo):
+        """Para el webhook ASGI: mismo LPUSH con redis.asyncio."""
+        from api.mbp_user_manager import get_webhook_redis_client_async
+        await get_webhook_redis_client_async().lpush(CLAVE_PENDIENTES, json.dumps(trabajo))
+
+    def obtener(self, timeout=1):
+        limite_espera = time.monotonic() + timeout
+        while True:
+            ahora = time.time()
+            raw = self._obtener(keys=[CLAVE_PENDIENTES, CLAVE_EN_CURSO, CLAVE_PROGRAMADOS],
+                                args=[ahora, ahora + self.plazo])
+            if raw is not None:
+                break
+            if time.monotonic() >= limite_espera:
+                return None, None
+            time.sleep(ESPERA_SONDEO)
+
+        try:
+            # La referencia es el propio texto, que es lo que necesita ZREM
+            return raw, json.loads(raw)
+        except ValueError:
+            # Si se quedara en curso, volvería a la cola cada vez que vence su plazo
+            print(f"-> ERROR: trabajo ilegible en la cola, se aparta en fallidos: {raw[:200]!r}")
+            self.mover_a_fallidos(raw, {"ilegible": raw})
+            return None, None
+
+    def confirmar(self, ref):
+        self.r.zrem(CLAVE_EN_CURSO, ref)
+
+    def reprogramar(self, ref, trabajo, retraso):
+        pipe = self.r.pipeline()
+        pipe.zadd(CLAVE_PROGRAMADOS, {json.dumps(trabajo): time.time() + retraso})
+        pipe.zrem(CLAVE_EN_CURSO, ref)
+        pipe.execute()
+
+    def mover_a_fallidos(self, ref, trabajo):
+        pipe = self.r.pipeline()
+        pipe.lpush(CLAVE_FALLIDOS, json.dumps(trabajo))
+        pipe.zrem(CLAVE_EN_CURSO, ref)
+        pipe.execute()
+
+    def recuperar_procesando(self):
+        """
+        Devuelve a pendientes lo que quedó a medias tras una caída: solo los
+        trabajos cuyo plazo ya venció (obtener() también lo hace por su cuenta).
+        """
+        recuperados = 0
+        for raw in self.r.zrangebyscore(CLAVE_EN_CURSO, "-inf", time.time()):
+            # Solo lo mueve quien consigue borrarlo, así dos workers no lo duplican
+            if self.r.zrem(CLAVE_EN_CURSO, raw):
+                self.r.rpush(CLAVE_PENDIENTES, raw)
+                recuperados += 1
+        return recuperados
+
+    def fallidos(self):
+        return [json.loads(raw) for raw in self.r.lrange(CLAVE_FALLIDOS, 0, -1)]
+
+
+class ColaSQLite:
+    """
+    Misma interfaz que ColaRedis pero sobre un fichero SQLite.
+    Sirve para desarrollo y pruebas sin un Redis disponible. Para los trabajos
+    en curso, disponible_en es la hora límite para confirmarlos.
+    """
+
+    def __init__(self, ruta=":memory:", plazo=None):
+        self.plazo = obtener_config().cola_plazo if plazo is None else plazo
+        self.conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    datos TEXT NOT NULL,
+                    estado TEXT NOT NULL DEFAULT 'pendiente',
+                    disponible_en REAL NOT NULL DEFAULT 0
+                )
+                """
+            )
+
+    def encolar(self, trabajo):
+        with self.lock:
+            self.conn.execute("INSERT INTO trabajos (datos) VALUES (?)", (json.dumps(trabajo),))
+
+    async def encolar_async(self, trabajo):
+        await asyncio.to_thread(self.encolar, trabajo)
+
+    def obtener(self, timeout=1):
+        limite = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                ahora = time.time()
+                # Pendientes cuya espera venció, o en curso cuyo plazo venció sin confirmarse
+                fila = self.conn.execute(
+                    "SELECT id, datos FROM trabajos WHERE estado IN ('pendiente', 'procesando') "
+                    "AND disponible_en <= ? ORDER BY id LIMIT 1",
+                    (ahora,),
+                ).fetchone()
+                if fila:
+                    self.conn.execute("UPDATE trabajos SET estado = 'procesando', disponible_en = ? WHERE id = ?",
+                                      (ahora + self.plazo, fila[0]))
+                    return fila[0], json.loads(fila[1])
+            if time.monotonic() >= limite:
+                return None, None
+            time.sleep(0.05)
+
+    def confirmar(self, ref):
+        with self.lock:
+            self.conn.execute("DELETE FROM trabajos WHERE id = ?", (ref,))
+
+    def reprogramar(self, ref, trabajo, retraso):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE trabajos SET datos = ?, estado = 'pendiente', disponible_en = ? WHERE id = ?",
+                (json.dumps(trabajo), time.time() + retraso, ref),
+            )
+
+    def mover_a_fallidos(self, ref, trabajo):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE trabajos SET datos = ?, estado = 'fallido' WHERE id = ?",
+                (json.dumps(trabajo), ref),
+            )
+
+    def recuperar_procesando(self):
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE trabajos SET estado = 'pendiente', disponible_en = 0 "
+                "WHERE estado = 'procesando' AND disponible_en <= ?",
+                (time.time(),),
+            )
+            return cur.rowcount
+
+    def fallidos(self):
+        with self.lock:
+            filas = self.conn.execute("SELECT datos FROM trabajos WHERE estado = 'fallido' ORDER BY id").fetchall()
+        return [json.loads(f[0]) for f in filas]
+
+
+_cola = None
+_origen_cola = (None, None)  # (config, cliente de Redis) con los que se creó _cola
+
+
+def obtener_cola():
+    """
+    La cola del proceso según COLA_BACKEND ("redis" por defecto o "sqlite").
+    Se crea una vez (con SQLite, abrir la conexión y el CREATE TABLE en cada
+    petición sale caro) y se rehace si cambia la configuración o el cliente de
+    Redis, p. ej. en pruebas.
+    """
+    global _cola, _origen_cola
+    config = obtener_config()
+    if config.cola_backend == "sqlite":
+        origen = (config, None)
+    else:
+        from api.mbp_user_manager import get_webhook_redis_client
+        origen = (config, get_webhook_redis_client())
+
+    if _cola is None or origen[0] is not _origen_cola[0] or origen[1] is not _origen_cola[1]:
+        _cola = ColaSQLite(config.cola_sqlite_path) if origen[1] is None else ColaRedis(origen[1])
+        _origen_cola = origen
+    return _cola
@@ -0,0 +1,232 @@
+# config.py
+#
+# Configuración del webhook leída y validada UNA vez, al importar el módulo,
+# en lugar de consultar os.environ en cada petición. Todas las variables de
+# entorno de api/ se leen aquí; un número mal escrito o una opción que no
+# existe hacen fallar el arranque.
+#
+# Las variables que faltan no impiden arrancar (se avisa en el log); con
+# CONFIG_ESTRICTA=1 el arranque falla directamente.
+
+import os
+from dataclasses import dataclass
+
+
+# Opciones válidas de las variables que no son números ni interruptores
+BACKENDS_COLA = ("redis", "sqlite")
+PERFILES_HASH = ("produccion", "estandar", "desarrollo")
+
+
+def _booleano(valor):
+    return (valor or "").lower() in ("1", "true", "si", "sí")
+
+
+def _numero(entorno, nombre, defecto, tipo=int):
+    valor = entorno.get(nombre)
+    if valor is None or valor == "":
+        return defecto
+    try:
+        return tipo(valor)
+    except ValueError:
+        raise ValueError(f"{nombre} no es un número: {valor!r}")
+
+
+def _opcion(entorno, nombre, defecto, opciones):
+    valor = (entorno.get(nombre) or defecto).lower()
+    if valor not in opciones:
+        raise ValueError(f"{nombre} no es válido: {valor!r}. Opciones: {', '.join(opciones)}")
+    return valor
+
+
+@dataclass(frozen=True)
+class Config:
+    stripe_secret_key: str = None
+    stripe_webhook_secret: str = None
+
+    correo_user: str = None
+    correo_pass: str = None
+    nombre_correo: str = None
+    smtp_server: str = None
+    smtp_port: int = None
+    smtp_ssl: bool = True
+    smtp_max_conexiones: int = 2
+    smtp_timeout: float = 10.0
+    # Cupo del proveedor (api/limite_smtp.py); 0 es sin límite
+    smtp_por_minuto: int = 0
+    smtp_rafaga: int = 0
+    # Pausa de todos los envíos cuando el proveedor pide frenar (421/451)
+    smtp_pausa_freno: float = 60.0
+    # Correos por sesión SMTP compartida (api/correo_lotes.py); 0 es sin lotes
+    smtp_lote_tamano: int = 0
+    smtp_lote_espera: float = 0.2
+
+    redis_url: str = None
+    redis_timeout: float = 5.0
+    redis_timeout_conexion: float = 2.0
+
+    stripe_timeout: float = 10.0
+
+    # Reintentos y cortocircuitos de las dependencias (api/resiliencia.py)
+    reintentos: int = 2
+    # Dentro de una petición del webhook: Stripe no espera, mejor diferir a la cola
+    reintentos_peticion: int = 0
+    reintento_base: float = 0.05
+    reintento_maximo: float = 1.0
+    circuito_umbral: int = 5
+    circuito_segundos_abierto: float = 30.0
+
+    # Dominio del asunto de la tienda principal y JSON con las demás (api/tiendas.py)
+    tienda_dominio: str = "micosmeticanatural.com"
+    tiendas_config: str = None
+
+    # Outbox de correos (api/outbox.py): enviar en el acto y/o despachar desde el webhook.
+    # OJO: con outbox_despachador_integrado=False hace falta un `python -m api.despachador`
+    # aparte; sin él, un correo que no sale en el acto se queda en el outbox para siempre.
+    outbox_envio_inmediato: bool = True
+    outbox_despachador_integrado: bool = False
+    outbox_plazo_envio: float = 300.0
+    outbox_conservar_enviados: int = 7 * 24 * 3600
+    outbox_conservar_sesiones: int = 180 * 24 * 3600
+
+    # Despachador del outbox (api/despachador.py)
+    despachador_concurrencia: int = 4
+    despachador_lote: int = 20
+    despachador_max_intentos: int = 8
+    despachador_base_retraso: float = 2.0
+    despachador_max_aplazamientos: int = 30
+    despachador_informe_segundos: float = 60.0
+
+    # Modo cola (api/cola_envios.py) y su worker (api/worker.py)
+    modo_cola: bool = False
+    worker_integrado: bool = False
+    cola_backend: str = "redis"
+    cola_sqlite_path: str = "cola_envios.sqlite3"
+    cola_plazo: float = 300.0
+    worker_concurrencia: int = 2
+    worker_max_intentos: int = 5
+    worker_base_retraso: float = 2.0
+
+    # Hash de contraseñas (api/hashing.py); hash_procesos 0 = en el propio hilo, sin pool
+    hash_perfil: str = "estandar"
+    hash_procesos: int = 0
+    hash_max_pendientes: int = None
+    hash_espera: float = 5.0
+
+    # Eventos de Stripe ya procesados (api/idempotencia.py)
+    idempotencia_ttl: int = 4 * 24 * 3600
+    idempotencia_ttl_en_curso: int = 600
+    idempotencia_max_local: int = 10000
+
+    # Resumen de pedidos para la tienda (api/correo_lotes.py)
+    digest_comerciante: bool = False
+    digest_destinatario: str = None
+    digest_cada_pedidos: int = 50
+    digest_cada_segundos: float = 900.0
+
+    # Variante ASGI (api/webhook_asgi.py)
+    asgi_max_en_vuelo: int = 200
+    asgi_espera_en_vuelo: float = 10.0
+
+    calentar: bool = False
+
+    def problemas(self):
+        """Lista de problemas de configuración (vacía si todo está bien)."""
+        faltan = []
+        if not self.stripe_webhook_secret:
+            faltan.append("STRIPE_WEBHOOK_SECRET")
+        if not self.stripe_secret_key:
+            faltan.append("STRIPE_SECRET_KEY")
+        if not all([self.correo_user, self.correo_pass, self.smtp_server, self.smtp_port]):
+            faltan.append("CORREO_USER/CORREO_PASS/SMTP_SERVER/SMTP_PORT")
+        if not self.redis_url:
+            faltan.append("REDIS_URL")
+        return [f"Falta la variable de entorno {nombre}" for nombre in faltan]
+
+    @property
+    def correo_configurado(self):
+        return all([self.correo_user, self.correo_pass, self.smtp_server, self.smtp_port])
+
+
+def cargar_config(entorno=None):
+    entorno = os.environ if entorno is None else entorno
+
+    return Config(
+        stripe_secret_key=entorno.get('STRIPE_SECRET_KEY'),
+        stripe_webhook_secret=entorno.get('STRIPE_WEBHOOK_SECRET'),
+        correo_user=entorno.get('CORREO_USER'),
+        correo_pass=entorno.get('CORREO_PASS'),
+        nombre_correo=entorno.get('NOMBRE_CORREO'),
+        smtp_server=entorno.get('SMTP_SERVER'),
+        smtp_port=_numero(entorno, 'SMTP_PORT', None),
+        smtp_ssl=entorno.get('SMTP_SSL', '1') != '0',
+        smtp_max_conexiones=_numero(entorno, 'SMTP_MAX_CONEXIONES', 2),
+        smtp_timeout=_numero(entorno, 'SMTP_TIMEOUT', 10.0, float),
+        smtp_por_minuto=_numero(entorno, 'SMTP_POR_MINUTO', 0),
+        smtp_rafaga=_numero(entorno, 'SMTP_RAFAGA', 0),
+        smtp_pausa_freno=_numero(entorno, 'SMTP_PAUSA_FRENO', 60.0, float),
+        smtp_lote_tamano=_numero(entorno, 'SMTP_LOTE_TAMANO', 0),
+        smtp_lote_espera=_numero(entorno, 'SMTP_LOTE_ESPERA_MS', 200) / 1000,
+        redis_url=entorno.get("REDIS_URL") or entorno.get("REDIS_USER"),
+        redis_timeout=_numero(entorno, 'REDIS_TIMEOUT', 5.0, float),
+        redis_timeout_conexion=_numero(entorno, 'REDIS_TIMEOUT_CONEXION', 2.0, float),
+        stripe_timeout=_numero(entorno, 'STRIPE_TIMEOUT', 10.0, float),
+        reintentos=_numero(entorno, 'RESILIENCIA_REINTENTOS', 2),
+        reintentos_peticion=_numero(entorno, 'RESILIENCIA_REINTENTOS_PETICION', 0),
+        reintento_base=_numero(entorno, 'RESILIENCIA_BASE_MS', 50.0, float) / 1000,
+        reintento_maximo=_numero(entorno, 'RESILIENCIA_MAXIMO_MS', 1000.0, float) / 1000,
+        circuito_umbral=_numero(entorno, 'CIRCUITO_UMBRAL', 5),
+        circuito_segundos_abierto=_numero(entorno, 'CIRCUITO_SEGUNDOS_ABIERTO', 30.0, float),
+        tienda_dominio=entorno.get('TIENDA_DOMINIO') or "micosmeticanatural.com",
+        tiendas_config=entorno.get('TIENDAS_CONFIG'),
+        outbox_envio_inmediato=entorno.get('OUTBOX_ENVIO_INMEDIATO', '1') != '0',
+        outbox_despachador_integrado=_booleano(entorno.get('OUTBOX_DESPACHADOR_INTEGRADO')),
+        outbox_plazo_envio=_numero(entorno, 'OUTBOX_PLAZO_ENVIO', 300.0, float),
+        outbox_conservar_enviados=_numero(entorno, 'OUTBOX_CONSERVAR_ENVIADOS', 7 * 24 * 3600),
+        outbox_conservar_sesiones=_numero(entorno, 'OUTBOX_CONSERVAR_SESIONES', 180 * 24 * 3600),
+        despachador_concurrencia=_numero(entorno, 'DESPACHADOR_CONCURRENCIA', 4),
+        despachador_lote=_numero(entorno, 'DESPACHADOR_LOTE', 20),
+        despachador_max_intentos=_numero(entorno, 'DESPACHADOR_MAX_INTENTOS', 8),
+        despachador_base_retraso=_numero(entorno, 'DESPACHADOR_BASE_RETRASO', 2.0, float),
+        despachador_max_aplazamientos=_numero(entorno, 'DESPACHADOR_MAX_APLAZAMIENTOS', 30),
+        despachador_informe_segundos=_numero(entorno, 'DESPACHADOR_INFORME_SEGUNDOS', 60.0, float),
+        modo_cola=_booleano(entorno.get('WEBHOOK_MODO_COLA')),
+        worker_integrado=_booleano(entorno.get('WORKER_INTEGRADO')),
+        cola_backend=_opcion(entorno, 'COLA_BACKEND', "redis", BACKENDS_COLA),
+        cola_sqlite_path=entorno.get('COLA_SQLITE_PATH') or "cola_envios.sqlite3",
+        cola_plazo=_numero(entorno, 'COLA_PLAZO', 300.0, float),
+        worker_concurrencia=_numero(entorno, 'WORKER_CONCURRENCIA', 2),
+        worker_max_intentos=_numero(entorno, 'WORKER_MAX_INTENTOS', 5),
+        worker_base_retraso=_numero(entorno, 'WORKER_BASE_RETRASO', 2.0, float),
+        hash_perfil=_opcion(entorno, 'HASH_PERFIL', "estandar", PERFILES_HASH),
+        hash_procesos=_numero(entorno, 'HASH_PROCESOS', 0),
+        hash_max_pendientes=_numero(entorno, 'HASH_MAX_PENDIENTES', None),
+        hash_espera=_numero(entorno, 'HASH_ESPERA', 5.0, float),
+        idempotencia_ttl=_numero(entorno, 'IDEMPOTENCIA_TTL', 4 * 24 * 3600),
+        idempotencia_ttl_en_curso=_numero(entorno, 'IDEMPOTENCIA_TTL_EN_CURSO', 600),
+        idempotencia_max_local=_numero(entorno, 'IDEMPOTENCIA_MAX_LOCAL', 10000),
+        digest_comerciante=_booleano(entorno.get('DIGEST_COMERCIANTE')),
+        digest_destinatario=entorno.get('DIGEST_DESTINATARIO'),
+        digest_cada_pedidos=_numero(entorno, 'DIGEST_CADA_PEDIDOS', 50),
+        digest_cada_segundos=_numero(entorno, 'DIGEST_CADA_MINUTOS', 15.0, float) * 60,
+        asgi_max_en_vuelo=_numero(entorno, 'ASGI_MAX_EN_VUELO', 200),
+        asgi_espera_en_vuelo=_numero(entorno, 'ASGI_ESPERA_EN_VUELO', 10.0, float),
+        calentar=_booleano(entorno.get('WEBHOOK_CALENTAR')),
+    )
+
+_config = cargar_config()
+
+for _problema in _config.problemas():
+    if _booleano(os.environ.get('CONFIG_ESTRICTA')):
+        raise ValueError(_problema)
+    print(f"-> AVISO DE CONFIGURACIÓN: {_problema}")
+
+
+def obtener_config():
+    return _config
+
+
+def recargar_config(entorno=None):
+    """Vuelve a leer la configuración (pensado para pruebas y benchmarks)."""
+    global _config
+    _config = cargar_config(entorno)
+    return _config
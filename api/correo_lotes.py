@@ -0,0 +1,369 @@
+# correo_lotes.py
+#
+# Etapa de salida del correo:
+#   - LoteCorreos: junta los correos de varios pedidos y los manda en lotes por
+#     una misma sesión SMTP (varios send_message por login).
+#   - DigestComerciante: en vez de poner a la tienda en copia de cada pedido,
+#     le manda un resumen cada N pedidos o cada N minutos. Los pedidos esperan
+#     en Redis, no en memoria: si el proceso muere siguen ahí para el siguiente
+#     resumen, lo mande este proceso u otro.
+#
+# Variables de entorno (se leen en api/config.py):
+#   SMTP_LOTE_TAMANO       correos por lote (0 = sin lotes, se envía uno a uno)
+#   SMTP_LOTE_ESPERA_MS    cuánto se espera como mucho a que se llene un lote
+#   DIGEST_COMERCIANTE     1 para activar el resumen (y quitar la copia por pedido)
+#   DIGEST_DESTINATARIO    buzón del resumen de la tienda principal (por defecto CORREO_USER)
+#   DIGEST_CADA_PEDIDOS    pedidos por resumen
+#   DIGEST_CADA_MINUTOS    minutos entre resúmenes aunque no se llegue a N pedidos
+#
+# Claves:  digest_pedidos:<tienda>            lista de pedidos (JSON) sin resumir
+#          digest_pedidos:<tienda>:envio      un solo proceso manda el resumen a la vez
+#          digest_pedidos:<tienda>:ultimo     cuándo salió el último resumen
+
+import os
+import html
+import json
+import time
+import uuid
+import atexit
+import signal
+import threading
+from datetime import datetime
+from concurrent.futures import Future
+from email.message import EmailMessage
+
+from api.config import obtener_config
+from api.smtp_pool import obtener_pool_smtp, EnvioIncierto
+from api.tiendas import obtener_tienda, listar_tiendas, TIENDA_PRINCIPAL
+from api.metricas import contar
+
+
+class LoteCorreos:
+
+    def __init__(self, pool, tamaño_lote=20, espera_max=0.2):
+        self.pool = pool
+        self.tamaño_lote = tamaño_lote
+        self.espera_max = espera_max
+
+        self._pendientes = []  # lista de (mensaje, Future)
+        self._cond = threading.Condition()
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._bucle, name="lote-correos", daemon=True)
+        self._hilo.start()
+
+    def añadir(self, mensaje):
+        """Encola el correo y devuelve un Future que se resuelve al enviarlo."""
+        futuro = Future()
+        with self._cond:
+            if self._cerrado:
+                raise RuntimeError("El lote de correos ya está cerrado.")
+            self._pendientes.append((mensaje, futuro))
+            if len(self._pendientes) >= self.tamaño_lote:
+                self._cond.notify()
+        return futuro
+
+    def enviar(self, mensaje, timeout=60):
+        """
+        Como PoolSMTP.enviar pero compartiendo sesión con otros pedidos.
+        Si vence la espera y el correo aún no había salido de la cola, se
+        quita (TimeoutError); si ya se estaba enviando, lanza EnvioIncierto.
+        """
+        futuro = self.añadir(mensaje)
+        try:
+            futuro.result(timeout=timeout)
+        except TimeoutError:
+            if futuro.cancel():
+                raise TimeoutError(f"El lote no llegó a enviar el correo en {timeout}s.") from None
+            raise EnvioIncierto(f"El lote seguía enviando el correo tras {timeout}s.", futuro) from None
+        return True
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                # Esperamos a tener algo, y luego a que se llene el lote o venza la espera
+                while not self._pendientes and not self._cerrado:
+                    self._cond.wait()
+                if not self._pendientes and self._cerrado:
+                    return
+                if len(self._pendientes) < self.tamaño_lote and not self._cerrado:
+                    self._cond.wait(timeout=self.espera_max)
+                lote = self._pendientes[:self.tamaño_lote]
+                del self._pendientes[:self.tamaño_lote]
+
+            # Los cancelados por enviar() al vencer su espera ya no se mandan
+            lote = [(mensaje, futuro) for mensaje, futuro in lote if futuro.set_running_or_notify_cancel()]
+            if lote:
+                self._enviar_lote(lote)
+
+    def _enviar_lote(self, lote):
+        try:
+            resultados = self.pool.enviar_lote([mensaje for mensaje, _ in lote])
+        except Exception as e:
+            resultados = [e] * len(lote)
+
+        contar("lotes_smtp")
+        for (_, futuro), error in zip(lote, resultados):
+            if error is None:
+                futuro.set_result(True)
+            else:
+                futuro.set_exception(error)
+
+    def cerrar(self):
+        """Envía lo que quede y para el hilo."""
+        with self._cond:
+            self._cerrado = True
+            self._cond.notify()
+        self._hilo.join(timeout=30)
+
+
+PREFIJO_DIGEST = "digest_pedidos:"
+# Lo que puede tardar un resumen en salir antes de que otro proceso lo intente
+PLAZO_ENVIO_DIGEST = 120
+
+# Suelta el bloqueo del resumen solo si sigue siendo nuestro. Con GET y DEL por
+# separado, si el bloqueo caducaba entre los dos se borraba el de otro proceso.
+SCRIPT_SOLTAR_BLOQUEO = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_script_soltar = None
+
+
+def serializar_pedido(email, nombre, producto, monto):
+    return json.dumps({
+        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "email": email,
+        "nombre": nombre or "",
+        "producto": producto,
+        "monto": monto,
+    }, ensure_ascii=False)
+
+
+class DigestComerciante:
+
+    def __init__(self, pool, remitente, destinatario, nombre_remitente=None, cada_pedidos=50, cada_segundos=900,
+                 nombre_tienda=TIENDA_PRINCIPAL):
+        self.pool = pool
+        self.remitente = remitente
+        self.destinatario = destinatario
+        self.nombre_remitente = nombre_remitente or remitente
+        self.cada_pedidos = cada_pedidos
+        self.cada_segundos = cada_segundos
+        self.clave = f"{PREFIJO_DIGEST}{nombre_tienda}"
+
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name="digest-comerciante", daemon=True)
+        self._hilo.start()
+
+    @property
+    def r(self):
+        # Se pide cada vez: en pruebas el cliente de Redis puede cambiar
+        from api.mbp_user_manager import get_webhook_redis_client
+        return get_webhook_redis_client()
+
+    def añadir_pedido(self, email, nombre, producto, monto):
+        """Guarda el pedido para el resumen. No envía nada: de eso se encarga el hilo del digest."""
+        pedido = serializar_pedido(email, nombre, producto, monto)
+        try:
+            pendientes = self.r.rpush(self.clave, pedido)
+        except Exception as e:
+            # El correo del cliente ya salió; el pedido al menos queda en el log
+            print(f"-> ERROR: no se pudo guardar el pedido para el resumen ({e}). PEDIDO SIN RESUMEN: {pedido}")
+            return
+        if pendientes >= self.cada_pedidos:
+            self._despertar.set()
+
+    async def añadir_pedido_async(self, email, nombre, producto, monto):
+        """añadir_pedido con redis.asyncio (webhook ASGI): no bloquea el bucle de eventos."""
+        from api.mbp_user_manager import get_webhook_redis_client_async
+        pedido = serializar_pedido(email, nombre, producto, monto)
+        try:
+            pendientes = await get_webhook_redis_client_async().rpush(self.clave, pedido)
+        except Exception as e:
+            print(f"-> ERROR: no se pudo guardar el pedido para el resumen ({e}). PEDIDO SIN RESUMEN: {pedido}")
+            return
+        if pendientes >= self.cada_pedidos:
+            self._despertar.set()
+
+    def _bucle(self):
+        # Cada proceso mira a menudo; el resumen sale cuando toca según Redis, no según este reloj
+        while not self._parar.is_set():
+            self._despertar.wait(min(self.cada_segundos, 60))
+            self._despertar.clear()
+            if self.toca_resumen():
+                self.enviar_resumen()
+
+    def toca_resumen(self):
+        try:
+            pendientes = self.r.llen(self.clave)
+            if pendientes >= self.cada_pedidos:
+                return True
+            return pendientes > 0 and time.time() - float(self.r.get(f"{self.clave}:ultimo") or 0) >= self.cada_segundos
+        except Exception as e:
+            print(f"-> AVISO: no se pudo consultar el resumen pendiente: {e}")
+            return False
+
+    def construir_resumen(self, pedidos):
+        msg = EmailMessage()
+        msg['Subject'] = f"Resumen de pedidos: {len(pedidos)} nuevos"
+        msg['From'] = f"{self.nombre_remitente} <{self.remitente}>"
+        msg['To'] = self.destinatario
+
+        texto = "\n".join(f"{p['fecha']}  {p['email']}  {p['producto']}  {p['monto']}" for p in pedidos)
+        msg.set_content(f"Pedidos desde el último resumen:\n\n{texto}\n")
+
+        filas = "".join(
+            "<tr>" + "".join(f"<td>{html.escape(str(p[c]))}</td>" for c in ("fecha", "nombre", "email", "producto", "monto")) + "</tr>"
+            for p in pedidos
+        )
+        msg.add_alternative(
+            "<table border='1' cellpadding='4' cellspacing='0'>"
+            "<tr><th>Fecha</th><th>Nombre</th><th>Email</th><th>Producto</th><th>Importe</th></tr>"
+            f"{filas}</table>",
+            subtype='html',
+        )
+        return msg
+
+    def enviar_resumen(self):
+        """
+        Manda los pedidos pendientes y solo entonces los quita de Redis. Si
+        otro proceso ya está enviando el resumen de esta tienda, no hace nada.
+        """
+        global _script_soltar
+        r = self.r
+        bloqueo = f"{self.clave}:envio"
+        marca = uuid.uuid4().hex
+        try:
+            if not r.set(bloqueo, marca, nx=True, ex=PLAZO_ENVIO_DIGEST):
+                return True
+        except Exception as e:
+            print(f"-> ERROR AL ENVIAR EL RESUMEN DE PEDIDOS: {e}")
+            return False
+
+        try:
+            crudos = r.lrange(self.clave, 0, -1)
+            if not crudos:
+                return True
+            pedidos = [json.loads(crudo) for crudo in crudos]
+            self.pool.enviar(self.construir_resumen(pedidos))
+            # Solo los que iban en el resumen: los que llegaron mientras se enviaba esperan al siguiente
+            r.ltrim(self.clave, len(crudos), -1)
+            r.set(f"{self.clave}:ultimo", time.time())
+            contar("digests_enviados")
+            print(f"-> Resumen de {len(pedidos)} pedidos enviado a {self.destinatario}.")
+            return True
+        except Exception as e:
+            # Siguen en Redis para el siguiente intento
+            contar("digests_fallidos")
+            print(f"-> ERROR AL ENVIAR EL RESUMEN DE PEDIDOS: {e}")
+            return False
+        finally:
+            try:
+                if _script_soltar is None:
+                    _script_soltar = r.register_script(SCRIPT_SOLTAR_BLOQUEO)
+                _script_soltar(keys=[bloqueo], args=[marca], client=r)
+            except Exception:
+                pass  # caduca solo
+
+    def cerrar(self):
+        """Manda lo que quede aunque no toque todavía: al cerrar no se sabe cuándo habrá otro proceso."""
+        self._parar.set()
+        self._despertar.set()
+        self.enviar_resumen()
+
+
+# Uno de cada por tienda (nombre -> instancia)
+_lotes = {}
+_digests = {}
+_lock_modulo = threading.Lock()
+_cierre_registrado = False
+
+
+def _registrar_cierre():
+    """Al salir (o con SIGTERM) se vacían el lote y el resumen pendientes."""
+    global _cierre_registrado
+    if _cierre_registrado:
+        return
+    _cierre_registrado = True
+    atexit.register(cerrar_salida)
+
+    # Solo si nadie más (gunicorn, uvicorn...) maneja SIGTERM y estamos en el hilo principal
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        def _al_terminar(signum, frame):
+            cerrar_salida()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, _al_terminar)
+
+
+def obtener_lote_correos(tienda=None):
+    """None si SMTP_LOTE_TAMANO no está activado."""
+    config = obtener_config()
+    if config.smtp_lote_tamano <= 0:
+        return None
+    tienda = tienda or obtener_tienda()
+    lote = _lotes.get(tienda.nombre)
+    if lote is None:
+        with _lock_modulo:
+            lote = _lotes.get(tienda.nombre)
+            if lote is None:
+                lote = _lotes[tienda.nombre] = LoteCorreos(
+                    obtener_pool_smtp(tienda),
+                    tamaño_lote=config.smtp_lote_tamano,
+                    espera_max=config.smtp_lote_espera,
+                )
+                _registrar_cierre()
+    return lote
+
+
+def digest_activo():
+    return obtener_config().digest_comerciante
+
+
+def obtener_digest(tienda=None):
+    """None si DIGEST_COMERCIANTE no está activado. Cada tienda recibe su propio resumen."""
+    if not digest_activo():
+        return None
+    tienda = tienda or obtener_tienda()
+    digest = _digests.get(tienda.nombre)
+    if digest is None:
+        with _lock_modulo:
+            digest = _digests.get(tienda.nombre)
+            if digest is None:
+                # DIGEST_DESTINATARIO es de la tienda principal; las demás lo reciben en su buzón
+                config = obtener_config()
+                destinatario = config.digest_destinatario if tienda.nombre == TIENDA_PRINCIPAL else None
+                digest = _digests[tienda.nombre] = DigestComerciante(
+                    obtener_pool_smtp(tienda),
+                    remitente=tienda.correo_user,
+                    destinatario=destinatario or tienda.correo_user,
+                    nombre_remitente=tienda.nombre_correo,
+                    cada_pedidos=config.digest_cada_pedidos,
+                    cada_segundos=config.digest_cada_segundos,
+                    nombre_tienda=tienda.nombre,
+                )
+                _registrar_cierre()
+    return digest
+
+
+def iniciar_digests():
+    """
+    Arranca el hilo del resumen de cada tienda con correo al arrancar la app
+    (webhook o despachador), y no con el primer pedido: así también salen los
+    pedidos que dejó en Redis un proceso anterior.
+    """
+    if not digest_activo():
+        return []
+    return [obtener_digest(tienda) for tienda in listar_tiendas() if tienda.correo_configurado]
+
+
+def cerrar_salida():
+    for lote in list(_lotes.values()):
+        lote.cerrar()
+    for digest in list(_digests.values()):
+        digest.cerrar()
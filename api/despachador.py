@@ -0,0 +1,318 @@
+# despachador.py
+#
+# Envía los correos que el webhook deja en el outbox (api/outbox.py).
+# Cada hilo reclama los correos por lotes (una ida a Redis por lote) y los manda
+# por el pool SMTP de su tienda; se puede escalar con más hilos o más procesos
+# sin tocar el webhook, porque reclamar es atómico y nadie manda dos veces lo mismo.
+#
+# Con SMTP_POR_MINUTO (o smtp_por_minuto en TIENDAS_CONFIG) cada tienda no pasa
+# de su cupo, sumando todos los procesos (api/limite_smtp.py), y los correos
+# con la contraseña de una cuenta nueva salen antes que las confirmaciones.
+# Las respuestas 4xx del proveedor no pierden el correo: vuelve a la cola.
+#
+# Uso:  python -m api.despachador --concurrencia 4 --lote 20
+#       python -m api.despachador --estado       # correos en cada cola
+#
+# Con OUTBOX_DESPACHADOR_INTEGRADO=1 el propio webhook arranca un hilo
+# despachador (útil con un solo proceso), con DESPACHADOR_CONCURRENCIA y
+# DESPACHADOR_LOTE.
+#
+# IMPORTANTE: por defecto (OUTBOX_DESPACHADOR_INTEGRADO=0) el webhook no
+# despacha nada. Sin este proceso corriendo, cualquier correo que no salga en
+# el acto (SMTP caído, sin cupo, OUTBOX_ENVIO_INMEDIATO=0) se queda en el
+# outbox para siempre. El webhook lo avisa al arrancar.
+
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api.config import obtener_config
+from api.outbox import obtener_outbox, mensaje_de_entrada
+from api.smtp_pool import obtener_pool_smtp, es_aplazamiento, es_fallo_de_conexion, codigos_smtp, EnvioIncierto
+from api.limite_smtp import obtener_limitador, obtener_limitador_async
+from api.correo_lotes import obtener_lote_correos, obtener_digest, iniciar_digests
+from api.metricas import medir, contar, anotar, evento
+from api.resiliencia import proteger, calcular_retraso, DependenciaCaida
+from api.tiendas import listar_tiendas
+
+
+_config = obtener_config()
+MAX_INTENTOS = _config.despachador_max_intentos
+BASE_RETRASO = _config.despachador_base_retraso
+# Los aplazamientos (4xx) no son culpa del correo y se cuentan aparte, con más margen
+MAX_APLAZAMIENTOS = _config.despachador_max_aplazamientos
+# Respuestas con las que el proveedor dice "vas demasiado rápido", y la pausa que se hace entonces
+CODIGOS_FRENO = {421, 451}
+PAUSA_FRENO = _config.smtp_pausa_freno
+ESPERA_VACIO = 0.2
+INFORME_SEGUNDOS = _config.despachador_informe_segundos
+
+ENVIADO = "enviado"
+REINTENTO = "reintento"
+APLAZADO = "aplazado"
+FRENADO = "frenado"
+FALLIDO = "fallido"
+INCIERTO = "incierto"
+
+
+def registrar_envio(outbox, id_entrada, tienda, pedido=None):
+    """El correo salió: se confirma en el outbox y el pedido pasa al resumen de la tienda."""
+    outbox.confirmar(tienda, id_entrada)
+    contar("correos_enviados")
+    anotar(resultado=ENVIADO)
+
+    digest = obtener_digest(tienda)
+    if digest is not None and pedido:
+        digest.añadir_pedido(**pedido)
+
+
+async def registrar_envio_async(outbox, id_entrada, tienda, pedido=None):
+    """registrar_envio con un OutboxCorreosAsync (webhook ASGI)."""
+    await outbox.confirmar(tienda, id_entrada)
+    contar("correos_enviados")
+    anotar(resultado=ENVIADO)
+
+    digest = obtener_digest(tienda)
+    if digest is not None and pedido:
+        await digest.añadir_pedido_async(**pedido)
+
+
+def pide_frenar(error):
+    """El proveedor respondió 421/451: hay que vaciar el cupo de la tienda para todos los procesos."""
+    causa = error.__cause__ if isinstance(error, DependenciaCaida) else error
+    return causa is not None and bool(CODIGOS_FRENO & set(codigos_smtp(causa)))
+
+
+def evaluar_fallo(error, intentos=0, aplazamientos=0, max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    """
+    Decide qué hacer con un correo cuyo envío falló:
+      - Si lo que falla es la conexión con el SMTP (DependenciaCaida por un
+        servidor caído, sin sesión o con el circuito abierto) no se gasta
+        intento: el correo no tiene la culpa y se esperará lo que haga falta.
+        Un 5xx a este mensaje sí cuenta, aunque llegue como DependenciaCaida.
+      - Un 4xx es un aplazamiento y se cuenta aparte (FRENADO si es 421/451).
+    Devuelve (REINTENTO, APLAZADO, FRENADO o FALLIDO, intentos, aplazamientos, retraso).
+    """
+    causa = error.__cause__ if isinstance(error, DependenciaCaida) else error
+    sin_conexion = isinstance(error, DependenciaCaida) and (causa is None or es_fallo_de_conexion(causa))
+    if causa is not None and es_aplazamiento(causa):
+        aplazamientos += 1
+        resultado = FRENADO if pide_frenar(error) else APLAZADO
+        agotado = aplazamientos >= MAX_APLAZAMIENTOS
+        retraso = calcular_retraso(aplazamientos, base_retraso)
+    else:
+        resultado = REINTENTO
+        if not sin_conexion:
+            intentos += 1
+        agotado = intentos >= max_intentos
+        retraso = calcular_retraso(max(intentos, 1), base_retraso)
+    return (FALLIDO if agotado else resultado), intentos, aplazamientos, retraso
+
+
+def _informar_fallo(id_entrada, error, resultado, intentos, aplazamientos, retraso):
+    if resultado == FALLIDO:
+        print(f"-> ERROR: correo {id_entrada} enviado a fallidos tras {intentos} intentos "
+              f"y {aplazamientos} aplazamientos: {error}")
+        contar("correos_fallidos")
+    elif resultado == REINTENTO:
+        print(f"-> Reintento {intentos} del correo {id_entrada} en {retraso:.1f}s: {error}")
+        contar("correos_reintentados")
+    else:
+        print(f"-> El SMTP aplaza el correo {id_entrada}; vuelve a la cola en {retraso:.1f}s: {error}")
+        contar("correos_aplazados")
+    anotar(resultado=resultado, error=str(error))
+
+
+def registrar_fallo(outbox, id_entrada, error, tienda, intentos=0, aplazamientos=0,
+                    max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    """
+    Reprograma el correo o, si agotó los intentos, lo aparta en fallidos
+    (ver evaluar_fallo). Devuelve REINTENTO, APLAZADO, FRENADO o FALLIDO.
+    """
+    if pide_frenar(error):
+        obtener_limitador().frenar(tienda, PAUSA_FRENO)
+    resultado, intentos, aplazamientos, retraso = evaluar_fallo(error, intentos, aplazamientos,
+                                                                max_intentos, base_retraso)
+    _informar_fallo(id_entrada, error, resultado, intentos, aplazamientos, retraso)
+    if resultado == FALLIDO:
+        outbox.mover_a_fallidos(tienda, id_entrada, intentos=intentos, aplazamientos=aplazamientos,
+                                ultimo_error=str(error))
+    else:
+        outbox.reprogramar(tienda, id_entrada, retraso, intentos=intentos, aplazamientos=aplazamientos,
+                           ultimo_error=str(error))
+    return resultado
+
+
+async def registrar_fallo_async(outbox, id_entrada, error, tienda, intentos=0, aplazamientos=0,
+                                max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    """registrar_fallo con un OutboxCorreosAsync (webhook ASGI)."""
+    if pide_frenar(error):
+        await obtener_limitador_async().frenar(tienda, PAUSA_FRENO)
+    resultado, intentos, aplazamientos, retraso = evaluar_fallo(error, intentos, aplazamientos,
+                                                                max_intentos, base_retraso)
+    _informar_fallo(id_entrada, error, resultado, intentos, aplazamientos, retraso)
+    if resultado == FALLIDO:
+        await outbox.mover_a_fallidos(tienda, id_entrada, intentos=intentos, aplazamientos=aplazamientos,
+                                      ultimo_error=str(error))
+    else:
+        await outbox.reprogramar(tienda, id_entrada, retraso, intentos=intentos, aplazamientos=aplazamientos,
+                                 ultimo_error=str(error))
+    return resultado
+
+
+def anotar_incierto(outbox, id_entrada, tienda, futuro, pedido=None, intentos=0, aplazamientos=0,
+                    max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    """Cuando el lote por fin resuelve un envío incierto, se anota como cualquier otro."""
+    def al_terminar(futuro):
+        try:
+            if futuro.cancelled():
+                return  # no salió: el plazo de envío lo devolverá a la cola
+            error = futuro.exception()
+            if error is None:
+                registrar_envio(outbox, id_entrada, tienda, pedido)
+            else:
+                registrar_fallo(outbox, id_entrada, error, tienda, intentos, aplazamientos, max_intentos, base_retraso)
+        except Exception as e:
+            print(f"-> ERROR al anotar el correo {id_entrada}: {e}")
+
+    futuro.add_done_callback(al_terminar)
+
+
+def entregar(outbox, id_entrada, msg, tienda, pedido=None, intentos=0, aplazamientos=0,
+             max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    """
+    Envía un correo ya reclamado del outbox. Devuelve ENVIADO, INCIERTO (el lote
+    lo sigue enviando; se anotará al acabar) o lo que diga registrar_fallo.
+    """
+    try:
+        # Con SMTP_LOTE_TAMANO el correo comparte sesión SMTP con otros
+        enviador = obtener_lote_correos(tienda) or obtener_pool_smtp(tienda)
+        with medir("smtp"):
+            proteger("smtp", enviador.enviar, msg, tienda=tienda)
+    except EnvioIncierto as e:
+        # Reprogramarlo ahora podría mandarlo dos veces; mientras, sigue reclamado en el outbox
+        print(f"-> AVISO: correo {id_entrada} pendiente del lote: {e}")
+        anotar(resultado=INCIERTO)
+        anotar_incierto(outbox, id_entrada, tienda, e.futuro, pedido, intentos, aplazamientos, max_intentos, base_retraso)
+        return INCIERTO
+    except Exception as e:
+        return registrar_fallo(outbox, id_entrada, e, tienda, intentos, aplazamientos, max_intentos, base_retraso)
+
+    print(f"-> Correo con plantilla enviado exitosamente a {msg.destinatarios[0]}.")
+    registrar_envio(outbox, id_entrada, tienda, pedido)
+    return ENVIADO
+
+
+def despachar_entrada(outbox, tienda, id_entrada, entrada, max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    intentos = int(entrada.get('intentos') or 0)
+    aplazamientos = int(entrada.get('aplazamientos') or 0)
+    with evento(id_entrada, origen="despachador", intento=intentos + aplazamientos + 1, tienda=tienda.nombre,
+                credenciales=entrada.get('credenciales') == '1'):
+        pedido = json.loads(entrada['pedido']) if entrada.get('pedido') else None
+        return entregar(outbox, id_entrada, mensaje_de_entrada(entrada), tienda, pedido, intentos, aplazamientos,
+                        max_intentos, base_retraso)
+
+
+def despachar_lote(outbox, tienda, reclamadas, max_intentos=MAX_INTENTOS, base_retraso=BASE_RETRASO):
+    for i, (id_entrada, entrada) in enumerate(reclamadas):
+        try:
+            resultado = despachar_entrada(outbox, tienda, id_entrada, entrada, max_intentos, base_retraso)
+        except Exception as e:
+            # Si no se pudo ni anotar el resultado, el plazo de envío lo devolverá a la cola
+            print(f"-> ERROR con el correo {id_entrada}: {e}")
+            continue
+        if resultado == FRENADO:
+            # El resto del lote chocaría con el mismo límite: vuelve a la cola sin gastar intento
+            outbox.devolver(tienda, reclamadas[i + 1:])
+            return
+
+
+def bucle_despachador(outbox, parar, lote, max_intentos, base_retraso):
+    while not parar.is_set():
+        reclamados = 0
+        esperas = [ESPERA_VACIO]
+        fallo = False
+        for tienda in listar_tiendas():
+            try:
+                reclamadas, espera = outbox.reclamar(tienda, lote)
+                reclamados += len(reclamadas)
+                if espera:
+                    esperas.append(espera)
+                despachar_lote(outbox, tienda, reclamadas, max_intentos, base_retraso)
+            except Exception as e:
+                print(f"-> ERROR al despachar el outbox de {tienda.nombre}: {e}")
+                fallo = True
+        # Sin nada que enviar (o sin cupo) se espera a la siguiente ficha, como mucho ESPERA_VACIO
+        if not reclamados:
+            parar.wait(1 if fallo else min(esperas))
+
+
+def informar_profundidad(outbox):
+    try:
+        profundidad = outbox.publicar_profundidad(listar_tiendas())
+    except Exception as e:
+        print(f"-> AVISO: no se pudo leer la profundidad del outbox: {e}")
+        return None
+    print(f"-> Outbox: {json.dumps(profundidad)}")
+    return profundidad
+
+
+def ejecutar_despachador(outbox=None, concurrencia=4, lote=20, max_intentos=MAX_INTENTOS,
+                         base_retraso=BASE_RETRASO, parar=None):
+    """
+    Arranca `concurrencia` hilos que vacían el outbox hasta que se activa `parar`.
+    """
+    outbox = outbox or obtener_outbox()
+    parar = parar or threading.Event()
+
+    print(f"-> Despachador arrancado con {concurrencia} hilos y lotes de {lote}.")
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for _ in range(concurrencia):
+            pool.submit(bucle_despachador, outbox, parar, lote, max_intentos, base_retraso)
+        try:
+            ultimo_informe = 0
+            while not parar.is_set():
+                time.sleep(0.5)
+                if time.monotonic() - ultimo_informe >= INFORME_SEGUNDOS:
+                    ultimo_informe = time.monotonic()
+                    informar_profundidad(outbox)
+        except KeyboardInterrupt:
+            print("-> Parando despachador...")
+            parar.set()
+
+
+def iniciar_en_segundo_plano(concurrencia=1, lote=20):
+    """Despachador en un hilo daemon del propio proceso. Devuelve el Event para pararlo."""
+    parar = threading.Event()
+    hilo = threading.Thread(
+        target=ejecutar_despachador,
+        kwargs={"concurrencia": concurrencia, "lote": lote, "parar": parar},
+        name="despachador-outbox",
+        daemon=True,
+    )
+    hilo.start()
+    return parar
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Despachador de los correos del outbox.")
+    parser.add_argument("--concurrencia", type=int, default=_config.despachador_concurrencia)
+    parser.add_argument("--lote", type=int, default=_config.despachador_lote)
+    parser.add_argument("--max-intentos", type=int, default=MAX_INTENTOS)
+    parser.add_argument("--base-retraso", type=float, default=BASE_RETRASO)
+    parser.add_argument("--estado", action="store_true", help="muestra cuántos correos hay en cada cola y sale")
+    args = parser.parse_args()
+
+    if args.estado:
+        informar_profundidad(obtener_outbox())
+        return
+
+    iniciar_digests()
+    ejecutar_despachador(concurrencia=args.concurrencia, lote=args.lote, max_intentos=args.max_intentos,
+                         base_retraso=args.base_retraso)
+
+
+if __name__ == "__main__":
+    main()
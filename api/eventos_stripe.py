@@ -0,0 +1,164 @@
+# eventos_stripe.py
+#
+# Lectura rápida de los webhooks de Stripe, sin stripe.Webhook.construct_event.
+#
+# construct_event decodifica el JSON entero a un árbol de StripeObject para
+# cualquier tipo de evento, y nosotros solo usamos checkout.session.completed.
+# Aquí:
+#   1. La firma (HMAC-SHA256, esquema v1) se comprueba sobre los bytes tal
+#      cual llegan, como hace Stripe.
+#   2. Si el tipo que gestionamos ni aparece en el cuerpo, el evento es de otro
+#      tipo y se responde sin decodificar nada.
+#   3. Si aparece, se decodifica con orjson (si está instalado; si no, json) a
+#      dicts normales y se queda solo lo que usamos en un SesionCheckout.
+
+import hmac
+import json
+import time
+import hashlib
+
+try:
+    import orjson
+    cargar_json = orjson.loads
+except ImportError:  # orjson es opcional: json da lo mismo, algo más lento
+    cargar_json = json.loads
+
+
+TIPO_CHECKOUT_COMPLETADO = "checkout.session.completed"
+# Lo mismo que construct_event: firmas de más de 5 minutos no valen (evita reenvíos)
+TOLERANCIA_FIRMA = 300
+
+_MARCA_CHECKOUT = f'"{TIPO_CHECKOUT_COMPLETADO}"'.encode()
+_CAMPOS_DIRECCION = ('line1', 'line2', 'postal_code', 'city', 'state', 'country')
+
+
+class FirmaInvalida(Exception):
+    """La cabecera Stripe-Signature falta, está mal formada o no corresponde al cuerpo."""
+
+
+def verificar_firma(payload, cabecera, secreto, tolerancia=TOLERANCIA_FIRMA, ahora=None):
+    if not secreto:
+        # Sin secreto no hay nada contra lo que comprobar: se rechaza, no se deja pasar
+        raise FirmaInvalida("No hay secreto de webhook configurado para esta tienda.")
+    if not cabecera:
+        raise FirmaInvalida("Falta la cabecera Stripe-Signature.")
+
+    timestamp, firmas = None, []
+    for parte in cabecera.split(","):
+        clave, _, valor = parte.strip().partition("=")
+        if clave == "t":
+            timestamp = valor
+        elif clave == "v1":
+            firmas.append(valor)
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        raise FirmaInvalida("La cabecera Stripe-Signature no trae un timestamp válido.")
+    if not firmas:
+        raise FirmaInvalida("La cabecera Stripe-Signature no trae firmas v1.")
+
+    esperada = hmac.new(secreto.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(esperada, firma) for firma in firmas):
+        raise FirmaInvalida("Ninguna firma coincide con el cuerpo recibido.")
+    if tolerancia and timestamp < (ahora or time.time()) - tolerancia:
+        raise FirmaInvalida("La firma ha caducado (timestamp fuera de tolerancia).")
+
+
+def id_producto(precio):
+    """El product_id de un precio de Stripe: `product` es el id, o el objeto si se expandió."""
+    producto = precio.get('product') if precio else None
+    if producto is not None and not isinstance(producto, str):
+        producto = producto.get('id')
+    return producto
+
+
+class SesionCheckout:
+    """Lo que usamos de una checkout.session (y el id de su evento), sin el resto del árbol."""
+
+    __slots__ = ("event_id", "session_id", "email", "nombre", "monto", "moneda", "direccion", "line_items")
+
+    def __init__(self, event_id=None, session_id=None, email=None, nombre=None, monto=0.0, moneda="USD",
+                 direccion=None, line_items=None):
+        self.event_id = event_id
+        self.session_id = session_id
+        self.email = email
+        self.nombre = nombre
+        self.monto = monto
+        self.moneda = moneda
+        self.direccion = direccion
+        self.line_items = line_items
+
+    @classmethod
+    def desde_evento(cls, evento):
+        """Acepta el evento como dict o como StripeObject (backfill). ValueError si no trae sesión."""
+        try:
+            session = evento['data']['object']
+            detalles = session.get('customer_details') or {}
+            envio = session.get('shipping_details') or {}
+            addr = envio.get('address')
+
+            direccion = None
+            if addr:
+                direccion = {campo: addr.get(campo) for campo in _CAMPOS_DIRECCION}
+
+            # Si la sesión viene expandida con sus line items, nos ahorramos la llamada a Stripe
+            line_items = None
+            if session.get('line_items') and session['line_items'].get('data'):
+                line_items = []
+                for item in session['line_items']['data']:
+                    precio = item.get('price') or {}
+                    line_items.append({
+                        "description": item.get('description'),
+                        "price_id": precio.get('id'),
+                        "product_id": id_producto(precio),
+                    })
+
+            return cls(
+                event_id=evento.get('id'),
+                session_id=session.get('id'),
+                email=detalles.get('email'),
+                nombre=detalles.get('name'),
+                monto=(session.get('amount_total') or 0) / 100,
+                moneda=(session.get('currency') or 'usd').upper(),
+                direccion=direccion,
+                line_items=line_items,
+            )
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"El evento no trae una checkout.session válida: {e!r}")
+
+    def como_trabajo(self, nombre_tienda):
+        """El registro compacto y serializable en JSON que viaja por la cola hasta el worker."""
+        if not self.email:
+            raise ValueError("No se encontró email en los detalles de la sesión.")
+        return {
+            "event_id": self.event_id,
+            "session_id": self.session_id,
+            "email": self.email,
+            "nombre": self.nombre,
+            "monto": self.monto,
+            "moneda": self.moneda,
+            "direccion": self.direccion,
+            "line_items": self.line_items,
+            "tienda": nombre_tienda,
+            "intentos": 0,
+        }
+
+
+def leer_checkout_completado(payload, cabecera, secreto, tolerancia=TOLERANCIA_FIRMA):
+    """
+    Verifica la firma y, si el evento es checkout.session.completed, devuelve
+    su SesionCheckout; para cualquier otro tipo devuelve None.
+    Lanza FirmaInvalida si la firma no vale y ValueError si el cuerpo no es un evento válido.
+    """
+    verificar_firma(payload, cabecera, secreto, tolerancia)
+
+    # Comprobación exacta en negativo: un evento de este tipo lleva la cadena sí o sí
+    if _MARCA_CHECKOUT not in payload:
+        return None
+
+    evento = cargar_json(payload)
+    if not isinstance(evento, dict):
+        raise ValueError("El cuerpo no es un objeto JSON.")
+    if evento.get('type') != TIPO_CHECKOUT_COMPLETADO:
+        return None
+    return SesionCheckout.desde_evento(evento)
@@ -0,0 +1,159 @@
+# hashing.py
+#
+# El hash de la contraseña (scrypt/pbkdf2) es caro a propósito. Con HASH_PROCESOS
+# se puede calcular en un pool de procesos para no bloquear el hilo de la
+# petición (es trabajo de CPU, con hilos no se ganaría nada por el GIL).
+#
+# Por defecto se calcula en el propio hilo: en plataformas serverless no se
+# pueden crear procesos (ni los semáforos que usa multiprocessing), y si el
+# pool no se puede arrancar también se vuelve a calcular en el hilo.
+#
+# Variables de entorno (se leen en api/config.py):
+#   HASH_PERFIL         produccion | estandar | desarrollo   (coste del hash)
+#   HASH_PROCESOS       procesos del pool; 0 (por defecto) = calcular en el propio hilo
+#   HASH_MAX_PENDIENTES hashes en cola como máximo antes de rechazar
+#   HASH_ESPERA         segundos que se espera por un hueco en la cola
+
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+
+# Método de werkzeug para cada perfil. None = el método por defecto de werkzeug.
+PERFILES_HASH = {
+    "produccion": "scrypt:32768:8:1",
+    "estandar": None,
+    "desarrollo": "pbkdf2:sha256:20000",
+}
+
+
+class PoolHashingSaturado(RuntimeError):
+    """Hay demasiados hashes pendientes; mejor rechazar que acumular sin límite."""
+
+
+def metodo_de_perfil(perfil):
+    if perfil not in PERFILES_HASH:
+        raise ValueError(f"Perfil de hash desconocido: {perfil}. Opciones: {', '.join(PERFILES_HASH)}")
+    return PERFILES_HASH[perfil]
+
+
+def calcular_hash(password, metodo=None):
+    # Función de módulo para que se pueda enviar a otro proceso
+    if metodo is None:
+        return generate_password_hash(password)
+    return generate_password_hash(password, method=metodo)
+
+
+class PoolHashing:
+
+    def __init__(self, procesos=0, max_pendientes=None, perfil="estandar", espera=5.0, timeout=30.0, metodo=None):
+        # `metodo` (de werkzeug) manda sobre el perfil; solo para pruebas y benchmarks, que no quieren pagar el hash
+        self.procesos = procesos or 0
+        self.max_pendientes = max_pendientes or max(1, self.procesos) * 4
+        self.metodo = metodo_de_perfil(perfil) if metodo is None else metodo
+        self.espera = espera
+        self.timeout = timeout
+
+        self._ejecutor = None
+        self._ejecutor_lock = threading.Lock()
+        self._huecos = threading.BoundedSemaphore(self.max_pendientes)
+
+    def _obtener_ejecutor(self):
+        # Los procesos se arrancan la primera vez que hacen falta, no al importar
+        if self._ejecutor is None and self.procesos > 0:
+            with self._ejecutor_lock:
+                if self._ejecutor is None and self.procesos > 0:
+                    try:
+                        self._ejecutor = ProcessPoolExecutor(max_workers=self.procesos, mp_context=_contexto())
+                    except (OSError, NotImplementedError, ImportError) as e:
+                        print(f"-> AVISO: no se pudo crear el pool de hashing ({e}); se calcula en el propio hilo.")
+                        self.procesos = 0
+        return self._ejecutor
+
+    def usa_procesos(self):
+        """True si los hashes van al pool; False si se calculan en el hilo que los pide."""
+        return self._obtener_ejecutor() is not None
+
+    def enviar(self, password):
+        """
+        Encola el hash y devuelve un Future. Si la cola está llena más de
+        `espera` segundos, lanza PoolHashingSaturado (backpressure).
+        """
+        ejecutor = self._obtener_ejecutor()
+        if ejecutor is None:
+            futuro = Future()
+            futuro.set_result(calcular_hash(password, self.metodo))
+            return futuro
+
+        if not self._huecos.acquire(timeout=self.espera):
+            raise PoolHashingSaturado(f"Más de {self.max_pendientes} hashes pendientes.")
+        try:
+            futuro = ejecutor.submit(calcular_hash, password, self.metodo)
+        except Exception:
+            self._huecos.release()
+            raise
+        futuro.add_done_callback(lambda _: self._huecos.release())
+        return futuro
+
+    def generar_hash(self, password):
+        if not self.usa_procesos():
+            return calcular_hash(password, self.metodo)
+        return self.enviar(password).result(timeout=self.timeout)
+
+    def cerrar(self):
+        if self._ejecutor is not None:
+            self._ejecutor.shutdown(wait=True)
+            self._ejecutor = None
+
+
+def _contexto():
+    # No fork: copiar un proceso con hilos (pool SMTP, Redis) puede dejar locks cogidos para siempre
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+
+_pool_hashing = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool_hashing():
+    global _pool_hashing
+    if _pool_hashing is None:
+        with _pool_lock:
+            if _pool_hashing is None:
+                # Aquí y no arriba: los procesos del pool importan este módulo y no necesitan la configuración
+                from api.config import obtener_config
+                config = obtener_config()
+                _pool_hashing = PoolHashing(
+                    procesos=config.hash_procesos,
+                    max_pendientes=config.hash_max_pendientes,
+                    perfil=config.hash_perfil,
+                    espera=config.hash_espera,
+                )
+    return _pool_hashing
+
+
+def configurar_pool_hashing(pool):
+    """Cambia el pool del proceso (por ejemplo por uno con un método barato en las pruebas); None = el de la configuración."""
+    global _pool_hashing
+    with _pool_lock:
+        anterior, _pool_hashing = _pool_hashing, pool
+    if anterior is not None and anterior is not pool:
+        anterior.cerrar()
+
+
+def generar_hash_password(password):
+    return obtener_pool_hashing().generar_hash(password)
+
+
+async def generar_hash_password_async(password):
+    """Igual que generar_hash_password pero sin bloquear el bucle de asyncio."""
+    pool = obtener_pool_hashing()
+    if not pool.usa_procesos():
+        return await asyncio.to_thread(pool.generar_hash, password)
+    # enviar() puede esperar por un hueco (backpressure), así que va en un hilo
+    futuro = await asyncio.to_thread(pool.enviar, password)
+    return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=pool.timeout)
@@ -0,0 +1,140 @@
+# idempotencia.py
+#
+# Stripe reintenta los eventos si tardamos o devolvemos un error. Aquí guardamos
+# qué event.id ya hemos procesado para no mandar dos veces el mismo correo.
+#
+# Dos niveles:
+#   1. Una caché LRU en memoria con caducidad, para los reintentos rápidos.
+#   2. Una clave en Redis (SET NX con expiración), compartida entre workers.
+
+from api.cache import CacheLRU
+from api.config import obtener_config
+from api.resiliencia import obtener_circuito
+
+
+# Stripe reintenta durante unos 3 días; guardamos algo más por margen (IDEMPOTENCIA_TTL)
+TTL_EVENTO_HECHO = obtener_config().idempotencia_ttl
+# Si un worker muere procesando, a los pocos minutos otro puede volver a intentarlo
+TTL_EVENTO_EN_CURSO = obtener_config().idempotencia_ttl_en_curso
+
+NUEVO = "nuevo"
+EN_CURSO = "en_curso"
+HECHO = "hecho"
+
+
+_cache_local = CacheLRU(max_entradas=obtener_config().idempotencia_max_local, ttl=TTL_EVENTO_HECHO)
+
+
+def _clave_redis(event_id):
+    return f"stripe_evento:{event_id}"
+
+
+def _redis():
+    from api.mbp_user_manager import get_webhook_redis_client
+    return get_webhook_redis_client()
+
+
+def _redis_async():
+    from api.mbp_user_manager import get_webhook_redis_client_async
+    return get_webhook_redis_client_async()
+
+
+def reclamar_evento(event_id, r=None):
+    """
+    Intenta quedarse con el evento. Devuelve:
+        NUEVO    -> nadie lo ha procesado, adelante.
+        HECHO    -> ya se procesó, basta con responder 200.
+        EN_CURSO -> otro worker lo está procesando ahora mismo.
+    Si Redis no responde, solo se usa la caché local (mejor un posible
+    duplicado que perder el pedido).
+    """
+    if not event_id:
+        return NUEVO
+    if event_id in _cache_local:
+        return HECHO
+
+    try:
+        r = r or _redis()
+        # Con el circuito de Redis abierto no esperamos al timeout: caché local y adelante
+        if obtener_circuito("redis").llamar(r.set, _clave_redis(event_id), EN_CURSO, nx=True, ex=TTL_EVENTO_EN_CURSO):
+            return NUEVO
+
+        estado = r.get(_clave_redis(event_id))
+        if estado == HECHO:
+            _cache_local.añadir(event_id)
+            return HECHO
+        # La clave pudo caducar entre el SET y el GET
+        return EN_CURSO if estado else NUEVO
+    except Exception as e:
+        print(f"-> AVISO: no se pudo comprobar el evento {event_id} en Redis: {e}")
+        return NUEVO
+
+
+def marcar_evento_hecho(event_id, r=None):
+    if not event_id:
+        return
+    _cache_local.añadir(event_id)
+    try:
+        r = r or _redis()
+        r.set(_clave_redis(event_id), HECHO, ex=TTL_EVENTO_HECHO)
+    except Exception as e:
+        print(f"-> AVISO: no se pudo marcar el evento {event_id} como hecho en Redis: {e}")
+
+
+def liberar_evento(event_id, r=None):
+    """Si el procesado falla, soltamos el evento para que el reintento de Stripe entre."""
+    if not event_id:
+        return
+    _cache_local.quitar(event_id)
+    try:
+        r = r or _redis()
+        r.delete(_clave_redis(event_id))
+    except Exception as e:
+        print(f"-> AVISO: no se pudo liberar el evento {event_id} en Redis: {e}")
+
+
+# Lo mismo con redis.asyncio, para el webhook ASGI (api/webhook_asgi.py)
+
+async def reclamar_evento_async(event_id, r=None):
+    """Versión asyncio de reclamar_evento (mismos valores de retorno)."""
+    if not event_id:
+        return NUEVO
+    if event_id in _cache_local:
+        return HECHO
+
+    try:
+        r = r or _redis_async()
+        if await obtener_circuito("redis").llamar_async(r.set, _clave_redis(event_id), EN_CURSO, nx=True,
+                                                         ex=TTL_EVENTO_EN_CURSO):
+            return NUEVO
+
+        estado = await r.get(_clave_redis(event_id))
+        if estado == HECHO:
+            _cache_local.añadir(event_id)
+            return HECHO
+        return EN_CURSO if estado else NUEVO
+    except Exception as e:
+        print(f"-> AVISO: no se pudo comprobar el evento {event_id} en Redis: {e}")
+        return NUEVO
+
+
+async def marcar_evento_hecho_async(event_id, r=None):
+    if not event_id:
+        return
+    _cache_local.añadir(event_id)
+    try:
+        r = r or _redis_async()
+        await r.set(_clave_redis(event_id), HECHO, ex=TTL_EVENTO_HECHO)
+    except Exception as e:
+        print(f"-> AVISO: no se pudo marcar el evento {event_id} como hecho en Redis: {e}")
+
+
+async def liberar_evento_async(event_id, r=None):
+    if not event_id:
+        return
+    _cache_local.quitar(event_id)
+    try:
+        r = r or _redis_async()
+        await r.delete(_clave_redis(event_id))
+    except Exception as e:
+        print(f"-> AVISO: no se pudo liberar el evento {event_id} en Redis: {e}")
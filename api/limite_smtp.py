@@ -0,0 +1,191 @@
+# limite_smtp.py
+#
+# Límite de envíos por minuto de cada tienda, compartido por todos los
+# procesos a través de Redis (un cubo de fichas por tienda).
+#
+# El proveedor SMTP corta (y a veces banea un rato) si se pasa de N mensajes
+# por minuto. El cubo se rellena a SMTP_POR_MINUTO / 60 fichas por segundo
+# hasta SMTP_RAFAGA; cada correo gasta una. El despachador (api/despachador.py)
+# reclama del outbox tantos correos como fichas le dan, en el mismo script, y
+# el webhook solo envía en el acto si consigue ficha.
+#
+# Si el proveedor responde que frenemos (421/451), frenar() deja el cubo en
+# negativo y todos los procesos esperan a que se rellene.
+#
+# Claves:  limite_smtp:<tienda>   hash {fichas, ts}
+
+import time
+
+from api.metricas import contar
+from api.resiliencia import proteger, proteger_async
+
+
+PREFIJO_LIMITE = "limite_smtp:"
+
+# Función Lua que comparten los scripts que gastan fichas (este y el de
+# reclamar del outbox). Devuelve las fichas concedidas y cuánto falta, en
+# segundos, para la siguiente. Con tasa 0 no hay límite.
+LUA_FICHAS = """
+local function tomar_fichas(clave, tasa, capacidad, ahora, pedidas)
+    if tasa <= 0 then
+        return pedidas, 0
+    end
+    local cubo = redis.call('HMGET', clave, 'fichas', 'ts')
+    local fichas = tonumber(cubo[1]) or capacidad
+    local ts = tonumber(cubo[2]) or ahora
+    -- Con relojes algo desfasados entre máquinas, nunca se rellena hacia atrás
+    fichas = math.min(capacidad, fichas + math.max(0, ahora - ts) * tasa)
+
+    local concedidas = math.max(0, math.min(pedidas, math.floor(fichas)))
+    fichas = fichas - concedidas
+    redis.call('HSET', clave, 'fichas', tostring(fichas), 'ts', tostring(math.max(ahora, ts)))
+    redis.call('EXPIRE', clave, 3600)
+
+    local espera = 0
+    if concedidas < pedidas then
+        espera = (1 - fichas) / tasa
+    end
+    return concedidas, espera
+end
+
+local function devolver_fichas(clave, tasa, sobrantes)
+    if tasa > 0 and sobrantes > 0 then
+        redis.call('HINCRBYFLOAT', clave, 'fichas', sobrantes)
+    end
+end
+"""
+
+# KEYS[1] = cubo de la tienda; ARGV = tasa (fichas/s), capacidad, ahora, pedidas
+# Devuelve {concedidas, espera en ms} (Lua devuelve los números como enteros)
+SCRIPT_TOMAR = LUA_FICHAS + """
+local concedidas, espera = tomar_fichas(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]),
+                                        tonumber(ARGV[3]), tonumber(ARGV[4]))
+return {concedidas, math.ceil(espera * 1000)}
+"""
+
+
+# Devuelve fichas que se tomaron y no se usaron, sin pasar de la capacidad.
+# Si el cubo ya caducó no se crea: uno nuevo empieza lleno de todas formas.
+# KEYS[1] = cubo de la tienda; ARGV = fichas, capacidad
+SCRIPT_DEVOLVER = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local fichas = tonumber(redis.call('HGET', KEYS[1], 'fichas')) or 0
+    redis.call('HSET', KEYS[1], 'fichas', tostring(math.min(tonumber(ARGV[2]), fichas + tonumber(ARGV[1]))))
+end
+return 1
+"""
+
+
+def clave_limite(nombre_tienda):
+    return f"{PREFIJO_LIMITE}{nombre_tienda}"
+
+
+def parametros_limite(tienda):
+    """(fichas por segundo, capacidad) de la tienda; (0, 0) si no tiene límite."""
+    if not tienda.smtp_por_minuto:
+        return 0, 0
+    tasa = tienda.smtp_por_minuto / 60
+    # Sin ráfaga configurada se permiten unos 10 segundos de envíos seguidos
+    capacidad = tienda.smtp_rafaga or max(1, round(tasa * 10))
+    return tasa, capacidad
+
+
+class LimitadorSMTP:
+
+    def __init__(self, client):
+        self.r = client
+        self._tomar = client.register_script(SCRIPT_TOMAR)
+        self._devolver = client.register_script(SCRIPT_DEVOLVER)
+
+    def tomar(self, tienda, cantidad=1):
+        """Devuelve (fichas concedidas, segundos hasta la siguiente)."""
+        tasa, capacidad = parametros_limite(tienda)
+        if tasa <= 0:
+            return cantidad, 0.0
+        concedidas, espera_ms = proteger("redis", self._tomar, keys=[clave_limite(tienda.nombre)],
+                                         args=[tasa, capacidad, time.time(), cantidad])
+        if int(concedidas) < cantidad:
+            contar("envios_limitados")
+        return int(concedidas), int(espera_ms) / 1000
+
+    def devolver(self, tienda, cantidad=1):
+        """
+        Devuelve fichas que se tomaron para un envío que al final no se hizo.
+        Si Redis falla se deja estar: como mucho se pierde una ficha.
+        """
+        tasa, capacidad = parametros_limite(tienda)
+        if tasa <= 0:
+            return
+        try:
+            self._devolver(keys=[clave_limite(tienda.nombre)], args=[cantidad, capacidad])
+        except Exception as e:
+            print(f"-> AVISO: no se pudo devolver la ficha de envío de {tienda.nombre}: {e}")
+
+    def frenar(self, tienda, segundos):
+        """El proveedor pidió frenar: nadie envía hasta dentro de `segundos`."""
+        tasa, _ = parametros_limite(tienda)
+        if tasa <= 0:
+            return
+        print(f"-> AVISO: el SMTP de {tienda.nombre} pide frenar; pausa de {segundos:.0f}s.")
+        contar("smtp_frenados")
+        self.r.hset(clave_limite(tienda.nombre), mapping={"fichas": -tasa * segundos, "ts": time.time()})
+
+
+class LimitadorSMTPAsync:
+    """LimitadorSMTP con redis.asyncio, para el webhook ASGI. Mismos scripts y mismas claves."""
+
+    def __init__(self, client):
+        self.r = client
+        self._tomar = client.register_script(SCRIPT_TOMAR)
+        self._devolver = client.register_script(SCRIPT_DEVOLVER)
+
+    async def tomar(self, tienda, cantidad=1):
+        tasa, capacidad = parametros_limite(tienda)
+        if tasa <= 0:
+            return cantidad, 0.0
+        concedidas, espera_ms = await proteger_async("redis", self._tomar, keys=[clave_limite(tienda.nombre)],
+                                                     args=[tasa, capacidad, time.time(), cantidad])
+        if int(concedidas) < cantidad:
+            contar("envios_limitados")
+        return int(concedidas), int(espera_ms) / 1000
+
+    async def devolver(self, tienda, cantidad=1):
+        tasa, capacidad = parametros_limite(tienda)
+        if tasa <= 0:
+            return
+        try:
+            await self._devolver(keys=[clave_limite(tienda.nombre)], args=[cantidad, capacidad])
+        except Exception as e:
+            print(f"-> AVISO: no se pudo devolver la ficha de envío de {tienda.nombre}: {e}")
+
+    async def frenar(self, tienda, segundos):
+        tasa, _ = parametros_limite(tienda)
+        if tasa <= 0:
+            return
+        print(f"-> AVISO: el SMTP de {tienda.nombre} pide frenar; pausa de {segundos:.0f}s.")
+        contar("smtp_frenados")
+        await self.r.hset(clave_limite(tienda.nombre), mapping={"fichas": -tasa * segundos, "ts": time.time()})
+
+
+_limitador = None
+_limitador_async = None
+
+
+def obtener_limitador():
+    """El LimitadorSMTP del proceso (se rehace si cambia el cliente de Redis, p. ej. en pruebas)."""
+    global _limitador
+    from api.mbp_user_manager import get_webhook_redis_client
+    cliente = get_webhook_redis_client()
+    if _limitador is None or _limitador.r is not cliente:
+        _limitador = LimitadorSMTP(cliente)
+    return _limitador
+
+
+def obtener_limitador_async():
+    """El LimitadorSMTPAsync del proceso, sobre get_webhook_redis_client_async()."""
+    global _limitador_async
+    from api.mbp_user_manager import get_webhook_redis_client_async
+    cliente = get_webhook_redis_client_async()
+    if _limitador_async is None or _limitador_async.r is not cliente:
+        _limitador_async = LimitadorSMTPAsync(cliente)
+    return _limitador_async
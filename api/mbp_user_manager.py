@@ -1,117 +1,147 @@
 # mbp_user_manager.py
 
-import os
 import secrets
 import string
-import redis
+import threading
 from datetime import datetime
-from werkzeug.security import generate_password_hash
+
+from api.config import obtener_config
+
+
+# Cliente (y su pool de conexiones) compartido por todas las peticiones del
+# proceso. Se crea la primera vez que hace falta.
+_redis_cliente = None
+_redis_pool_lock = threading.Lock()
+# Cliente fijado a mano (por ejemplo fakeredis en los benchmarks)
+_cliente_redis_fijo = None
+# Lo mismo para redis.asyncio (variante ASGI del webhook)
+_redis_cliente_async = None
+_cliente_redis_async_fijo = None
+
+
+# Esquema de claves en Redis:
+#   cliente_mbp:<email>          hash con los datos del cliente (email, status,
+#                                created_at, password_hash...). El campo 'curso'
+#                                se mantiene como copia "A;B" para el portal.
+#   cliente_mbp_cursos:<email>   set con los cursos del cliente (lo que manda)
+#   curso_mbp:<CURSO>            set con los emails que tienen ese curso
+#   clientes_mbp_por_fecha       sorted set email -> created_at (timestamp)
+#
+# Así "quién tiene TIMON" es un SMEMBERS/SSCAN y las altas de un mes un
+# ZRANGEBYSCORE, sin recorrer todas las claves. Los clientes anteriores a este
+# esquema se pasan con `python -m api.migrar_cursos`.
+#
+# Con varias tiendas (api/tiendas.py) todas las claves llevan delante el
+# prefijo_redis de la tienda; la principal no lleva prefijo.
+PREFIJO_CLIENTE = "cliente_mbp:"
+PREFIJO_CURSOS_CLIENTE = "cliente_mbp_cursos:"
+PREFIJO_CURSO = "curso_mbp:"
+CLAVE_CLIENTES_POR_FECHA = "clientes_mbp_por_fecha"
 
 
 def get_webhook_redis_client():
     """
     Establece la conexión con la base de datos de Redis en el Webhook.
+    Todas las llamadas devuelven el mismo cliente (y su pool de conexiones).
     """
-    redis_url = os.environ.get("REDIS_URL") or os.environ.get("REDIS_USER")
-    if not redis_url:
-        raise ValueError("No se configuró la variable de entorno para conectar a Redis.")
-    return redis.from_url(redis_url, decode_responses=True)
-
-
-def registrar_cliente_con_password(email: str, curso: str) -> str:
-    """
-    Si el cliente ya existe en Redis:
-        - Mantiene su usuario y contraseña.
-        - Añade el nuevo curso al campo 'curso', separado por ';'.
-
-    Si el cliente no existe:
-        - Genera una contraseña nueva.
-        - Guarda el usuario en Redis.
-        - Retorna la contraseña plana para enviarla por correo.
-    """
-
-    email_normalizado = email.lower().strip()
-    curso_normalizado = curso.strip()
-    key = f"cliente_mbp:{email_normalizado}"
-
-    try:
-        # Conectar con Redis
-        r = get_webhook_redis_client()
+    global _redis_cliente
+    if _cliente_redis_fijo is not None:
+        return _cliente_redis_fijo
+
+    if _redis_cliente is None:
+        # redis se importa aquí y no arriba para no alargar el arranque en frío
+        import redis
+
+        with _redis_pool_lock:
+            if _redis_cliente is None:
+                config = obtener_config()
+                if not config.redis_url:
+                    raise ValueError("No se configuró la variable de entorno para conectar a Redis.")
+                # Con timeouts cortos un Redis caído falla pronto en vez de colgar la petición
+                pool = redis.ConnectionPool.from_url(
+                    config.redis_url, decode_responses=True,
+                    socket_timeout=config.redis_timeout,
+                    socket_connect_timeout=config.redis_timeout_conexion,
+                )
+                _redis_cliente = redis.Redis(connection_pool=pool)
+    return _redis_cliente
 
-        # ---------------------------------------------------------
-        # 1. COMPROBAR SI EL CLIENTE YA EXISTE
-        # ---------------------------------------------------------
-        if r.exists(key):
 
-            datos_existentes = r.hgetall(key)
+def configurar_cliente_redis(cliente):
+    """Hace que get_webhook_redis_client() devuelva siempre `cliente` (None lo deshace)."""
+    global _cliente_redis_fijo
+    _cliente_redis_fijo = cliente
 
-            curso_actual = datos_existentes.get("curso", "")
 
-            # Convertimos "MBP;TIMON" en una lista
-            cursos = [c.strip() for c in curso_actual.split(";") if c.strip()]
+def get_webhook_redis_client_async():
+    """
+    Cliente de redis.asyncio con su propio pool, el mismo en todas las llamadas.
+    Debe llamarse desde dentro del bucle de asyncio que lo va a usar.
+    """
+    global _redis_cliente_async
+    if _cliente_redis_async_fijo is not None:
+        return _cliente_redis_async_fijo
+
+    if _redis_cliente_async is None:
+        import redis.asyncio as redis_async
+
+        config = obtener_config()
+        if not config.redis_url:
+            raise ValueError("No se configuró la variable de entorno para conectar a Redis.")
+        pool = redis_async.ConnectionPool.from_url(
+            config.redis_url, decode_responses=True,
+            socket_timeout=config.redis_timeout,
+            socket_connect_timeout=config.redis_timeout_conexion,
+        )
+        _redis_cliente_async = redis_async.Redis(connection_pool=pool)
+    return _redis_cliente_async
 
-            # Añadir el nuevo curso solamente si todavía no lo tiene
-            if curso_normalizado not in cursos:
-                cursos.append(curso_normalizado)
 
-                nuevo_curso = ";".join(cursos)
+def configurar_cliente_redis_async(cliente):
+    """Como configurar_cliente_redis(), para get_webhook_redis_client_async()."""
+    global _cliente_redis_async_fijo
+    _cliente_redis_async_fijo = cliente
 
-                r.hset(key, "curso", nuevo_curso)
 
-                print(
-                    f"Cliente existente: {email_normalizado}. "
-                    f"Curso añadido: {curso_normalizado}. "
-                    f"Cursos actuales: {nuevo_curso}"
-                )
-            else:
+def generar_password_plana():
+    """Contraseña del portal para un cliente nuevo (va en claro en su correo de bienvenida)."""
+    caracteres = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(caracteres) for _ in range(8))
 
-                print(
-                    f"Cliente existente: {email_normalizado}. "
-                    f"Ya tiene el curso {curso_normalizado}."
-                )
 
-            # IMPORTANTE:
-            # No generamos una nueva contraseña.
-            # Devolvemos None porque el usuario ya tiene contraseña.
-            return None,1
+def datos_cliente_nuevo(email_normalizado, curso_normalizado, password_hash):
+    """Campos del hash cliente_mbp:<email> de un cliente nuevo; el alta la hace api/outbox.py."""
+    return {
+        "email": email_normalizado,
+        "curso": curso_normalizado,
+        "status": "activo",
+        "created_at": datetime.now().isoformat(),
+        "login_count": "0",
+        "password_hash": password_hash
+    }
 
-        # ---------------------------------------------------------
-        # 2. SI NO EXISTE, CREAR CLIENTE NUEVO
-        # ---------------------------------------------------------
 
-        # Generar contraseña en texto plano
-        caracteres = string.ascii_letters + string.digits
-        password_plana = ''.join(
-            secrets.choice(caracteres) for _ in range(8)
-        )
+# ---------------------------------------------------------
+# Consultas sobre los índices (campañas, auditorías...)
+# ---------------------------------------------------------
 
-        # Encriptar contraseña (hash)
-        password_hash = generate_password_hash(password_plana)
+def cursos_de_cliente(email: str, r=None, prefijo=""):
+    r = r or get_webhook_redis_client()
+    return r.smembers(f"{prefijo}{PREFIJO_CURSOS_CLIENTE}{email.lower().strip()}")
 
-        # Preparar la estructura
-        fecha_creacion = datetime.now().isoformat()
 
-        datos_usuario = {
-            "email": email_normalizado,
-            "curso": curso_normalizado,
-            "status": "activo",
-            "created_at": fecha_creacion,
-            "login_count": "0",
-            "password_hash": password_hash
-        }
+def clientes_con_curso(curso: str, r=None, prefijo=""):
+    """Emails con el curso, recorriendo el set con SSCAN (no bloquea Redis con sets grandes)."""
+    r = r or get_webhook_redis_client()
+    return r.sscan_iter(f"{prefijo}{PREFIJO_CURSO}{curso.strip()}", count=500)
 
-        # Guardar en Redis
-        r.hset(key, mapping=datos_usuario)
 
-        print(
-            f"Nuevo cliente creado: {email_normalizado}. "
-            f"Curso: {curso_normalizado}"
-        )
+def numero_clientes_con_curso(curso: str, r=None, prefijo=""):
+    r = r or get_webhook_redis_client()
+    return r.scard(f"{prefijo}{PREFIJO_CURSO}{curso.strip()}")
 
-        # Retornar contraseña en texto plano, portal_cliente=0 pues no existía
-        return password_plana, 0
 
-    except Exception as e:
-        print(f"Error al escribir el cliente en Redis: {e}")
-        #portal cliente=1 pues ya existía
-        return None, 0
\ No newline at end of file
+def clientes_creados_entre(desde: datetime, hasta: datetime, r=None, prefijo=""):
+    """Emails dados de alta en [desde, hasta), del más antiguo al más reciente."""
+    r = r or get_webhook_redis_client()
+    return r.zrangebyscore(f"{prefijo}{CLAVE_CLIENTES_POR_FECHA}", desde.timestamp(), f"({hasta.timestamp()}")
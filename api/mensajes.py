@@ -0,0 +1,152 @@
+# mensajes.py
+#
+# Montaje del correo de confirmación sin pasar por EmailMessage en cada pedido.
+#
+# De un pedido a otro solo cambian el destinatario y los huecos de la plantilla;
+# el resto (cabeceras From/Subject, estructura multipart, parte de texto y los
+# trozos literales del HTML ya codificados en quoted-printable) se calcula una
+# vez por plantilla y se guarda. Para cada pedido se codifican solo los valores
+# y se pegan los bytes, que van directos a sendmail (sin re-aplanar el mensaje).
+#
+# El truco para pegar trozos en quoted-printable: cada trozo termina en un
+# salto de línea "blando" (=\r\n), que al decodificar desaparece. Y la frontera
+# multipart empieza por "=_", que nunca aparece en un texto quoted-printable.
+
+import secrets
+import weakref
+import binascii
+import threading
+from email import policy
+from email.message import EmailMessage
+
+TEXTO_ALTERNATIVO = (
+    "Hemos recibido tu pago correctamente. Este correo se visualiza mejor en un cliente de correo moderno."
+)
+
+_SALTO_BLANDO = b"=\r\n"
+# 7bit para que las cabeceras con acentos salgan codificadas (=?utf-8?q?...?=)
+_POLITICA = policy.SMTP.clone(cte_type="7bit")
+
+
+def _cabecera(nombre, valor):
+    return _POLITICA.header_factory(nombre, valor).fold(policy=_POLITICA).encode("ascii")
+
+
+def codificar_qp(texto):
+    """Texto -> bytes quoted-printable con líneas CRLF de 76 caracteres como mucho."""
+    datos = texto.replace("\r\n", "\n").replace("\n", "\r\n").encode("utf-8")
+    # b2a_qp copia el salto de línea del texto; si no tiene ninguno (un valor
+    # largo de una sola línea) corta con "=\n", que SMTP no admite sin CR
+    return binascii.b2a_qp(datos, istext=True).replace(b"=\n", _SALTO_BLANDO)
+
+
+class MensajePreparado:
+    """Correo ya serializado: lo que PoolSMTP pasa tal cual a sendmail."""
+
+    __slots__ = ("remitente", "destinatarios", "datos")
+
+    def __init__(self, remitente, destinatarios, datos):
+        self.remitente = remitente
+        self.destinatarios = destinatarios
+        self.datos = datos
+
+    def as_bytes(self):
+        return self.datos
+
+
+class EsqueletoCorreo:
+    """
+    Lo invariable de los correos de un remitente: cabeceras comunes, frontera
+    multipart y parte de texto. Los trozos del HTML de cada plantilla se
+    codifican la primera vez que se usan y se guardan junto a la Plantilla.
+    """
+
+    def __init__(self, remitente, nombre_remitente, asunto, con_copia):
+        self.remitente = remitente
+        self.con_copia = con_copia
+        frontera = f"=_mcn_{secrets.token_hex(12)}".encode()
+
+        self._cabeceras = _cabecera("Subject", asunto) + _cabecera("From", f"{nombre_remitente} <{remitente}>")
+        self._copia = _cabecera("Cc", remitente) if con_copia else b""
+        self._estructura = (
+            b"MIME-Version: 1.0\r\n"
+            b'Content-Type: multipart/alternative; boundary="' + frontera + b'"\r\n'
+            b"\r\n"
+            b"--" + frontera + b"\r\n"
+            b'Content-Type: text/plain; charset="utf-8"\r\n'
+            b"Content-Transfer-Encoding: quoted-printable\r\n"
+            b"\r\n"
+            + codificar_qp(TEXTO_ALTERNATIVO + "\n") + b"\r\n"
+            b"--" + frontera + b"\r\n"
+            b'Content-Type: text/html; charset="utf-8"\r\n'
+            b"Content-Transfer-Encoding: quoted-printable\r\n"
+            b"\r\n"
+        )
+        self._cierre = b"\r\n--" + frontera + b"--\r\n"
+
+        self._trozos = weakref.WeakKeyDictionary()  # Plantilla -> partes en QP
+        self._lock = threading.Lock()
+
+    def _trozos_plantilla(self, plantilla):
+        # Si la plantilla se recarga (cambió el fichero) es otro objeto y se recalcula
+        trozos = self._trozos.get(plantilla)
+        if trozos is None:
+            partes = list(plantilla.partes)
+            # Como EmailMessage.set_content, el cuerpo termina siempre en salto de línea
+            if not partes[-1].endswith("\n"):
+                partes[-1] += "\n"
+            trozos = [
+                (None, codificar_qp(parte)) if i % 2 == 0 else (parte, None)
+                for i, parte in enumerate(partes)
+                if parte
+            ]
+            with self._lock:
+                self._trozos[plantilla] = trozos
+        return trozos
+
+    @staticmethod
+    def _cabecera_to(destinatario):
+        if "\r" in destinatario or "\n" in destinatario:
+            raise ValueError(f"Destinatario no válido: {destinatario!r}")
+        if destinatario.isascii() and not any(c in destinatario for c in ',"<>;'):
+            return b"To: " + destinatario.encode("ascii") + b"\r\n"
+        return _cabecera("To", destinatario)
+
+    def construir(self, plantilla, valores, destinatario):
+        plantilla.comprobar(valores)
+
+        partes = [self._cabeceras, self._cabecera_to(destinatario), self._copia, self._estructura]
+        html = []
+        for campo, literal in self._trozos_plantilla(plantilla):
+            html.append(literal if campo is None else codificar_qp(valores[campo]))
+        partes.append(_SALTO_BLANDO.join(html))
+        partes.append(self._cierre)
+
+        destinatarios = [destinatario, self.remitente] if self.con_copia else [destinatario]
+        return MensajePreparado(self.remitente, destinatarios, b"".join(partes))
+
+
+def construir_email_message(remitente, nombre_remitente, asunto, con_copia, destinatario, cuerpo_html):
+    """El montaje de siempre con EmailMessage (para comparar y como referencia)."""
+    msg = EmailMessage()
+    msg['Subject'] = asunto
+    msg['From'] = f"{nombre_remitente} <{remitente}>"
+    msg['To'] = destinatario
+    if con_copia:
+        msg['Cc'] = remitente
+    msg.set_content(TEXTO_ALTERNATIVO)
+    msg.add_alternative(cuerpo_html, subtype='html')
+    return msg
+
+
+_esqueletos = {}
+_lock_esqueletos = threading.Lock()
+
+
+def obtener_esqueleto(remitente, nombre_remitente, asunto, con_copia):
+    clave = (remitente, nombre_remitente, asunto, con_copia)
+    esqueleto = _esqueletos.get(clave)
+    if esqueleto is None:
+        with _lock_esqueletos:
+            esqueleto = _esqueletos.setdefault(clave, EsqueletoCorreo(*clave))
+    return esqueleto
@@ -0,0 +1,206 @@
+# metricas.py
+#
+# Medición ligera del webhook, pensada para dejarla activada en producción:
+#   - medir("etapa"): context manager que apunta cuánto tardó cada etapa
+#     (firma, productos, redis, hash_password, plantilla, smtp...) en un histograma.
+#   - contar("nombre"): contadores (correos enviados, fallidos, duplicados...).
+#   - fijar("nombre", valor): indicadores que suben y bajan (estado de un circuito...).
+#     Los dos admiten etiquetas: fijar("outbox", 3, tienda="principal", cola="pedidos")
+#     sale como webhook_outbox{cola="pedidos",tienda="principal"} 3. Lo que varía
+#     (tienda, cola, dependencia) va en etiquetas, nunca dentro del nombre.
+#   - evento(event_id): agrupa todo lo de un evento de Stripe y al terminar
+#     escribe UNA línea JSON con el event_id como identificador de correlación.
+#   - exportar_prometheus(): el texto que sirve el endpoint /metrics.
+
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Límites de los buckets en segundos (el último, +Inf, se añade al exportar)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        # Búsqueda lineal: son 12 buckets, más barato que bisect con su llamada
+        i = 0
+        for limite in self.buckets:
+            if valor <= limite:
+                break
+            i += 1
+        with self._lock:
+            self.cuentas[i] += 1
+            self.suma += valor
+            self.total += 1
+
+    def percentil(self, p):
+        """Aproximado: devuelve el límite del bucket donde cae el percentil."""
+        with self._lock:
+            cuentas, total = list(self.cuentas), self.total
+        if total == 0:
+            return 0.0
+        objetivo = p / 100 * total
+        acumulado = 0
+        for i, cuenta in enumerate(cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+_histogramas = {}   # etapa -> Histograma
+_contadores = {}    # (nombre, etiquetas) -> valor
+_indicadores = {}   # (nombre, etiquetas) -> valor
+_lock = threading.Lock()
+
+_evento_actual = contextvars.ContextVar("evento_actual", default=None)
+
+
+def _histograma(etapa):
+    h = _histogramas.get(etapa)
+    if h is None:
+        with _lock:
+            h = _histogramas.setdefault(etapa, Histograma())
+    return h
+
+
+def observar(etapa, segundos):
+    _histograma(etapa).observar(segundos)
+    datos = _evento_actual.get()
+    if datos is not None:
+        datos["etapas_ms"][etapa] = round(datos["etapas_ms"].get(etapa, 0) + segundos * 1000, 3)
+
+
+@contextmanager
+def medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(etapa, time.perf_counter() - inicio)
+
+
+def _clave(nombre, etiquetas):
+    # Ordenadas, para que el orden de los argumentos no cree dos series
+    return nombre, tuple(sorted(etiquetas.items()))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _texto_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in etiquetas) + "}"
+
+
+def contar(nombre, cantidad=1, **etiquetas):
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + cantidad
+
+
+def fijar(nombre, valor, **etiquetas):
+    with _lock:
+        _indicadores[_clave(nombre, etiquetas)] = valor
+
+
+def anotar(**campos):
+    """Añade campos a la línea JSON del evento en curso (si lo hay)."""
+    datos = _evento_actual.get()
+    if datos is not None:
+        datos.update(campos)
+
+
+@contextmanager
+def evento(event_id, **campos):
+    datos = {"event_id": event_id, "etapas_ms": {}}
+    datos.update(campos)
+    token = _evento_actual.set(datos)
+    inicio = time.perf_counter()
+    try:
+        yield datos
+    finally:
+        _evento_actual.reset(token)
+        datos["total_ms"] = round((time.perf_counter() - inicio) * 1000, 3)
+        observar("total", datos["total_ms"] / 1000)
+        sys.stdout.write(json.dumps(datos, ensure_ascii=False, default=str) + "\n")
+
+
+def instantanea():
+    """Copia de contadores e histogramas, útil para benchmarks. Las series con etiquetas van como en /metrics."""
+    with _lock:
+        contadores = {nombre + _texto_etiquetas(etiquetas): v for (nombre, etiquetas), v in _contadores.items()}
+        indicadores = {nombre + _texto_etiquetas(etiquetas): v for (nombre, etiquetas), v in _indicadores.items()}
+        histogramas = dict(_histogramas)
+    return {
+        "contadores": contadores,
+        "indicadores": indicadores,
+        "etapas": {
+            etapa: {
+                "total": h.total,
+                "media_ms": (h.suma / h.total * 1000) if h.total else 0.0,
+                "p50_ms": h.percentil(50) * 1000,
+                "p95_ms": h.percentil(95) * 1000,
+                "p99_ms": h.percentil(99) * 1000,
+            }
+            for etapa, h in histogramas.items()
+        },
+    }
+
+
+def reiniciar():
+    with _lock:
+        _histogramas.clear()
+        _contadores.clear()
+        _indicadores.clear()
+
+
+def exportar_prometheus():
+    lineas = []
+    with _lock:
+        contadores = sorted(_contadores.items())
+        indicadores = sorted(_indicadores.items())
+        histogramas = sorted(_histogramas.items())
+
+    # Un solo TYPE por métrica, con todas sus series debajo
+    anterior = None
+    for (nombre, etiquetas), valor in contadores:
+        if nombre != anterior:
+            lineas.append(f"# TYPE webhook_{nombre}_total counter")
+            anterior = nombre
+        lineas.append(f"webhook_{nombre}_total{_texto_etiquetas(etiquetas)} {valor}")
+
+    anterior = None
+    for (nombre, etiquetas), valor in indicadores:
+        if nombre != anterior:
+            lineas.append(f"# TYPE webhook_{nombre} gauge")
+            anterior = nombre
+        lineas.append(f"webhook_{nombre}{_texto_etiquetas(etiquetas)} {valor}")
+
+    lineas.append("# TYPE webhook_etapa_segundos histogram")
+    for etapa, h in histogramas:
+        with h._lock:
+            cuentas, suma, total = list(h.cuentas), h.suma, h.total
+        acumulado = 0
+        for limite, cuenta in zip(h.buckets, cuentas):
+            acumulado += cuenta
+            lineas.append(f'webhook_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+        lineas.append(f'webhook_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {total}')
+        lineas.append(f'webhook_etapa_segundos_sum{{etapa="{etapa}"}} {suma}')
+        lineas.append(f'webhook_etapa_segundos_count{{etapa="{etapa}"}} {total}')
+
+    return "\n".join(lineas) + "\n"
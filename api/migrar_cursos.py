@@ -0,0 +1,103 @@
+# migrar_cursos.py
+#
+# Pasa los clientes guardados con el esquema antiguo (cursos como "A;B" dentro
+# del hash cliente_mbp:<email>) a los índices nuevos:
+#   cliente_mbp_cursos:<email>, curso_mbp:<CURSO> y clientes_mbp_por_fecha
+# (ver el esquema en api/mbp_user_manager.py).
+#
+# Recorre las claves con SCAN y escribe por lotes con pipeline, así que no
+# bloquea Redis. Se puede relanzar sin problema: SADD y ZADD NX no duplican.
+#
+# Uso:
+#   python -m api.migrar_cursos --simulacion
+#   python -m api.migrar_cursos --lote 1000
+#   python -m api.migrar_cursos --tienda otra     # claves con el prefijo de esa tienda
+
+import argparse
+from datetime import datetime
+
+from api.mbp_user_manager import (
+    get_webhook_redis_client,
+    PREFIJO_CLIENTE,
+    PREFIJO_CURSOS_CLIENTE,
+    PREFIJO_CURSO,
+    CLAVE_CLIENTES_POR_FECHA,
+)
+from api.tiendas import obtener_tienda
+
+
+def _timestamp(created_at):
+    try:
+        return datetime.fromisoformat(created_at).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _migrar_lote(r, claves, simulacion, prefijo=""):
+    """Lee el lote de hashes en una ida y escribe sus índices en otra."""
+    lectura = r.pipeline(transaction=False)
+    for clave in claves:
+        lectura.hmget(clave, "email", "curso", "created_at")
+    datos = lectura.execute()
+
+    escritura = r.pipeline(transaction=False)
+    resumen = {"clientes": 0, "cursos": 0, "sin_fecha": 0}
+    for clave, (email, cursos, created_at) in zip(claves, datos):
+        email = (email or clave[len(prefijo + PREFIJO_CLIENTE):]).lower().strip()
+        lista_cursos = [c.strip() for c in (cursos or "").split(";") if c.strip()]
+
+        resumen["clientes"] += 1
+        resumen["cursos"] += len(lista_cursos)
+        if lista_cursos:
+            escritura.sadd(f"{prefijo}{PREFIJO_CURSOS_CLIENTE}{email}", *lista_cursos)
+        for curso in lista_cursos:
+            escritura.sadd(f"{prefijo}{PREFIJO_CURSO}{curso}", email)
+
+        timestamp = _timestamp(created_at)
+        if timestamp is None:
+            resumen["sin_fecha"] += 1
+        else:
+            escritura.zadd(f"{prefijo}{CLAVE_CLIENTES_POR_FECHA}", {email: timestamp}, nx=True)
+
+    if not simulacion:
+        escritura.execute()
+    return resumen
+
+
+def migrar(r=None, lote=500, simulacion=False, prefijo=""):
+    r = r or get_webhook_redis_client()
+    total = {"clientes": 0, "cursos": 0, "sin_fecha": 0}
+
+    claves = []
+    # _type="hash" deja fuera cualquier otra clave que empiece igual
+    for clave in r.scan_iter(match=f"{prefijo}{PREFIJO_CLIENTE}*", count=lote, _type="hash"):
+        claves.append(clave)
+        if len(claves) >= lote:
+            for campo, valor in _migrar_lote(r, claves, simulacion, prefijo).items():
+                total[campo] += valor
+            claves = []
+            print(f"-> {total['clientes']} clientes procesados...")
+
+    if claves:
+        for campo, valor in _migrar_lote(r, claves, simulacion, prefijo).items():
+            total[campo] += valor
+
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migra los cursos de los clientes a sets e índices en Redis.")
+    parser.add_argument("--lote", type=int, default=500, help="claves por SCAN y por pipeline")
+    parser.add_argument("--simulacion", action="store_true", help="lee y cuenta, pero no escribe nada")
+    parser.add_argument("--tienda", help="tienda de api/tiendas.py (por defecto la principal)")
+    args = parser.parse_args(argv)
+
+    prefijo = obtener_tienda(args.tienda).prefijo_redis
+    total = migrar(lote=args.lote, simulacion=args.simulacion, prefijo=prefijo)
+    etiqueta = "[SIMULACIÓN] " if args.simulacion else ""
+    print(f"-> {etiqueta}Migración terminada: {total['clientes']} clientes, {total['cursos']} cursos, "
+          f"{total['sin_fecha']} sin created_at válido (no entran en {CLAVE_CLIENTES_POR_FECHA}).")
+
+
+if __name__ == "__main__":
+    main()
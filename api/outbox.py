@@ -0,0 +1,597 @@
+# outbox.py
+#
+# Outbox de correos de confirmación en Redis.
+#
+# El alta del cliente en el portal y el correo que le corresponde se escriben
+# en el mismo script Lua: o quedan los dos o ninguno. Así un fallo del SMTP ya
+# no deja una cuenta creada con una contraseña que nadie recibió (y que un
+# reintento, al ver que el cliente ya existe, mandaría con la plantilla de
+# "ya tienes cuenta"). El correo guardado lleva la contraseña buena y se
+# reintenta tal cual hasta que sale.
+#
+# Claves (cada entrada dice además de qué tienda es):
+#   outbox_correos:entrada:<id>   hash con el correo ya serializado y su estado
+#   outbox_correos:pendientes:<tienda>:credenciales
+#   outbox_correos:pendientes:<tienda>:reintentos
+#   outbox_correos:pendientes:<tienda>:pedidos
+#                                 listas de ids por enviar, en ese orden: los
+#                                 correos con la contraseña de una cuenta nueva
+#                                 primero, luego los que vuelven de un reintento
+#   outbox_correos:procesando:<tienda>
+#                                 sorted set id -> hora límite de quien lo envía
+#   outbox_correos:programados:<tienda>
+#                                 sorted set id -> hora del siguiente reintento
+#   outbox_correos:fallidos       lista de ids que agotaron los intentos
+#   outbox_correos:sesion:<session_id>
+#                                 id de la entrada que ya lleva el correo de
+#                                 esa sesión de checkout
+#
+# El id es el event_id de Stripe: un reintento del mismo evento no vuelve a dar
+# de alta ni duplica el correo. Y como el backfill no tiene event_id (usa
+# backfill:<session_id>), cada sesión de checkout recuerda además qué entrada
+# la envió: una compra que ya tuvo su correo por el webhook no lo repite.
+# Una vez enviado, la entrada se queda unos días solo con su estado (sin el
+# correo, que lleva la contraseña en claro).
+#
+# Los envía api/despachador.py, al ritmo que permite el cupo de la tienda
+# (api/limite_smtp.py); el webhook además intenta mandarlo en el acto
+# (OUTBOX_ENVIO_INMEDIATO) si hay cupo y, si no, lo deja para el despachador.
+
+import json
+import time
+import secrets
+
+from api.config import obtener_config
+from api.hashing import generar_hash_password, generar_hash_password_async
+from api.mensajes import MensajePreparado
+from api.metricas import medir, contar, fijar
+from api.resiliencia import proteger, proteger_async
+from api.limite_smtp import LUA_FICHAS, clave_limite, parametros_limite
+from api.mbp_user_manager import (
+    get_webhook_redis_client,
+    get_webhook_redis_client_async,
+    generar_password_plana,
+    datos_cliente_nuevo,
+    PREFIJO_CLIENTE,
+    PREFIJO_CURSOS_CLIENTE,
+    PREFIJO_CURSO,
+    CLAVE_CLIENTES_POR_FECHA,
+)
+
+
+PREFIJO_ENTRADA = "outbox_correos:entrada:"
+PREFIJO_PENDIENTES = "outbox_correos:pendientes:"
+PREFIJO_SESION = "outbox_correos:sesion:"
+PREFIJO_PROCESANDO = "outbox_correos:procesando:"
+PREFIJO_PROGRAMADOS = "outbox_correos:programados:"
+CLAVE_FALLIDOS = "outbox_correos:fallidos"
+
+# Tiempo que tiene quien reclama un correo para confirmarlo; pasado ese plazo
+# se da por muerto y el correo vuelve a pendientes
+PLAZO_ENVIO = obtener_config().outbox_plazo_envio
+# Cuánto se guarda el estado de un correo ya enviado (para reconocer reintentos)
+CONSERVAR_ENVIADOS = obtener_config().outbox_conservar_enviados
+# Cuánto se recuerda qué entrada envió el correo de cada sesión de checkout
+CONSERVAR_SESIONES = obtener_config().outbox_conservar_sesiones
+
+DUPLICADO = "duplicado"
+EXISTENTE = "existente"
+NUEVO = "nuevo"
+
+# Colas de pendientes de cada tienda, de más a menos prioritaria
+PRIORIDADES = ("credenciales", "reintentos", "pedidos")
+
+
+def clave_entrada(id_entrada):
+    return f"{PREFIJO_ENTRADA}{id_entrada}"
+
+
+def clave_sesion(session_id):
+    return f"{PREFIJO_SESION}{session_id}"
+
+
+def clave_pendientes(nombre_tienda, prioridad):
+    return f"{PREFIJO_PENDIENTES}{nombre_tienda}:{prioridad}"
+
+
+def clave_procesando(nombre_tienda):
+    return f"{PREFIJO_PROCESANDO}{nombre_tienda}"
+
+
+def clave_programados(nombre_tienda):
+    return f"{PREFIJO_PROGRAMADOS}{nombre_tienda}"
+
+
+# Alta del cliente (con todos los cursos de la compra, ver el esquema de claves
+# en api/mbp_user_manager.py) y entrada del outbox en una sola ida a Redis.
+#   KEYS = cliente, cursos del cliente, clientes por fecha, entrada, pendientes
+#          de pedidos, pendientes de credenciales, procesando, sesión de
+#          checkout, y un set curso_mbp:<CURSO> por curso
+#   ARGV[1] = email, ARGV[2] = created_at (timestamp), ARGV[3] = id de la entrada
+#   ARGV[4] = hora límite si quien escribe lo va a enviar en el acto ('' si no)
+#   ARGV[5] = correo si el cliente ya existe, ARGV[6] = correo con credenciales
+#   ARGV[7] = segundos que se recuerda la sesión ('' si el correo no es de una sesión)
+#   ARGV[8] = n.º de cursos, y a continuación los cursos
+#   luego el n.º de valores de la entrada, sus campo, valor... y el resto son
+#   campo, valor... del cliente nuevo (opcional)
+# Devuelve {existia, cursos}: existia = -1 si la entrada ya estaba y -2 si la
+# sesión ya tuvo su correo con otra entrada (devuelve esa; no se toca nada), y
+# {0, ""} si el cliente no existe y no nos pasan sus datos, igual que el
+# script de alta: el hash de la contraseña solo se calcula si hace falta.
+SCRIPT_ALTA_CON_CORREO = """
+local key, key_cursos, key_fechas = KEYS[1], KEYS[2], KEYS[3]
+local key_entrada, key_pedidos, key_credenciales, key_procesando = KEYS[4], KEYS[5], KEYS[6], KEYS[7]
+local key_sesion = KEYS[8]
+local email, ts, id, limite, ttl_sesion = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[7]
+local n = tonumber(ARGV[8])
+local inicio_entrada = 10 + n
+local fin_entrada = inicio_entrada + tonumber(ARGV[9 + n]) - 1
+
+if redis.call('EXISTS', key_entrada) == 1 then
+    return {-1, ''}
+end
+if ttl_sesion ~= '' then
+    local previa = redis.call('GET', key_sesion)
+    if previa then
+        return {-2, previa}
+    end
+end
+
+local existia = 1
+local actual = ''
+if n > 0 then
+    if redis.call('EXISTS', key) == 1 then
+        actual = redis.call('HGET', key, 'curso') or ''
+
+        -- Cliente de antes del esquema con sets: su set sale del campo 'curso'
+        if redis.call('EXISTS', key_cursos) == 0 then
+            for c in string.gmatch(actual, '([^;]+)') do
+                c = string.match(c, '^%s*(.-)%s*$')
+                if c ~= '' then
+                    redis.call('SADD', key_cursos, c)
+                end
+            end
+        end
+
+        local cambia = false
+        for i = 1, n do
+            local curso = ARGV[8 + i]
+            redis.call('SADD', KEYS[8 + i], email)
+            if redis.call('SADD', key_cursos, curso) == 1 then
+                if actual ~= '' then
+                    actual = actual .. ';' .. curso
+                else
+                    actual = curso
+                end
+                cambia = true
+            end
+        end
+        if cambia then
+            redis.call('HSET', key, 'curso', actual)
+        end
+    else
+        if #ARGV == fin_entrada then
+            return {0, ''}
+        end
+        existia = 0
+        redis.call('HSET', key, unpack(ARGV, fin_entrada + 1))
+        for i = 1, n do
+            redis.call('SADD', key_cursos, ARGV[8 + i])
+            redis.call('SADD', KEYS[8 + i], email)
+        end
+        redis.call('ZADD', key_fechas, ts, email)
+        actual = redis.call('HGET', key, 'curso')
+    end
+end
+
+if fin_entrada >= inicio_entrada then
+    redis.call('HSET', key_entrada, unpack(ARGV, inicio_entrada, fin_entrada))
+end
+if existia == 1 then
+    redis.call('HSET', key_entrada, 'datos', ARGV[5], 'credenciales', '0')
+else
+    redis.call('HSET', key_entrada, 'datos', ARGV[6], 'credenciales', '1')
+end
+redis.call('HSET', key_entrada, 'estado', 'pendiente', 'intentos', '0')
+if ttl_sesion ~= '' then
+    redis.call('SET', key_sesion, id, 'EX', ttl_sesion)
+end
+
+if limite ~= '' then
+    -- Quien lo escribe lo va a enviar ya; si no lo confirma a tiempo vuelve a la cola
+    redis.call('ZADD', key_procesando, limite, id)
+elseif existia == 1 then
+    redis.call('LPUSH', key_pedidos, id)
+else
+    redis.call('LPUSH', key_credenciales, id)
+end
+return {existia, actual}
+"""
+
+# Reclama correos de una tienda para enviarlos: tantos como pida quien llama
+# y permita el cupo de la tienda, primero los de credenciales. Antes pasa a la
+# cola de reintentos los que ya esperaron su retraso y los que alguien reclamó
+# y no confirmó a tiempo (se murió o se colgó). Solo toca claves de la tienda,
+# todas declaradas en KEYS; el contenido de las entradas se lee después.
+#   KEYS = pendientes de credenciales, de reintentos y de pedidos, procesando,
+#          programados, cubo de fichas de la tienda
+#   ARGV = ahora, hora límite para confirmar, cantidad, fichas/s, capacidad del cubo
+# Devuelve {espera en ms hasta la siguiente ficha, {id, ...}}
+SCRIPT_RECLAMAR = LUA_FICHAS + """
+local credenciales, reintentos, pedidos = KEYS[1], KEYS[2], KEYS[3]
+local procesando, programados, cubo = KEYS[4], KEYS[5], KEYS[6]
+local ahora, limite, cantidad = tonumber(ARGV[1]), ARGV[2], tonumber(ARGV[3])
+local tasa, capacidad = tonumber(ARGV[4]), tonumber(ARGV[5])
+
+for _, origen in ipairs({programados, procesando}) do
+    for _, id in ipairs(redis.call('ZRANGEBYSCORE', origen, '-inf', ahora, 'LIMIT', 0, cantidad)) do
+        redis.call('ZREM', origen, id)
+        redis.call('RPUSH', reintentos, id)
+    end
+end
+
+local concedidas, espera = tomar_fichas(cubo, tasa, capacidad, ahora, cantidad)
+local reclamadas = {}
+for _, cola in ipairs({credenciales, reintentos, pedidos}) do
+    local faltan = concedidas - #reclamadas
+    if faltan > 0 then
+        local ids = redis.call('RPOP', cola, faltan)
+        if ids then
+            for _, id in ipairs(ids) do
+                redis.call('ZADD', procesando, limite, id)
+                table.insert(reclamadas, id)
+            end
+        end
+    end
+end
+devolver_fichas(cubo, tasa, concedidas - #reclamadas)
+return {math.ceil(espera * 1000), reclamadas}
+"""
+
+_script_alta = None
+_script_alta_async = None
+
+
+def nuevo_id():
+    """Id para correos que no vienen de un evento de Stripe."""
+    return f"manual:{secrets.token_hex(8)}"
+
+
+def campos_entrada(mensaje, tienda, pedido=None):
+    """Lo que guarda la entrada además del correo: remitente, destinatarios, tienda y pedido."""
+    campos = {
+        "tienda": tienda.nombre,
+        "remitente": mensaje.remitente,
+        "destinatarios": json.dumps(mensaje.destinatarios),
+        "creado": time.time(),
+    }
+    if pedido is not None:
+        campos["pedido"] = json.dumps(pedido, ensure_ascii=False)
+    return campos
+
+
+def mensaje_de_entrada(entrada):
+    """Vuelve a montar el MensajePreparado guardado en una entrada del outbox."""
+    return MensajePreparado(entrada['remitente'], json.loads(entrada['destinatarios']),
+                            entrada['datos'].encode('ascii'))
+
+
+def _claves_alta(email, cursos, id_entrada, tienda, id_sesion=None):
+    prefijo = tienda.prefijo_redis
+    claves = [
+        f"{prefijo}{PREFIJO_CLIENTE}{email}",
+        f"{prefijo}{PREFIJO_CURSOS_CLIENTE}{email}",
+        f"{prefijo}{CLAVE_CLIENTES_POR_FECHA}",
+        clave_entrada(id_entrada),
+        clave_pendientes(tienda.nombre, "pedidos"),
+        clave_pendientes(tienda.nombre, "credenciales"),
+        clave_procesando(tienda.nombre),
+        clave_sesion(id_sesion or id_entrada),
+    ]
+    return claves + [f"{prefijo}{PREFIJO_CURSO}{curso}" for curso in cursos]
+
+
+def _argumentos_alta(email, cursos, id_entrada, id_sesion, campos, mensaje, inmediato, mensaje_nuevo=None,
+                     datos_cliente=None):
+    # Los correos preparados son ASCII (cabeceras codificadas y cuerpo en quoted-printable)
+    argumentos = [
+        email, time.time(), id_entrada,
+        time.time() + PLAZO_ENVIO if inmediato else "",
+        mensaje.datos.decode("ascii"),
+        mensaje_nuevo.datos.decode("ascii") if mensaje_nuevo is not None else "",
+        CONSERVAR_SESIONES if id_sesion else "",
+        len(cursos), *cursos,
+        len(campos) * 2,
+    ]
+    for campo, valor in campos.items():
+        argumentos.extend([campo, valor])
+    if datos_cliente:
+        for campo, valor in datos_cliente.items():
+            argumentos.extend([campo, valor])
+    return argumentos
+
+
+def _normalizar(email, cursos):
+    # Sin repetidos y en el orden de la compra
+    return email.lower().strip(), list(dict.fromkeys(curso.strip() for curso in cursos))
+
+
+def _resultado(id_entrada, email, existia, actuales, cursos):
+    if existia == -1:
+        print(f"-> El correo de {id_entrada} ya estaba en el outbox, no se repite.")
+        contar("outbox_duplicados")
+        return DUPLICADO
+    if existia == -2:
+        print(f"-> La sesión de {id_entrada} ya tuvo su correo ({actuales}), no se repite.")
+        contar("outbox_duplicados")
+        return DUPLICADO
+    if existia == 0:
+        print(f"Nuevo cliente creado: {email}. Curso: {actuales}")
+        contar("clientes_nuevos")
+        return NUEVO
+    if cursos:
+        print(f"Cliente existente: {email}. Cursos actuales: {actuales}")
+        contar("clientes_existentes")
+    return EXISTENTE
+
+
+def encolar_confirmacion(id_entrada, tienda, campos, mensaje, renderizar_nuevo=None, email=None, cursos=(),
+                         inmediato=False, r=None, id_sesion=None):
+    """
+    Da de alta al cliente con los `cursos` de la compra (si hay alguno) y deja
+    su correo en el outbox, todo en un mismo script.
+
+    `mensaje` es el correo para un cliente que ya existe (o para una compra sin
+    cuenta en el portal). Si el cliente es nuevo se genera su contraseña y se
+    llama a renderizar_nuevo(password_plana) para el correo con credenciales.
+
+    Con inmediato=True la entrada queda ya reclamada por quien llama, que debe
+    enviarla y confirmarla (o reprogramarla) antes de PLAZO_ENVIO.
+
+    `id_sesion` es el session_id de Stripe: si esa sesión ya dejó su correo con
+    otro id (el webhook y luego un backfill), el resultado es DUPLICADO.
+
+    `tienda` (api/tiendas.py) pone el prefijo de las claves del cliente y la
+    cola de pendientes (la de credenciales si el cliente es nuevo).
+
+    Devuelve (resultado, mensaje guardado): resultado es NUEVO, EXISTENTE o
+    DUPLICADO (la entrada o la sesión ya existían; el mensaje es None y no se
+    toca nada).
+    Si Redis falla, el error se propaga (DependenciaCaida si no responde).
+    """
+    global _script_alta
+    r = r or get_webhook_redis_client()
+    if _script_alta is None:
+        _script_alta = r.register_script(SCRIPT_ALTA_CON_CORREO)
+    email, cursos = _normalizar(email or "", cursos)
+    claves = _claves_alta(email, cursos, id_entrada, tienda, id_sesion)
+
+    def llamar(mensaje_nuevo=None, datos_cliente=None):
+        argumentos = _argumentos_alta(email, cursos, id_entrada, id_sesion, campos, mensaje, inmediato,
+                                      mensaje_nuevo, datos_cliente)
+        with medir("redis"):
+            existia, actuales = proteger("redis", _script_alta, keys=claves, args=argumentos, client=r)
+        return int(existia), actuales
+
+    try:
+        existia, actuales = llamar()
+        mensaje_nuevo = None
+        if existia == 0:
+            password_plana = generar_password_plana()
+            with medir("hash_password"):
+                password_hash = generar_hash_password(password_plana)
+            mensaje_nuevo = renderizar_nuevo(password_plana)
+            # Si otra compra lo creó mientras calculábamos el hash, el script
+            # se queda con el correo de cliente existente
+            existia, actuales = llamar(mensaje_nuevo, datos_cliente_nuevo(email, ";".join(cursos), password_hash))
+    except Exception as e:
+        print(f"Error al escribir el cliente y su correo en Redis: {e}")
+        contar("errores_redis")
+        raise
+
+    resultado = _resultado(id_entrada, email, existia, actuales, cursos)
+    if resultado == DUPLICADO:
+        return resultado, None
+    return resultado, mensaje_nuevo if resultado == NUEVO else mensaje
+
+
+async def encolar_confirmacion_async(r, id_entrada, tienda, campos, mensaje, renderizar_nuevo=None, email=None,
+                                     cursos=(), inmediato=False, id_sesion=None):
+    """Versión asyncio de encolar_confirmacion (mismo script, mismos valores de retorno)."""
+    global _script_alta_async
+    if _script_alta_async is None:
+        _script_alta_async = r.register_script(SCRIPT_ALTA_CON_CORREO)
+    email, cursos = _normalizar(email or "", cursos)
+    claves = _claves_alta(email, cursos, id_entrada, tienda, id_sesion)
+
+    async def llamar(mensaje_nuevo=None, datos_cliente=None):
+        argumentos = _argumentos_alta(email, cursos, id_entrada, id_sesion, campos, mensaje, inmediato,
+                                      mensaje_nuevo, datos_cliente)
+        with medir("redis"):
+            existia, actuales = await proteger_async("redis", _script_alta_async, keys=claves, args=argumentos,
+                                                     client=r)
+        return int(existia), actuales
+
+    try:
+        existia, actuales = await llamar()
+        mensaje_nuevo = None
+        if existia == 0:
+            password_plana = generar_password_plana()
+            with medir("hash_password"):
+                password_hash = await generar_hash_password_async(password_plana)
+            mensaje_nuevo = renderizar_nuevo(password_plana)
+            existia, actuales = await llamar(mensaje_nuevo,
+                                             datos_cliente_nuevo(email, ";".join(cursos), password_hash))
+    except Exception as e:
+        print(f"Error al escribir el cliente y su correo en Redis: {e}")
+        contar("errores_redis")
+        raise
+
+    resultado = _resultado(id_entrada, email, existia, actuales, cursos)
+    if resultado == DUPLICADO:
+        return resultado, None
+    return resultado, mensaje_nuevo if resultado == NUEVO else mensaje
+
+
+# Las escrituras de después del envío, compartidas por OutboxCorreos y
+# OutboxCorreosAsync: encolan en el pipeline y el que llama lo ejecuta
+
+def _pipe_confirmar(pipe, tienda, id_entrada):
+    clave = clave_entrada(id_entrada)
+    pipe.zrem(clave_procesando(tienda.nombre), id_entrada)
+    pipe.hdel(clave, "datos")
+    pipe.hset(clave, mapping={"estado": "enviado", "enviado": time.time()})
+    pipe.expire(clave, CONSERVAR_ENVIADOS)
+    return pipe
+
+
+def _pipe_reprogramar(pipe, tienda, id_entrada, retraso, campos):
+    if campos:
+        pipe.hset(clave_entrada(id_entrada), mapping=campos)
+    pipe.zadd(clave_programados(tienda.nombre), {id_entrada: time.time() + retraso})
+    pipe.zrem(clave_procesando(tienda.nombre), id_entrada)
+    return pipe
+
+
+def _pipe_mover_a_fallidos(pipe, tienda, id_entrada, campos):
+    pipe.hset(clave_entrada(id_entrada), mapping={"estado": "fallido", **campos})
+    pipe.lpush(CLAVE_FALLIDOS, id_entrada)
+    pipe.zrem(clave_procesando(tienda.nombre), id_entrada)
+    return pipe
+
+
+class OutboxCorreos:
+    """
+    Lado del envío del outbox: reclamar correos, confirmarlos y reprogramar o
+    apartar los que fallan. Misma idea que ColaRedis (api/cola_envios.py),
+    pero por lotes, por tienda y con prioridades.
+    """
+
+    def __init__(self, client):
+        self.r = client
+        self._reclamar = client.register_script(SCRIPT_RECLAMAR)
+
+    def reclamar(self, tienda, cantidad=20, plazo=PLAZO_ENVIO):
+        """
+        Hasta `cantidad` correos de la tienda, los de credenciales primero y sin
+        pasarse de su cupo. Devuelve ([(id, entrada)], segundos hasta que
+        vuelva a haber cupo; 0 si no se quedó corto).
+        """
+        ahora = time.time()
+        tasa, capacidad = parametros_limite(tienda)
+        nombre = tienda.nombre
+        espera_ms, ids = self._reclamar(
+            keys=[clave_pendientes(nombre, "credenciales"), clave_pendientes(nombre, "reintentos"),
+                  clave_pendientes(nombre, "pedidos"), clave_procesando(nombre), clave_programados(nombre),
+                  clave_limite(nombre)],
+            args=[ahora, ahora + plazo, cantidad, tasa, capacidad],
+        )
+        if not ids:
+            return [], int(espera_ms) / 1000
+
+        pipe = self.r.pipeline(transaction=False)
+        for id_entrada in ids:
+            pipe.hgetall(clave_entrada(id_entrada))
+        entradas = []
+        for id_entrada, entrada in zip(ids, pipe.execute()):
+            if entrada.get('datos'):
+                entradas.append((id_entrada, entrada))
+            else:
+                # Sin correo (caducó o se borró a mano) no hay nada que enviar
+                self.r.zrem(clave_procesando(nombre), id_entrada)
+        return entradas, int(espera_ms) / 1000
+
+    def confirmar(self, tienda, id_entrada):
+        """Marca el correo como enviado y borra su contenido (lleva la contraseña en claro)."""
+        _pipe_confirmar(self.r.pipeline(), tienda, id_entrada).execute()
+
+    def reprogramar(self, tienda, id_entrada, retraso, **campos):
+        """Vuelve a intentarlo dentro de `retraso` segundos; `campos` (intentos, ultimo_error...) van a la entrada."""
+        _pipe_reprogramar(self.r.pipeline(), tienda, id_entrada, retraso, campos).execute()
+
+    def devolver(self, tienda, entradas):
+        """Devuelve correos reclamados y sin intentar al principio de su cola, sin gastar intento."""
+        pipe = self.r.pipeline()
+        for id_entrada, entrada in entradas:
+            prioridad = "credenciales" if entrada.get('credenciales') == '1' else "pedidos"
+            pipe.rpush(clave_pendientes(tienda.nombre, prioridad), id_entrada)
+            pipe.zrem(clave_procesando(tienda.nombre), id_entrada)
+        pipe.execute()
+
+    def mover_a_fallidos(self, tienda, id_entrada, **campos):
+        _pipe_mover_a_fallidos(self.r.pipeline(), tienda, id_entrada, campos).execute()
+
+    def fallidos(self):
+        return self.r.lrange(CLAVE_FALLIDOS, 0, -1)
+
+    def profundidad_por_cola(self, tiendas):
+        """{(tienda, cola): correos esperando}, en una sola ida a Redis. Los fallidos son de todas (tienda None)."""
+        pipe = self.r.pipeline(transaction=False)
+        colas = []
+        for tienda in tiendas:
+            for prioridad in PRIORIDADES:
+                pipe.llen(clave_pendientes(tienda.nombre, prioridad))
+                colas.append((tienda.nombre, prioridad))
+            pipe.zcard(clave_programados(tienda.nombre))
+            colas.append((tienda.nombre, "programados"))
+            pipe.zcard(clave_procesando(tienda.nombre))
+            colas.append((tienda.nombre, "procesando"))
+        pipe.llen(CLAVE_FALLIDOS)
+        colas.append((None, "fallidos"))
+        return dict(zip(colas, pipe.execute()))
+
+    def profundidad(self, tiendas):
+        """Correos esperando en cada cola ({"<tienda>_<cola>": n, "fallidos": n}), para los logs."""
+        return _por_nombre(self.profundidad_por_cola(tiendas))
+
+    def publicar_profundidad(self, tiendas):
+        """Deja la profundidad de las colas en /metrics (webhook_outbox{tienda="…",cola="…"})."""
+        por_cola = self.profundidad_por_cola(tiendas)
+        for (tienda, cola), valor in por_cola.items():
+            if tienda:
+                fijar("outbox", valor, tienda=tienda, cola=cola)
+            else:
+                fijar("outbox", valor, cola=cola)
+        return _por_nombre(por_cola)
+
+
+def _por_nombre(por_cola):
+    return {f"{tienda}_{cola}" if tienda else cola: valor for (tienda, cola), valor in por_cola.items()}
+
+
+class OutboxCorreosAsync:
+    """Lo que hace el webhook ASGI tras su envío inmediato, con redis.asyncio."""
+
+    def __init__(self, client):
+        self.r = client
+
+    async def confirmar(self, tienda, id_entrada):
+        await _pipe_confirmar(self.r.pipeline(), tienda, id_entrada).execute()
+
+    async def reprogramar(self, tienda, id_entrada, retraso, **campos):
+        await _pipe_reprogramar(self.r.pipeline(), tienda, id_entrada, retraso, campos).execute()
+
+    async def mover_a_fallidos(self, tienda, id_entrada, **campos):
+        await _pipe_mover_a_fallidos(self.r.pipeline(), tienda, id_entrada, campos).execute()
+
+
+_outbox = None
+_outbox_async = None
+
+
+def obtener_outbox():
+    """El OutboxCorreos del proceso (se rehace si cambia el cliente de Redis, p. ej. en pruebas)."""
+    global _outbox
+    cliente = get_webhook_redis_client()
+    if _outbox is None or _outbox.r is not cliente:
+        _outbox = OutboxCorreos(cliente)
+    return _outbox
+
+
+def obtener_outbox_async():
+    """El OutboxCorreosAsync del proceso, sobre get_webhook_redis_client_async()."""
+    global _outbox_async
+    cliente = get_webhook_redis_client_async()
+    if _outbox_async is None or _outbox_async.r is not cliente:
+        _outbox_async = OutboxCorreosAsync(cliente)
+    return _outbox_async
@@ -0,0 +1,120 @@
+# plantillas.py
+
+import os
+import re
+import threading
+from pathlib import Path
+
+
+# Carpeta raíz del proyecto, donde viven los correo_template*.html
+BASE_DIR = Path(__file__).parent.parent
+
+PATRON_HUECO = re.compile(r"\{\{([A-Z_]+)\}\}")
+
+CAMPOS_PEDIDO = {"NOMBRE_CLIENTE", "MONTO_PAGO", "DIRECCION_ENTREGA", "NOMBRE_PRODUCTO"}
+CAMPOS_CREDENCIALES = CAMPOS_PEDIDO | {"CORREO_ACCESO", "PASSWORD_PLANA"}
+
+# Campos que el código rellena para cada plantilla. Si una plantilla usa un hueco
+# que no está aquí, falla al cargarla en vez de llegar sin rellenar al cliente.
+CAMPOS_POR_PLANTILLA = {
+    "correo_template.html": CAMPOS_PEDIDO,
+    "correo_template_simple.html": CAMPOS_PEDIDO,
+    "correo_template_metodo.html": CAMPOS_CREDENCIALES,
+    "correo_template_metodo_cexiste.html": CAMPOS_PEDIDO,
+    "correo_template_timon.html": CAMPOS_CREDENCIALES,
+    "correo_template_timon_cexiste.html": CAMPOS_PEDIDO,
+}
+
+
+class Plantilla:
+    """
+    Plantilla ya troceada en partes literales y huecos {{CAMPO}}.
+    Renderizar es un único join, sin pasadas de str.replace sobre todo el HTML.
+    """
+
+    def __init__(self, nombre, texto, campos_disponibles=None):
+        self.nombre = nombre
+
+        # re.split con grupo devuelve [literal, campo, literal, campo, ..., literal]
+        self._partes = PATRON_HUECO.split(texto)
+        self._huecos = [(i, self._partes[i]) for i in range(1, len(self._partes), 2)]
+        self.campos = {campo for _, campo in self._huecos}
+
+        if campos_disponibles is not None:
+            no_cubiertos = self.campos - set(campos_disponibles)
+            if no_cubiertos:
+                raise ValueError(
+                    f"La plantilla {nombre} usa campos que nadie rellena: {', '.join(sorted(no_cubiertos))}"
+                )
+
+    @property
+    def partes(self):
+        """[literal, campo, literal, campo, ..., literal], tal como las partió re.split."""
+        return self._partes
+
+    def comprobar(self, valores):
+        faltan = [campo for campo in self.campos if valores.get(campo) is None]
+        if faltan:
+            raise ValueError(f"Faltan valores para la plantilla {self.nombre}: {', '.join(sorted(faltan))}")
+
+    def renderizar(self, valores):
+        self.comprobar(valores)
+
+        partes = self._partes.copy()
+        for i, campo in self._huecos:
+            partes[i] = valores[campo]
+        return "".join(partes)
+
+
+class RegistroPlantillas:
+    """
+    Guarda en memoria las plantillas ya troceadas.
+    Se cargan una vez (precargar) o la primera vez que se piden, y se vuelven a
+    leer solo si el fichero cambia de fecha de modificación.
+    """
+
+    def __init__(self, directorio=BASE_DIR, campos_por_plantilla=None, comprobar_cambios=True):
+        self.directorio = Path(directorio)
+        self.campos_por_plantilla = CAMPOS_POR_PLANTILLA if campos_por_plantilla is None else campos_por_plantilla
+        self.comprobar_cambios = comprobar_cambios
+        self._cache = {}  # nombre -> (mtime, Plantilla)
+        self._lock = threading.Lock()
+
+    def _cargar(self, nombre, mtime):
+        ruta = self.directorio / nombre
+        with open(ruta, 'r', encoding='utf-8') as f:
+            texto = f.read()
+        plantilla = Plantilla(nombre, texto, self.campos_por_plantilla.get(nombre))
+        with self._lock:
+            self._cache[nombre] = (mtime, plantilla)
+        return plantilla
+
+    def obtener(self, nombre):
+        en_cache = self._cache.get(nombre)
+        if en_cache is not None and not self.comprobar_cambios:
+            return en_cache[1]
+
+        mtime = os.stat(self.directorio / nombre).st_mtime_ns
+        if en_cache is not None and en_cache[0] == mtime:
+            return en_cache[1]
+        return self._cargar(nombre, mtime)
+
+    def precargar(self, nombres=None):
+        """Carga (y valida) todas las plantillas de golpe, pensado para el arranque."""
+        for nombre in nombres or self.campos_por_plantilla:
+            self._cargar(nombre, os.stat(self.directorio / nombre).st_mtime_ns)
+
+    def renderizar(self, nombre, valores):
+        return self.obtener(nombre).renderizar(valores)
+
+
+_registros = {}  # carpeta -> RegistroPlantillas
+
+
+def obtener_registro_plantillas(tienda=None):
+    """Registro de la carpeta de plantillas de la tienda (None -> la raíz del proyecto)."""
+    directorio = Path(tienda.plantillas) if tienda is not None else BASE_DIR
+    registro = _registros.get(directorio)
+    if registro is None:
+        registro = _registros.setdefault(directorio, RegistroPlantillas(directorio))
+    return registro
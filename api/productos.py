@@ -0,0 +1,56 @@
+# productos.py
+#
+# Averigua qué productos hay en una compra:
+#   1. Si el evento ya trae los line items con su descripción (sesión
+#      expandida, p. ej. una exportación para el backfill), se usan tal cual.
+#   2. Si no, se llama a list_line_items.
+#
+# Los checkout.session.completed que manda Stripe no traen line items, así
+# que en el webhook lo normal es el paso 2. No hay caché: nada del evento
+# identifica los productos (un Payment Link se puede editar en Stripe y admite
+# cantidades y productos opcionales), y una caché por price_id solo serviría
+# para eventos que ya traen los line items.
+
+from api.resiliencia import proteger
+from api.tiendas import obtener_tienda
+
+
+class ResolutorProductos:
+
+    def __init__(self, cliente_stripe, tienda=None):
+        self.cliente_stripe = cliente_stripe
+        self.tienda = tienda
+
+    def resolver(self, trabajo):
+        """
+        Devuelve la lista de line items ({'description', 'price_id', 'product_id'}) de la compra.
+        """
+        # 1. Line items que venían en el propio evento
+        items = trabajo.get('line_items')
+        if items and all(item.get('description') for item in items):
+            return items
+
+        # 2. La API de Stripe
+        return proteger("stripe", self.cliente_stripe.listar_line_items, trabajo['session_id'], limit=5,
+                        tienda=self.tienda)
+
+
+# Uno por tienda: cada una con el cliente de su cuenta de Stripe
+_resolutores = {}
+
+
+def obtener_resolutor_productos(tienda=None):
+    tienda = tienda or obtener_tienda()
+    resolutor = _resolutores.get(tienda.nombre)
+    if resolutor is None:
+        from api.cliente_stripe import ClienteStripe
+        resolutor = _resolutores.setdefault(
+            tienda.nombre, ResolutorProductos(ClienteStripe(tienda.stripe_secret_key), tienda=tienda))
+    return resolutor
+
+
+def configurar_cliente_stripe(cliente_stripe, tienda=None):
+    """Cambia el cliente de Stripe de la tienda (por ejemplo por ClienteStripeFalso)."""
+    tienda = tienda or obtener_tienda()
+    resolutor = _resolutores[tienda.nombre] = ResolutorProductos(cliente_stripe, tienda=tienda)
+    return resolutor
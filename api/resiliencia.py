@@ -0,0 +1,274 @@
+# resiliencia.py
+#
+# Protección común para las dependencias externas (stripe, redis, smtp):
+#   - Un cortocircuito (circuit breaker) por dependencia: tras N fallos seguidos
+#     se abre y durante un rato las llamadas fallan al momento, sin esperar al
+#     timeout de conexión. Pasado ese rato deja pasar una llamada de prueba.
+#     SMTP y Stripe son de cada tienda (su servidor, su clave), así que tienen
+#     un circuito por tienda: que falle el de una no corta a las demás. Redis
+#     es compartido y tiene uno solo.
+#   - Reintentos acotados con backoff exponencial y aleatoriedad. Dentro de
+#     una petición del webhook (en_peticion()) no se reintenta por defecto
+#     (RESILIENCIA_REINTENTOS_PETICION=0): con los timeouts de SMTP, Redis y
+#     Stripe, unos pocos reintentos ya superan lo que espera Stripe. Se falla
+#     rápido y reintentan el worker y el despachador, que no tienen prisa.
+#
+# Cuando una dependencia no responde se lanza DependenciaCaida; el webhook la
+# usa para mandar el evento por el camino diferido (la cola) en vez de enviar
+# un correo a medias.
+#
+# Los cambios de estado quedan en /metrics, con la dependencia (y la tienda) como etiquetas:
+#   webhook_circuito_transiciones_total{dependencia="smtp",tienda="…",estado="abierto"}
+#   webhook_circuito_estado{dependencia="smtp",tienda="…"}   (0 cerrado, 1 semiabierto, 2 abierto)
+#   webhook_circuito_rechazadas_total{...}, webhook_reintentos_total{dependencia="…"}
+
+import time
+import random
+import asyncio
+import smtplib
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from api.config import obtener_config
+from api.metricas import contar, fijar
+
+
+CERRADO = "cerrado"
+SEMIABIERTO = "semiabierto"
+ABIERTO = "abierto"
+
+_VALOR_ESTADO = {CERRADO: 0, SEMIABIERTO: 1, ABIERTO: 2}
+
+
+class DependenciaCaida(Exception):
+    """La dependencia no respondió tras los reintentos, o su circuito está abierto."""
+
+    def __init__(self, dependencia, mensaje):
+        super().__init__(f"{dependencia}: {mensaje}")
+        self.dependencia = dependencia
+
+
+class CircuitoAbierto(DependenciaCaida):
+    pass
+
+
+def calcular_retraso(intentos, base=2.0, maximo=300.0):
+    """Backoff exponencial con algo de aleatoriedad para no reintentar todos a la vez."""
+    retraso = min(maximo, base * (2 ** (intentos - 1)))
+    return retraso * random.uniform(0.5, 1.0)
+
+
+class Circuito:
+
+    def __init__(self, nombre, umbral_fallos=5, segundos_abierto=30.0, ignorar=(ValueError,), etiquetas=None):
+        self.nombre = nombre
+        # Etiquetas de sus métricas; por defecto la dependencia es el nombre
+        self.etiquetas = etiquetas or {"dependencia": nombre}
+        self.umbral_fallos = umbral_fallos
+        self.segundos_abierto = segundos_abierto
+        # Errores que son culpa de la petición y no de la dependencia
+        self.ignorar = ignorar
+
+        self.estado = CERRADO
+        self.fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+        fijar("circuito_estado", _VALOR_ESTADO[CERRADO], **self.etiquetas)
+
+    def _cambiar(self, estado):
+        # Se llama con el lock cogido
+        if estado == self.estado:
+            return
+        self.estado = estado
+        contar("circuito_transiciones", estado=estado, **self.etiquetas)
+        fijar("circuito_estado", _VALOR_ESTADO[estado], **self.etiquetas)
+        print(f"-> Circuito {self.nombre}: {estado}")
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si ahora no se debe llamar a la dependencia."""
+        with self._lock:
+            if self.estado == CERRADO:
+                return
+            if self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.segundos_abierto:
+                self._cambiar(SEMIABIERTO)
+            # En semiabierto solo pasa una llamada de prueba a la vez
+            if self.estado == SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+        contar("circuito_rechazadas", **self.etiquetas)
+        raise CircuitoAbierto(self.nombre, "circuito abierto")
+
+    def exito(self):
+        with self._lock:
+            self.fallos = 0
+            self._prueba_en_curso = False
+            self._cambiar(CERRADO)
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self._prueba_en_curso = False
+            if self.estado == SEMIABIERTO or self.fallos >= self.umbral_fallos:
+                self._abierto_desde = time.monotonic()
+                self._cambiar(ABIERTO)
+
+    def _es_fallo(self, error):
+        return not isinstance(error, self.ignorar)
+
+    def llamar(self, func, *args, **kwargs):
+        self.permitir()
+        try:
+            resultado = func(*args, **kwargs)
+        except Exception as e:
+            if self._es_fallo(e):
+                self.fallo()
+            else:
+                self.exito()
+            raise
+        self.exito()
+        return resultado
+
+    async def llamar_async(self, func, *args, **kwargs):
+        self.permitir()
+        try:
+            resultado = await func(*args, **kwargs)
+        except Exception as e:
+            if self._es_fallo(e):
+                self.fallo()
+            else:
+                self.exito()
+            raise
+        self.exito()
+        return resultado
+
+
+# Errores que no abren el circuito de cada dependencia. En SMTP, las respuestas
+# a un mensaje concreto (rechazos y aplazamientos 4xx) no se reintentan al
+# momento: las reprograma el despachador del outbox.
+IGNORAR_POR_DEPENDENCIA = {
+    "smtp": (ValueError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError),
+}
+
+
+def _ignorar(nombre):
+    ignorar = IGNORAR_POR_DEPENDENCIA.get(nombre, (ValueError,))
+    if nombre == "redis":
+        # Un error de Redis a la orden (un script Lua que falla, un tipo que no
+        # corresponde) se repite igual: no es que Redis esté caído
+        try:
+            from redis.exceptions import ResponseError
+        except ImportError:
+            return ignorar
+        ignorar += (ResponseError,)
+    if nombre == "smtp":
+        # El lote (api/correo_lotes.py) pudo mandar ya el correo: repetirlo aquí lo duplicaría
+        from api.smtp_pool import EnvioIncierto
+        ignorar += (EnvioIncierto,)
+        # Los mismos rechazos en aiosmtplib (webhook ASGI), que no hereda de
+        # smtplib. Se importa aquí para no cargarlo en el arranque si no se usa
+        try:
+            import aiosmtplib
+        except ImportError:
+            return ignorar
+        ignorar += (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientRefused,
+                    aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError)
+    return ignorar
+
+# Dependencias que son de cada tienda
+POR_TIENDA = {"smtp", "stripe"}
+
+_circuitos = {}
+_lock_circuitos = threading.Lock()
+
+
+def obtener_circuito(nombre, tienda=None, **opciones):
+    """El circuito de la dependencia; el de `tienda` si la dependencia es de cada tienda."""
+    clave = (nombre, tienda.nombre) if tienda is not None and nombre in POR_TIENDA else nombre
+    circuito = _circuitos.get(clave)
+    if circuito is None:
+        with _lock_circuitos:
+            circuito = _circuitos.get(clave)
+            if circuito is None:
+                config = obtener_config()
+                opciones.setdefault("umbral_fallos", config.circuito_umbral)
+                opciones.setdefault("segundos_abierto", config.circuito_segundos_abierto)
+                opciones.setdefault("ignorar", _ignorar(nombre))
+                if isinstance(clave, str):
+                    circuito = Circuito(nombre, **opciones)
+                else:
+                    circuito = Circuito(f"{nombre}_{tienda.nombre}", etiquetas={"dependencia": nombre,
+                                                                               "tienda": tienda.nombre}, **opciones)
+                _circuitos[clave] = circuito
+    return circuito
+
+
+def estados_circuitos():
+    return {c.nombre: c.estado for c in _circuitos.values()}
+
+
+# Reintentos dentro de la petición en curso (None fuera de una petición)
+_reintentos_peticion = contextvars.ContextVar("reintentos_peticion", default=None)
+
+
+@contextmanager
+def en_peticion():
+    """Lo que se llame dentro usa RESILIENCIA_REINTENTOS_PETICION en vez de RESILIENCIA_REINTENTOS."""
+    token = _reintentos_peticion.set(obtener_config().reintentos_peticion)
+    try:
+        yield
+    finally:
+        _reintentos_peticion.reset(token)
+
+
+def _reintentos(reintentos, config):
+    if reintentos is not None:
+        return reintentos
+    en_curso = _reintentos_peticion.get()
+    return config.reintentos if en_curso is None else en_curso
+
+
+def proteger(dependencia, func, *args, reintentos=None, tienda=None, **kwargs):
+    """
+    Llama a func a través del circuito de `dependencia` (el de `tienda`, en
+    SMTP y Stripe), reintentando los fallos de la dependencia. Los errores de
+    la propia petición (los que el circuito ignora) se propagan tal cual; el
+    resto acaba en DependenciaCaida.
+    """
+    circuito = obtener_circuito(dependencia, tienda)
+    config = obtener_config()
+    reintentos = _reintentos(reintentos, config)
+
+    for intento in range(1, reintentos + 2):
+        try:
+            return circuito.llamar(func, *args, **kwargs)
+        except DependenciaCaida:
+            raise
+        except Exception as e:
+            if not circuito._es_fallo(e):
+                raise
+            if intento > reintentos:
+                raise DependenciaCaida(dependencia, e) from e
+            contar("reintentos", dependencia=dependencia)
+            time.sleep(calcular_retraso(intento, config.reintento_base, config.reintento_maximo))
+
+
+async def proteger_async(dependencia, func, *args, reintentos=None, tienda=None, **kwargs):
+    """Como proteger(), para corrutinas."""
+    circuito = obtener_circuito(dependencia, tienda)
+    config = obtener_config()
+    reintentos = _reintentos(reintentos, config)
+
+    for intento in range(1, reintentos + 2):
+        try:
+            return await circuito.llamar_async(func, *args, **kwargs)
+        except DependenciaCaida:
+            raise
+        except Exception as e:
+            if not circuito._es_fallo(e):
+                raise
+            if intento > reintentos:
+                raise DependenciaCaida(dependencia, e) from e
+            contar("reintentos", dependencia=dependencia)
+            await asyncio.sleep(calcular_retraso(intento, config.reintento_base, config.reintento_maximo))
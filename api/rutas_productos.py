@@ -0,0 +1,122 @@
+# rutas_productos.py
+#
+# Tabla que decide, para cada producto comprado, qué curso se da de alta en el
+# portal y qué plantilla de correo se envía. Para un producto nuevo basta con
+# añadir aquí una Ruta; no hay que tocar webhook.py.
+#
+# Un producto encaja con una ruta por su price_id, su product_id o por alguna
+# palabra clave de su descripción (sin distinguir mayúsculas ni tildes).
+
+import re
+import unicodedata
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Ruta:
+    nombre: str
+    plantilla: str
+    curso: str = None                   # código del curso en el portal (None = sin portal)
+    plantilla_existente: str = None     # plantilla si el cliente ya tenía cuenta
+    palabras: tuple = ()
+    price_ids: tuple = ()
+    product_ids: tuple = ()
+
+    @property
+    def cuenta_portal(self):
+        return self.curso is not None
+
+
+# El orden importa: si una compra encaja con varias rutas, la primera que da
+# acceso al portal decide la plantilla (y si ninguna lo da, la primera a secas).
+RUTAS = (
+    Ruta(
+        nombre="antioxidante",
+        plantilla="correo_template.html",
+        palabras=("ANTIOXIDANTE",),
+    ),
+    Ruta(
+        nombre="metodo_barrera",  # METODO BARRERA PRIMERO
+        plantilla="correo_template_metodo.html",
+        plantilla_existente="correo_template_metodo_cexiste.html",
+        curso="MBP",
+        palabras=("BARRERA",),
+    ),
+    Ruta(
+        nombre="reto_timon",  # RETO TIMON 21 DIAS
+        plantilla="correo_template_timon.html",
+        plantilla_existente="correo_template_timon_cexiste.html",
+        curso="TIMON",
+        palabras=("TIMON",),
+    ),
+)
+
+RUTA_POR_DEFECTO = Ruta(nombre="simple", plantilla="correo_template_simple.html")
+
+
+def normalizar(texto):
+    """Mayúsculas y sin tildes: 'Timón' -> 'TIMON'."""
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).upper()
+
+
+class TablaRutas:
+    """
+    Compila la tabla una sola vez: los IDs van a diccionarios y todas las
+    palabras clave a una única expresión regular, así cada descripción se
+    recorre una vez sea cual sea el número de rutas.
+    """
+
+    def __init__(self, rutas=RUTAS, por_defecto=RUTA_POR_DEFECTO):
+        self.rutas = tuple(rutas)
+        self.por_defecto = por_defecto
+        self._orden = {ruta.nombre: i for i, ruta in enumerate(self.rutas)}
+
+        self._por_precio = {}
+        self._por_producto = {}
+        self._por_palabra = {}
+        for ruta in self.rutas:
+            for price_id in ruta.price_ids:
+                self._por_precio[price_id] = ruta
+            for product_id in ruta.product_ids:
+                self._por_producto[product_id] = ruta
+            for palabra in ruta.palabras:
+                self._por_palabra[normalizar(palabra)] = ruta
+
+        # Las palabras largas primero, para que no las tape una más corta
+        palabras = sorted(self._por_palabra, key=len, reverse=True)
+        self._patron = re.compile("|".join(re.escape(p) for p in palabras)) if palabras else None
+
+    def rutas_de_item(self, item):
+        if item.get('price_id') in self._por_precio:
+            return {self._por_precio[item['price_id']]}
+        if item.get('product_id') in self._por_producto:
+            return {self._por_producto[item['product_id']]}
+        if self._patron is None:
+            return set()
+        return {self._por_palabra[m.group(0)] for m in self._patron.finditer(normalizar(item.get('description')))}
+
+    def clasificar(self, line_items):
+        """
+        Devuelve todas las rutas de la compra, sin repetir. La primera es la
+        principal (la que elige la plantilla del correo).
+        """
+        encontradas = set()
+        for item in line_items:
+            encontradas |= self.rutas_de_item(item)
+
+        if not encontradas:
+            return [self.por_defecto]
+
+        # Primero las que dan acceso al portal, y dentro de cada grupo el orden de la tabla
+        return sorted(encontradas, key=lambda r: (not r.cuenta_portal, self._orden[r.nombre]))
+
+
+_tabla = None
+
+
+def obtener_tabla_rutas():
+    global _tabla
+    if _tabla is None:
+        _tabla = TablaRutas()
+    return _tabla
@@ -0,0 +1,329 @@
+# smtp_pool.py
+
+import ssl
+import time
+import asyncio
+import smtplib
+import threading
+
+from api.config import obtener_config
+from api.mensajes import MensajePreparado
+from api.tiendas import obtener_tienda
+
+
+def codigos_smtp(error):
+    """Códigos de respuesta SMTP de un error de smtplib o aiosmtplib ([] si no trae)."""
+    destinatarios = getattr(error, "recipients", None)
+    if isinstance(destinatarios, dict):  # smtplib: {destinatario: (código, mensaje)}
+        return [codigo for codigo, _ in destinatarios.values()]
+    if isinstance(destinatarios, list):  # aiosmtplib: [SMTPRecipientRefused, ...]
+        return [getattr(d, "code", None) for d in destinatarios]
+    codigo = getattr(error, "smtp_code", None) or getattr(error, "code", None)
+    return [codigo] if isinstance(codigo, int) else []
+
+
+def es_aplazamiento(error):
+    """Respuesta 4xx: el servidor no lo rechaza, pide que se vuelva a intentar más tarde."""
+    codigos = codigos_smtp(error)
+    return bool(codigos) and all(isinstance(c, int) and 400 <= c < 500 for c in codigos)
+
+
+class EnvioIncierto(Exception):
+    """
+    Se dejó de esperar a un correo que ya se estaba enviando: no se sabe si
+    salió. `futuro` se resuelve cuando se sepa.
+    """
+
+    def __init__(self, mensaje, futuro):
+        super().__init__(mensaje)
+        self.futuro = futuro
+
+
+# Fallos de la sesión con el servidor y no de un mensaje concreto; smtplib y
+# aiosmtplib usan los mismos nombres (aiosmtplib no hereda de smtplib)
+_ERRORES_CONEXION = {"SMTPConnectError", "SMTPHeloError", "SMTPAuthenticationError", "SMTPServerDisconnected",
+                     "SMTPTimeoutError"}
+
+
+def es_fallo_de_conexion(error):
+    """El servidor no está disponible (sin conexión, sin sesión, login); un 5xx a un mensaje no lo es."""
+    if any(tipo.__name__ in _ERRORES_CONEXION for tipo in type(error).__mro__):
+        return True
+    return not codigos_smtp(error)
+
+
+class PoolSMTP:
+    """
+    Pool de conexiones SMTP_SSL ya autenticadas, una instancia por proceso.
+
+    - Reutiliza las sesiones abiertas (comprobándolas con NOOP antes de usarlas).
+    - Si el servidor cerró la conexión, abre otra y vuelve a hacer login.
+    - Nunca tiene más de `max_conexiones` abiertas a la vez, para no chocar con
+      el límite de conexiones del proveedor.
+    """
+
+    def __init__(self, servidor, puerto, usuario, password, max_conexiones=2,
+                 max_inactividad=60, timeout=30, usar_ssl=True):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.max_inactividad = max_inactividad
+        self.timeout = timeout
+        self.usar_ssl = usar_ssl
+
+        self._contexto = ssl.create_default_context()
+        self._libres = []  # lista de (conexion, momento_ultimo_uso)
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(max_conexiones)
+
+    def _conectar(self):
+        if self.usar_ssl:
+            server = smtplib.SMTP_SSL(self.servidor, self.puerto, context=self._contexto, timeout=self.timeout)
+        else:
+            # Solo para servidores locales de pruebas (SMTP_SSL=0)
+            server = smtplib.SMTP(self.servidor, self.puerto, timeout=self.timeout)
+        server.login(self.usuario, self.password)
+        return server
+
+    @staticmethod
+    def _cerrar(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _sigue_viva(server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    @staticmethod
+    def _enviar_uno(server, mensaje):
+        # Los MensajePreparado ya son bytes listos: nada que aplanar
+        if isinstance(mensaje, MensajePreparado):
+            server.sendmail(mensaje.remitente, mensaje.destinatarios, mensaje.datos)
+        else:
+            server.send_message(mensaje)
+
+    def _adquirir(self):
+        self._semaforo.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._libres:
+                        break
+                    server, ultimo_uso = self._libres.pop()
+
+                # Las que llevan mucho paradas casi seguro las cerró el servidor
+                if time.monotonic() - ultimo_uso < self.max_inactividad and self._sigue_viva(server):
+                    return server
+                self._cerrar(server)
+
+            return self._conectar()
+        except Exception:
+            self._semaforo.release()
+            raise
+
+    def _liberar(self, server, reutilizable=True):
+        try:
+            if reutilizable:
+                with self._lock:
+                    self._libres.append((server, time.monotonic()))
+            else:
+                self._cerrar(server)
+        finally:
+            self._semaforo.release()
+
+    def enviar_lote(self, mensajes):
+        """
+        Envía los mensajes por una sola sesión y devuelve, para cada uno, None
+        si salió bien o la excepción con la que falló. Un destinatario
+        rechazado no corta el lote; si la conexión se cae a mitad, reconecta
+        una vez y sigue por donde iba.
+        """
+        resultados = [None] * len(mensajes)
+        i = 0
+        reintentado = False
+        server = self._adquirir()
+        try:
+            while i < len(mensajes):
+                try:
+                    self._enviar_uno(server, mensajes[i])
+                except smtplib.SMTPServerDisconnected:
+                    if reintentado:
+                        raise
+                    reintentado = True
+                    self._cerrar(server)
+                    server = self._conectar()
+                    continue
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    resultados[i] = e
+                    i += 1
+                    # Tras un 421 el servidor ya cerró y el RSET falla: así el error que queda es el bueno
+                    server.rset()
+                    continue
+                i += 1
+        except Exception as e:
+            self._liberar(server, reutilizable=False)
+            for j in range(i, len(mensajes)):
+                resultados[j] = e
+            return resultados
+
+        self._liberar(server)
+        return resultados
+
+    def enviar_varios(self, mensajes):
+        """
+        Envía una lista de mensajes (EmailMessage o MensajePreparado) por una sola sesión.
+        Lanza el primer error que haya; si no, devuelve cuántos mensajes se enviaron.
+        """
+        for error in self.enviar_lote(mensajes):
+            if error is not None:
+                raise error
+        return len(mensajes)
+
+    def enviar(self, mensaje):
+        return self.enviar_varios([mensaje]) == 1
+
+    def cerrar_todo(self):
+        with self._lock:
+            libres, self._libres = self._libres, []
+        for server, _ in libres:
+            self._cerrar(server)
+
+
+class PoolSMTPAsync:
+    """
+    Igual que PoolSMTP pero con aiosmtplib, para la variante asyncio del webhook.
+    """
+
+    def __init__(self, servidor, puerto, usuario, password, max_conexiones=2,
+                 max_inactividad=60, timeout=30, usar_ssl=True):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.max_inactividad = max_inactividad
+        self.timeout = timeout
+        self.usar_ssl = usar_ssl
+
+        self._libres = []  # lista de (conexion, momento_ultimo_uso)
+        self._semaforo = asyncio.Semaphore(max_conexiones)
+
+    async def _conectar(self):
+        import aiosmtplib
+
+        server = aiosmtplib.SMTP(hostname=self.servidor, port=self.puerto, use_tls=self.usar_ssl,
+                                 start_tls=False, timeout=self.timeout)
+        await server.connect()
+        await server.login(self.usuario, self.password)
+        return server
+
+    @staticmethod
+    async def _cerrar(server):
+        try:
+            await server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    async def _sigue_viva(server):
+        try:
+            respuesta = await server.noop()
+            return respuesta.code == 250
+        except Exception:
+            return False
+
+    async def enviar(self, mensaje):
+        async with self._semaforo:
+            server = None
+            while self._libres:
+                candidata, ultimo_uso = self._libres.pop()
+                if time.monotonic() - ultimo_uso < self.max_inactividad and await self._sigue_viva(candidata):
+                    server = candidata
+                    break
+                await self._cerrar(candidata)
+
+            if server is None:
+                server = await self._conectar()
+
+            try:
+                if isinstance(mensaje, MensajePreparado):
+                    await server.sendmail(mensaje.remitente, mensaje.destinatarios, mensaje.datos)
+                else:
+                    await server.send_message(mensaje)
+            except Exception:
+                await self._cerrar(server)
+                raise
+
+            self._libres.append((server, time.monotonic()))
+            return True
+
+    async def cerrar_todo(self):
+        libres, self._libres = self._libres, []
+        for server, _ in libres:
+            await self._cerrar(server)
+
+
+_pools_smtp = {}  # nombre de tienda -> PoolSMTP
+_pool_lock = threading.Lock()
+
+
+def obtener_pool_smtp(tienda=None):
+    """
+    Devuelve el pool de la tienda (por defecto la principal), creándolo la
+    primera vez con sus datos de correo.
+    """
+    tienda = tienda or obtener_tienda()
+    pool = _pools_smtp.get(tienda.nombre)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools_smtp.get(tienda.nombre)
+            if pool is None:
+                if not tienda.correo_configurado:
+                    raise ValueError(f"Faltan variables de entorno del correo (tienda {tienda.nombre}).")
+
+                config = obtener_config()
+                pool = _pools_smtp[tienda.nombre] = PoolSMTP(
+                    tienda.smtp_server, tienda.smtp_port, tienda.correo_user, tienda.correo_pass,
+                    max_conexiones=config.smtp_max_conexiones,
+                    timeout=config.smtp_timeout,
+                    usar_ssl=tienda.smtp_ssl,
+                )
+    return pool
+
+
+_pools_smtp_async = {}
+
+
+def obtener_pool_smtp_async(tienda=None):
+    """
+    Pool asyncio de la tienda. Si aiosmtplib no está instalado devuelve None y
+    quien llama debe usar el pool normal en un hilo.
+    """
+    tienda = tienda or obtener_tienda()
+    pool_async = _pools_smtp_async.get(tienda.nombre)
+    if pool_async is None:
+        try:
+            import aiosmtplib  # noqa: F401
+        except ImportError:
+            return None
+
+        pool = obtener_pool_smtp(tienda)  # valida los datos de correo
+        pool_async = _pools_smtp_async[tienda.nombre] = PoolSMTPAsync(
+            pool.servidor, pool.puerto, pool.usuario, pool.password,
+            max_conexiones=obtener_config().smtp_max_conexiones,
+            timeout=pool.timeout,
+            usar_ssl=pool.usar_ssl,
+        )
+    return pool_async
+
+
+def pools_smtp_async():
+    return list(_pools_smtp_async.values())
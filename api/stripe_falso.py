@@ -0,0 +1,39 @@
+# stripe_falso.py
+#
+# Sustituto de ClienteStripe que no hace llamadas de red, para probar el
+# pipeline y lanzar benchmarks sin cuenta de Stripe.
+
+import threading
+
+
+class ClienteStripeFalso:
+
+    def __init__(self, line_items_por_sesion=None, line_items_por_defecto=None, sesiones=None):
+        """
+        line_items_por_sesion: {session_id: [{'description': ..., 'price_id': ..., 'product_id': ...}, ...]}
+        line_items_por_defecto: lo que se devuelve para sesiones que no estén en el diccionario.
+        sesiones: lista de sesiones de checkout (diccionarios) para listar_sesiones().
+        """
+        self.line_items_por_sesion = dict(line_items_por_sesion or {})
+        self.line_items_por_defecto = list(line_items_por_defecto or [])
+        self.sesiones = list(sesiones or [])
+        self.llamadas = []
+        self._lock = threading.Lock()
+
+    def listar_line_items(self, session_id, limit=5):
+        with self._lock:
+            self.llamadas.append(("listar_line_items", session_id))
+        items = self.line_items_por_sesion.get(session_id, self.line_items_por_defecto)
+        return [dict(item) for item in items[:limit]]
+
+    def listar_sesiones(self, desde=None, hasta=None, por_pagina=100):
+        # Imita la paginación de Stripe: una "llamada" por página
+        filtradas = [
+            s for s in self.sesiones
+            if (desde is None or s.get('created', 0) >= desde) and (hasta is None or s.get('created', 0) < hasta)
+        ]
+        for inicio in range(0, len(filtradas), por_pagina):
+            with self._lock:
+                self.llamadas.append(("listar_sesiones", inicio // por_pagina))
+            for session in filtradas[inicio:inicio + por_pagina]:
+                yield session
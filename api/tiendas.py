@@ -0,0 +1,167 @@
+# tiendas.py
+#
+# Varias tiendas (cuentas de Stripe y marcas) en un mismo despliegue.
+#
+# La tienda "principal" sale de las variables de entorno de siempre
+# (STRIPE_SECRET_KEY, CORREO_USER...), así que un despliegue de una sola
+# tienda no cambia nada. Las demás se declaran en un JSON (TIENDAS_CONFIG):
+#
+#   {
+#     "otra": {
+#       "stripe_secret_key": "${OTRA_STRIPE_SECRET_KEY}",
+#       "stripe_webhook_secret": "${OTRA_STRIPE_WEBHOOK_SECRET}",
+#       "correo_user": "pedidos@otra.com",
+#       "correo_pass": "${OTRA_CORREO_PASS}",
+#       "nombre_correo": "Otra Tienda",
+#       "smtp_server": "smtp.otra.com",
+#       "smtp_port": 465,
+#       "smtp_por_minuto": 300,
+#       "dominio": "otra.com",
+#       "prefijo_redis": "otra:",
+#       "plantillas": "tiendas/otra"
+#     }
+#   }
+#
+# stripe_secret_key, stripe_webhook_secret y dominio son obligatorios; si falta
+# alguno, el despliegue no arranca (una tienda nunca usa las credenciales de
+# otra). Los valores "${VARIABLE}" se leen del entorno, para no dejar secretos
+# en el fichero; si la variable no existe, tampoco arranca. Cada tienda recibe sus webhooks en
+# /api/webhook/<nombre> y tiene su propio cliente de Stripe, prefijo de claves
+# en Redis, pool SMTP (con su cupo de envíos por minuto) y carpeta de
+# plantillas; el proceso, los hilos y la conexión a Redis se comparten.
+
+import os
+import re
+import json
+from pathlib import Path
+from dataclasses import dataclass
+
+from api.config import obtener_config
+
+TIENDA_PRINCIPAL = "principal"
+
+# Carpeta raíz del proyecto; las rutas relativas de "plantillas" cuelgan de aquí
+BASE_DIR = Path(__file__).parent.parent
+
+_PATRON_VARIABLE = re.compile(r"^\$\{([A-Za-z_][A-Za-z0-9_]*)\}$")
+_PATRON_NOMBRE = re.compile(r"^[a-z0-9_-]+$")
+
+
+@dataclass(frozen=True)
+class Tienda:
+    nombre: str
+    stripe_secret_key: str = None
+    stripe_webhook_secret: str = None
+    correo_user: str = None
+    correo_pass: str = None
+    nombre_correo: str = None
+    smtp_server: str = None
+    smtp_port: int = None
+    smtp_ssl: bool = True
+    smtp_por_minuto: int = 0
+    smtp_rafaga: int = 0
+    dominio: str = None
+    prefijo_redis: str = ""
+    plantillas: Path = BASE_DIR
+
+    @property
+    def correo_configurado(self):
+        return all([self.correo_user, self.correo_pass, self.smtp_server, self.smtp_port])
+
+    @property
+    def asunto(self):
+        return f"Tu pedido en {self.dominio} ha sido confirmado."
+
+
+def _resolver(valor, entorno, nombre, campo):
+    if isinstance(valor, str):
+        coincide = _PATRON_VARIABLE.match(valor)
+        if coincide:
+            variable = coincide.group(1)
+            if variable not in entorno:
+                raise ValueError(f"La tienda {nombre} usa ${{{variable}}} en {campo}, "
+                                 f"pero esa variable no está definida.")
+            return entorno[variable]
+    return valor
+
+
+def _tienda_principal(config):
+    return Tienda(
+        nombre=TIENDA_PRINCIPAL,
+        stripe_secret_key=config.stripe_secret_key,
+        stripe_webhook_secret=config.stripe_webhook_secret,
+        correo_user=config.correo_user,
+        correo_pass=config.correo_pass,
+        nombre_correo=config.nombre_correo,
+        smtp_server=config.smtp_server,
+        smtp_port=config.smtp_port,
+        smtp_ssl=config.smtp_ssl,
+        smtp_por_minuto=config.smtp_por_minuto,
+        smtp_rafaga=config.smtp_rafaga,
+        dominio=config.tienda_dominio,
+    )
+
+
+def cargar_tiendas(config=None, entorno=None):
+    """Devuelve {nombre: Tienda}, con la principal siempre presente."""
+    config = config or obtener_config()
+    entorno = os.environ if entorno is None else entorno
+    tiendas = {TIENDA_PRINCIPAL: _tienda_principal(config)}
+
+    if not config.tiendas_config:
+        return tiendas
+
+    with open(config.tiendas_config, 'r', encoding='utf-8') as f:
+        declaradas = json.load(f)
+
+    for nombre, datos in declaradas.items():
+        if nombre == TIENDA_PRINCIPAL:
+            raise ValueError(f"'{TIENDA_PRINCIPAL}' es la tienda de las variables de entorno, usa otro nombre.")
+        if not _PATRON_NOMBRE.match(nombre):
+            raise ValueError(f"Nombre de tienda no válido (solo a-z, 0-9, _ y -): {nombre!r}")
+
+        valores = {campo: _resolver(valor, entorno, nombre, campo) for campo, valor in datos.items()}
+        if valores.get("plantillas"):
+            valores["plantillas"] = BASE_DIR / valores["plantillas"]
+        for campo in ("smtp_port", "smtp_por_minuto", "smtp_rafaga"):
+            if valores.get(campo):
+                valores[campo] = int(valores[campo])
+        # Sin prefijo propio las claves de Redis se mezclarían con las de otra tienda
+        valores.setdefault("prefijo_redis", f"{nombre}:")
+
+        try:
+            tienda = Tienda(nombre=nombre, **valores)
+        except TypeError as e:
+            raise ValueError(f"Configuración de la tienda {nombre} no válida: {e}")
+        if not tienda.stripe_secret_key:
+            raise ValueError(f"La tienda {nombre} no tiene stripe_secret_key.")
+        if not tienda.stripe_webhook_secret:
+            raise ValueError(f"La tienda {nombre} no tiene stripe_webhook_secret.")
+        # Va en el asunto de sus correos: sin él saldrían con el dominio de la principal
+        if not tienda.dominio:
+            raise ValueError(f"La tienda {nombre} no tiene dominio.")
+        tiendas[nombre] = tienda
+
+    prefijos = [t.prefijo_redis for t in tiendas.values()]
+    if len(set(prefijos)) != len(prefijos):
+        raise ValueError("Dos tiendas comparten prefijo_redis.")
+    return tiendas
+
+
+_tiendas = cargar_tiendas()
+
+
+def obtener_tienda(nombre=None):
+    """La tienda con ese nombre (None -> la principal). KeyError si no existe."""
+    return _tiendas[nombre or TIENDA_PRINCIPAL]
+
+
+def listar_tiendas():
+    return list(_tiendas.values())
+
+
+def recargar_tiendas(config=None, entorno=None):
+    """Vuelve a leer las tiendas (pensado para pruebas y benchmarks)."""
+    global _tiendas
+    _tiendas = cargar_tiendas(config, entorno)
+    return _tiendas
@@ -1,192 +1,497 @@
 # Reemplaza todo el archivo api/webhook.py
 from flask import Flask, request, Response
-import json
-import os
-import smtplib, ssl
-from email.message import EmailMessage
-import stripe
-from pathlib import Path
 
 # Creamos la aplicación Flask
 app = Flask(__name__)
 
-print("STRIPE VERSION:", stripe.VERSION)
+# El SDK de Stripe y redis se importan la primera vez que hacen falta, no aquí:
+# así el arranque en frío (serverless) no paga por ellos si no se usan.
+from api.config import obtener_config
 # 1. Importas únicamente la función encargada del registro
-from api.mbp_user_manager import registrar_cliente_con_password
-
-# Movemos la función de enviar correo fuera para que sea independiente
-def enviar_correo_confirmacion(destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto,ser):
-    print("-> Iniciando envío de correo con plantilla HTML...")
-
-    remitente = os.environ.get('CORREO_USER')
-    password = os.environ.get('CORREO_PASS')
-    servidor_smtp = os.environ.get('SMTP_SERVER')
-    puerto_smtp = int(os.environ.get('SMTP_PORT'))
-
-    if not all([remitente, password, servidor_smtp, puerto_smtp]):
-        print("-> ERROR FATAL: Faltan variables de entorno del correo.")
-        return
-
-    # --- ¡AQUÍ ESTÁ LA SOLUCIÓN! CONSTRUIMOS LA RUTA CORRECTA ---
+from api.mbp_user_manager import get_webhook_redis_client
+from api.cola_envios import obtener_cola
+from api.smtp_pool import obtener_pool_smtp
+from api.correo_lotes import digest_activo, iniciar_digests
+from api.plantillas import obtener_registro_plantillas
+from api.mensajes import obtener_esqueleto
+from api.outbox import encolar_confirmacion, campos_entrada, obtener_outbox, nuevo_id, NUEVO, DUPLICADO
+from api.despachador import entregar, iniciar_en_segundo_plano, ENVIADO
+from api.limite_smtp import obtener_limitador
+from api.eventos_stripe import leer_checkout_completado, SesionCheckout, FirmaInvalida, TIPO_CHECKOUT_COMPLETADO
+from api.productos import obtener_resolutor_productos
+from api.rutas_productos import obtener_tabla_rutas
+from api.idempotencia import reclamar_evento, marcar_evento_hecho, liberar_evento, HECHO, EN_CURSO
+from api.metricas import medir, contar, anotar, evento, exportar_prometheus
+from api.resiliencia import DependenciaCaida, en_peticion
+from api.tiendas import obtener_tienda, listar_tiendas
+
+# Cargamos y validamos las plantillas al arrancar: si alguna usa un campo que
+# no rellenamos, mejor enterarse aquí que en el correo de un cliente.
+for _tienda in listar_tiendas():
+    obtener_registro_plantillas(_tienda).precargar()
+
+
+def calentar():
+    """
+    Crea de antemano los clientes de Stripe, Redis y SMTP (y hace el import de
+    sus librerías) para que la primera petición no lo pague. Se llama al
+    importar si WEBHOOK_CALENTAR=1, o a mano desde el hook de arranque.
+    """
+    import stripe  # noqa: F401
+    obtener_tabla_rutas()
     try:
-        # 1. Obtenemos la ruta de la carpeta donde está este script (api/)
-        script_dir = Path(__file__).parent
-        # 2. Subimos un nivel para llegar a la raíz del proyecto
-        base_dir = script_dir.parent
-        # 3. Unimos la ruta raíz con el nombre del archivo de la plantilla
-        
-
-        if ser == 1:
-            template_path = base_dir / 'correo_template.html'
-
-        elif ser ==2: # METODO BARRERA PRIMERO                       
-            curso_comprado = "MBP"     
-            password_plana, portal_existe = registrar_cliente_con_password(destinatario, curso_comprado)    
-            if portal_existe==0:
-                template_path = base_dir / 'correo_template_metodo.html'
-            else:
-                template_path = base_dir / 'correo_template_metodo_cexiste.html'         
-             # ... (Aquí va tu lógica de comprobar si es "METODO" y asignar "MBP_L1" o "MBP_L2") ...
-            
-            
-
-        elif ser ==3: #RETO TIMON 21 DIAS                 
-            curso_comprado = "TIMON"     
-            password_plana, portal_existe = registrar_cliente_con_password(destinatario, curso_comprado)
-            if portal_existe==0:
-                template_path = base_dir / 'correo_template_timon.html'
-            else:
-                template_path = base_dir / 'correo_template_timon_cexiste.html'                             
-         
-        
-        else:
-            template_path = base_dir / 'correo_template_simple.html'
-
-
-
-        print(f"-> Intentando leer la plantilla desde la ruta: {template_path}")
-
-        with open(template_path, 'r', encoding='utf-8') as f:
-            cuerpo_html = f.read()
-    except FileNotFoundError:
-        print(f"-> ERROR FATAL: No se encontró el archivo de plantilla en la ruta esperada: {template_path}")
-        return
-    except Exception as e:
-        print(f"-> ERROR LEYENDO EL ARCHIVO DE PLANTILLA: {e}")
-        return
-
-    # --- El resto del código para reemplazar variables y enviar es el mismo ---
-    monto_formateado = f"{monto:.2f} {moneda}"
-    nombre_formateado = nombre_cliente.title() if nombre_cliente else " "
-
-    if direccion_envio and direccion_envio.address:
-        addr = direccion_envio.address
-        direccion_formateada = f"{addr.line1}<br>{f'{addr.line2}<br>' if addr.line2 else ''}{addr.postal_code} {addr.city}, {addr.state}<br>{addr.country}".strip()
-    else:
-        direccion_formateada = "No se ha especificado una dirección de envío."
-
-    cuerpo_html = cuerpo_html.replace('{{NOMBRE_CLIENTE}}', nombre_formateado)
-    cuerpo_html = cuerpo_html.replace('{{MONTO_PAGO}}', monto_formateado)
-    cuerpo_html = cuerpo_html.replace('{{DIRECCION_ENTREGA}}', direccion_formateada)
-    cuerpo_html = cuerpo_html.replace('{{NOMBRE_PRODUCTO}}', nombre_producto)  # <-- ¡AÑADE ESTA LÍNEA!
-
-    if (ser==2 or ser==3) and portal_existe==0:
-        cuerpo_html = cuerpo_html.replace('{{CORREO_ACCESO}}', destinatario)
-        cuerpo_html = cuerpo_html.replace('{{PASSWORD_PLANA}}', password_plana)        
-
-    asunto = f"Tu pedido en micosmeticanatural.com ha sido confirmado."
-    msg = EmailMessage()
-    msg['Subject'] = asunto
-    nombre_a_mostrar = os.environ.get('NOMBRE_CORREO')  # <-- CAMBIA ESTO POR TU NOMBRE O EL DE TU NEGOCIO
-    msg['From'] = f"{nombre_a_mostrar} <{remitente}>"
-    msg['To'] = destinatario
-    msg['Cc'] = remitente
-    
-    msg.set_content(
-        "Hemos recibido tu pago correctamente. Este correo se visualiza mejor en un cliente de correo moderno.")
-    msg.add_alternative(cuerpo_html, subtype='html')
-
+        get_webhook_redis_client()
+    except ValueError as e:
+        print(f"-> AVISO al calentar Redis: {e}")
+    for tienda in listar_tiendas():
+        obtener_resolutor_productos(tienda)
+        if tienda.correo_configurado:
+            obtener_pool_smtp(tienda)
+
+def correo_listo(tienda, simulacion=False):
+    """Sin datos de correo de la tienda no tiene sentido ni preguntar a Stripe por los productos."""
+    if not simulacion and not tienda.correo_configurado:
+        print("-> ERROR FATAL: Faltan variables de entorno del correo.")
+        return False
+    return True
+
+
+class Confirmacion:
+    """
+    El correo de confirmación de una compra hasta que llega al outbox. Reúne lo
+    que deciden igual el webhook Flask y el ASGI (plantilla, pedido para el
+    resumen, qué hacer con lo que responde el outbox); Redis y SMTP los pone
+    cada uno a su manera.
+    """
+
+    def __init__(self, destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto, rutas,
+                 tienda=None, id_envio=None, id_sesion=None):
+        self.destinatario = destinatario
+        self.monto = monto
+        self.moneda = moneda
+        self.nombre_cliente = nombre_cliente
+        self.direccion_envio = direccion_envio
+        self.nombre_producto = nombre_producto
+        self.rutas = rutas
+        self.tienda = tienda or obtener_tienda()
+        self.id_envio = id_envio or nuevo_id()
+        self.id_sesion = id_sesion
+        self.cursos = [ruta.curso for ruta in rutas if ruta.cuenta_portal]
+        self.pedido = {"email": destinatario, "nombre": nombre_cliente, "producto": nombre_producto,
+                       "monto": f"{monto:.2f} {moneda}"}
+
+    @classmethod
+    def desde_trabajo(cls, trabajo, nombre_producto, rutas, tienda):
+        return cls(trabajo['email'], trabajo['monto'], trabajo['moneda'], trabajo.get('nombre'),
+                   trabajo.get('direccion'), nombre_producto, rutas, tienda,
+                   trabajo.get('event_id'), trabajo.get('session_id'))
+
+    def renderizar(self, portal_existe, password_plana=None):
+        nombre_plantilla, credenciales = elegir_plantilla(self.rutas, portal_existe)
+        with medir("plantilla"):
+            return construir_correo(self.destinatario, self.monto, self.moneda, self.nombre_cliente,
+                                    self.direccion_envio, self.nombre_producto, nombre_plantilla,
+                                    password_plana if credenciales else None, self.tienda)
+
+    def preparar(self, simulacion=False):
+        """
+        El correo para cliente existente (o compra sin portal); el de
+        credenciales solo se renderiza si el alta resulta ser nueva. En
+        simulación, el de cliente nuevo con una contraseña de ejemplo.
+        Devuelve None si la plantilla no se puede renderizar.
+        """
+        portal_existe = 0 if simulacion and self.cursos else 1
+        nombre_plantilla, _ = elegir_plantilla(self.rutas, portal_existe)
+        try:
+            msg = self.renderizar(portal_existe, "********" if simulacion else None)
+        except FileNotFoundError:
+            print(f"-> ERROR FATAL: No se encontró el archivo de plantilla: {nombre_plantilla}")
+            contar("correos_fallidos")
+            return None
+        except Exception as e:
+            print(f"-> ERROR RENDERIZANDO LA PLANTILLA {nombre_plantilla}: {e}")
+            contar("correos_fallidos")
+            return None
+
+        if simulacion:
+            anotar(plantilla=nombre_plantilla)
+            print(f"-> [SIMULACIÓN] Se enviaría {nombre_plantilla} a {self.destinatario}.")
+        return msg
+
+    def entrada_outbox(self, msg, inmediato):
+        """Argumentos de encolar_confirmacion / encolar_confirmacion_async."""
+        return {
+            "id_entrada": self.id_envio,
+            "tienda": self.tienda,
+            "campos": campos_entrada(msg, self.tienda, self.pedido),
+            "mensaje": msg,
+            "renderizar_nuevo": lambda password_plana: self.renderizar(0, password_plana),
+            "email": self.destinatario,
+            "cursos": self.cursos,
+            "inmediato": inmediato,
+            "id_sesion": self.id_sesion,
+        }
+
+    def tras_encolar(self, resultado, inmediato):
+        """
+        Anota lo que respondió el outbox. Devuelve True si toca enviar ahora;
+        si no, el correo ya está (o ya estaba) a salvo en el outbox. Con un
+        DUPLICADO y envío inmediato, quien llama devuelve la ficha que tomó.
+        """
+        if resultado == DUPLICADO:
+            anotar(outbox="duplicado")
+            return False
+        anotar(plantilla=elegir_plantilla(self.rutas, 0 if resultado == NUEVO else 1)[0])
+        if not inmediato:
+            print(f"-> Correo para {self.destinatario} guardado en el outbox.")
+            anotar(outbox="pendiente")
+            return False
+        return True
+
+
+def enviar_correo_confirmacion(destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto, rutas,
+                               simulacion=False, tienda=None, id_envio=None, id_sesion=None):
+    """
+    `rutas` es la lista que devuelve TablaRutas.clasificar(): se da de alta
+    cada curso de la compra y la primera ruta elige la plantilla.
+
+    El alta del cliente y su correo se guardan juntos en el outbox
+    (api/outbox.py) y después se intenta el envío. Si el SMTP falla, el correo
+    se queda en el outbox y lo reintenta el despachador (api/despachador.py)
+    con la misma contraseña que quedó en la cuenta. Devuelve True en cuanto el
+    correo está a salvo en el outbox, haya salido ya o no.
+
+    `id_envio` identifica el correo en el outbox (el event_id de Stripe):
+    repetir el mismo no da de alta ni envía nada dos veces. Con `id_sesion`
+    (el session_id) tampoco se repite para la misma sesión con otro id.
+
+    Con simulacion=True no se toca Redis ni se envía nada: se renderiza el
+    correo como si el cliente fuera nuevo, con una contraseña de ejemplo.
+
+    Si Redis no responde se lanza DependenciaCaida, y quien llama decide si
+    diferirlo; nunca se manda un correo sin saber si el cliente existe.
+
+    `tienda` (api/tiendas.py) pone remitente, pool SMTP, plantillas y claves de
+    Redis; None es la tienda principal.
+    """
+    print("-> Iniciando envío de correo con plantilla HTML...")
+    tienda = tienda or obtener_tienda()
+    if not correo_listo(tienda, simulacion):
+        return False
+
+    confirmacion = Confirmacion(destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto, rutas,
+                                tienda, id_envio, id_sesion)
+    msg = confirmacion.preparar(simulacion)
+    if msg is None:
+        return False
+    if simulacion:
+        return True
+
+    # Solo se envía en el acto si queda cupo del proveedor; si no, lo hará el despachador a su ritmo
+    limitador = obtener_limitador()
+    inmediato = obtener_config().outbox_envio_inmediato and limitador.tomar(tienda)[0] > 0
     try:
-        contexto_seguro = ssl.create_default_context()
-        with smtplib.SMTP_SSL(servidor_smtp, puerto_smtp, context=contexto_seguro) as server:
-            server.login(remitente, password)
-            server.send_message(msg)
-            print(f"-> Correo con plantilla enviado exitosamente a {destinatario}.")
-    except Exception as e:
-        print(f"-> ERROR AL ENVIAR CORREO CON PLANTILLA: {e}")
-
-
-# Esta es nuestra ruta de webhook, que ahora usa Flask
+        resultado, msg = encolar_confirmacion(**confirmacion.entrada_outbox(msg, inmediato))
+    except Exception:
+        # La ficha era para un envío que no va a haber
+        if inmediato:
+            limitador.devolver(tienda)
+        raise
+    if resultado == DUPLICADO and inmediato:
+        limitador.devolver(tienda)
+    if not confirmacion.tras_encolar(resultado, inmediato):
+        return True
+
+    # La conexión sale del pool ya autenticada; si falla, el correo queda
+    # reprogramado en el outbox y no hace falta que Stripe reintente
+    resultado_envio = entregar(obtener_outbox(), confirmacion.id_envio, msg, tienda, confirmacion.pedido)
+    if resultado_envio != ENVIADO:
+        anotar(outbox=resultado_envio)
+    return True
+
+
+def elegir_plantilla(rutas, portal_existe):
+    """
+    La primera ruta manda. Devuelve (nombre_plantilla, credenciales), donde
+    credenciales indica si el correo lleva usuario y contraseña del portal.
+    """
+    principal = rutas[0]
+    credenciales = principal.cuenta_portal and portal_existe == 0
+    if principal.cuenta_portal and not credenciales:
+        return principal.plantilla_existente, False
+    return principal.plantilla, credenciales
+
+
+def construir_correo(destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto,
+                     nombre_plantilla, password_plana=None, tienda=None):
+    """
+    Rellena la plantilla y devuelve el correo ya serializado (MensajePreparado,
+    ver api/mensajes.py). Si se pasa password_plana, se rellenan también los
+    datos de acceso al portal. La tienda va en copia salvo que esté activado el
+    resumen periódico (DIGEST_COMERCIANTE).
+    """
+    tienda = tienda or obtener_tienda()
+    remitente = tienda.correo_user
+
+    valores = {
+        'NOMBRE_CLIENTE': nombre_cliente.title() if nombre_cliente else " ",
+        'MONTO_PAGO': f"{monto:.2f} {moneda}",
+        'DIRECCION_ENTREGA': formatear_direccion(direccion_envio),
+        'NOMBRE_PRODUCTO': nombre_producto,
+    }
+    if password_plana is not None:
+        valores['CORREO_ACCESO'] = destinatario
+        valores['PASSWORD_PLANA'] = password_plana
+
+    # Remitente y dominio del asunto son de cada tienda (NOMBRE_CORREO y TIENDA_DOMINIO en la principal)
+    asunto = tienda.asunto
+    nombre_a_mostrar = tienda.nombre_correo
+
+    # Cabeceras, estructura MIME y trozos del HTML ya codificados salen de caché:
+    # solo se codifican los valores del pedido y se pegan los bytes
+    esqueleto = obtener_esqueleto(remitente, nombre_a_mostrar, asunto, not digest_activo())
+    plantilla = obtener_registro_plantillas(tienda).obtener(nombre_plantilla)
+    return esqueleto.construir(plantilla, valores, destinatario)
+
+
+def formatear_direccion(direccion_envio):
+    """
+    Recibe la dirección como diccionario ({'line1': ..., 'city': ...}) o None.
+    """
+    if direccion_envio:
+        addr = direccion_envio
+        linea2 = f"{addr.get('line2')}<br>" if addr.get('line2') else ''
+        return f"{addr.get('line1')}<br>{linea2}{addr.get('postal_code')} {addr.get('city')}, {addr.get('state')}<br>{addr.get('country')}".strip()
+    return "No se ha especificado una dirección de envío."
+
+
+def modo_cola_activo():
+    return obtener_config().modo_cola
+
+
+def hay_consumidor_cola():
+    """Si alguien vacía la cola: un worker aparte (modo cola) o el integrado (WORKER_INTEGRADO)."""
+    config = obtener_config()
+    return config.modo_cola or config.worker_integrado
+
+
+def extraer_trabajo(event, tienda=None):
+    """
+    Reduce el evento de Stripe a un registro compacto y serializable en JSON,
+    que es lo que viaja por la cola hasta el worker. Acepta el SesionCheckout
+    que ya sacó el webhook o el evento entero (backfill).
+    """
+    sesion = event if isinstance(event, SesionCheckout) else SesionCheckout.desde_evento(event)
+    return sesion.como_trabajo((tienda or obtener_tienda()).nombre)
+
+
+def clasificar_compra(trabajo, line_items):
+    """Nombre del producto y rutas (cursos y plantilla, ver api/rutas_productos.py) de la compra."""
+    nombres_productos = [item['description'] for item in line_items]
+    nombre_producto = ", ".join(nombres_productos) if nombres_productos else "Tu Compra"
+
+    rutas = obtener_tabla_rutas().clasificar(line_items)
+    anotar(rutas=[r.nombre for r in rutas])
+
+    print(f"-> Sesión procesada. Producto: {nombre_producto}, Cliente: {trabajo['email']}, "
+          f"Rutas: {', '.join(r.nombre for r in rutas)}")
+    return nombre_producto, rutas
+
+
+def procesar_trabajo(trabajo, simulacion=False):
+    """
+    Lógica de negocio de una compra: productos, clasificación, registro y correo.
+    La usan el webhook (modo directo), el worker de la cola y el backfill.
+    Devuelve True si el correo se envió o quedó en el outbox (o se renderizó, en simulación).
+    """
+    # Los trabajos encolados antes de haber varias tiendas no traen 'tienda': son de la principal
+    tienda = obtener_tienda(trabajo.get('tienda'))
+    if not correo_listo(tienda, simulacion):
+        return False
+
+    # Los productos salen de los line items del evento o de Stripe
+    with medir("productos"):
+        line_items = obtener_resolutor_productos(tienda).resolver(trabajo)
+    nombre_producto, rutas = clasificar_compra(trabajo, line_items)
+
+    return enviar_correo_confirmacion(trabajo['email'], trabajo['monto'], trabajo['moneda'], trabajo.get('nombre'),
+                                      trabajo.get('direccion'), nombre_producto, rutas, simulacion, tienda,
+                                      trabajo.get('event_id'), trabajo.get('session_id'))
+
+
+# Esta es nuestra ruta de webhook, que ahora usa Flask.
+# /api/webhook es la tienda principal; las demás usan /api/webhook/<nombre>.
 @app.route('/api/webhook', methods=['POST'])
-def stripe_webhook():
+@app.route('/api/webhook/<nombre_tienda>', methods=['POST'])
+def stripe_webhook(nombre_tienda=None):
     # --- 1. CONFIGURACIÓN INICIAL ---
-    stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
-    endpoint_secret = os.environ.get('STRIPE_WEBHOOK_SECRET')
+    try:
+        tienda = obtener_tienda(nombre_tienda)
+    except KeyError:
+        print(f"ERROR: Tienda desconocida: {nombre_tienda}")
+        return Response(status=404)
+    endpoint_secret = tienda.stripe_webhook_secret
     payload = request.data
     sig_header = request.headers.get('Stripe-Signature')
 
     # --- 2. VERIFICACIÓN DE LA FIRMA (Máxima Seguridad) ---
+    # La firma se comprueba sobre los bytes tal cual; el JSON solo se decodifica
+    # si el evento es de los que gestionamos (ver api/eventos_stripe.py)
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
-        print(f"Webhook verificado y recibido: {event.get('type')}")
+        with medir("firma"):
+            sesion = leer_checkout_completado(payload, sig_header, endpoint_secret)
     except ValueError as e:
         # Cuerpo del payload inválido
         print(f"ERROR: Payload inválido. {e}")
+        contar("firmas_invalidas")
         return Response(status=400)
-    except stripe.error.SignatureVerificationError as e:
+    except FirmaInvalida as e:
         # Firma inválida
         print(f"ERROR: Fallo en la verificación de la firma. {e}")
+        contar("firmas_invalidas")
         return Response(status=400)
 
     # --- 3. MANEJAR EL EVENTO 'checkout.session.completed' ---
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
+    if sesion is None:
+        contar("eventos_ignorados")
+        return Response(status=200)
 
-        try:
-            # Obtenemos los datos del cliente de la sesión
-            email_cliente = session.get('customer_details', {}).get('email')
-            nombre_cliente = session.get('customer_details', {}).get('name')
-            direccion_envio = session.get('shipping_details')
-
-            # Obtenemos los datos del pago
-            monto = session.get('amount_total', 0) / 100
-            moneda = session.get('currency', 'usd').upper()
-
-            if not email_cliente:
-                raise ValueError("No se encontró email en los detalles de la sesión.")
-
-            # Obtenemos el nombre del producto de los Line Items
-            line_items = stripe.checkout.Session.list_line_items(session['id'], limit=5)
-            nombres_productos = [item.description for item in line_items.data]
-            nombre_producto = ", ".join(nombres_productos) if nombres_productos else "Tu Compra"
-
-            # Verificamos si el producto contiene la palabra "Antioxidante"
-            ser=0
-            # 1. Comprobación para "Antioxidante"
-            if "Antioxidante" in nombre_producto:
-                ser = 1
-                
-            # 2. Comprobación para "Barrera" (soporta minúsculas, mayúsculas y tildes)
-            elif "Barrera" in nombre_producto.upper() or "barrera" in nombre_producto.upper():
-                ser = 2
-
-            # 2. Comprobación para "Barrera" (soporta minúsculas, mayúsculas y tildes)
-            elif "TIMÓN" in nombre_producto.upper() or "TIMON" in nombre_producto.upper():
-                ser = 3
-                
-            # 3. Opción por defecto si no coincide con ninguno
-            else:
-                ser = 0
-
-            print(f"-> Sesión procesada. Producto: {nombre_producto}, Cliente: {email_cliente}")
-
-            # Llamamos a nuestra función de envío de correo
-            # (Hay que definirla fuera o dentro de esta función)
-            enviar_correo_confirmacion(email_cliente, monto, moneda, nombre_cliente, direccion_envio, nombre_producto,ser)
-            #enviar_correo_confirmacion(os.environ.get('CORREO_USER'), monto, moneda, nombre_cliente, direccion_envio, nombre_producto)
-        except Exception as e:
-            print(f"-> ERROR al procesar la sesión de checkout: {e}")
-            return Response(status=500)
+    print(f"Webhook verificado y recibido: {TIPO_CHECKOUT_COMPLETADO}")
+    # Todo lo que pase con este evento sale en una línea JSON con su event_id
+    # Sin reintentos aquí: si algo no responde, el evento se difiere y Stripe no espera
+    with evento(sesion.event_id, tipo=TIPO_CHECKOUT_COMPLETADO, origen="webhook", tienda=tienda.nombre), en_peticion():
+        return Response(status=manejar_checkout(sesion, tienda))
+
+
+def manejar_checkout(sesion, tienda=None):
+    """Recibe el SesionCheckout ya verificado. Devuelve el código HTTP para Stripe."""
+    event_id = sesion.event_id
+
+    # Si ya lo procesamos (reintento de Stripe), respondemos sin hacer nada más
+    with medir("idempotencia"):
+        estado = reclamar_evento(event_id)
+    status = respuesta_evento_reclamado(event_id, estado)
+    if status is not None:
+        return status
+
+    trabajo = None
+    try:
+        trabajo = extraer_trabajo(sesion, tienda)
+
+        # Modo cola: respondemos a Stripe enseguida y el worker hace el resto
+        if modo_cola_activo():
+            with medir("encolar"):
+                obtener_cola().encolar(trabajo)
+            print(f"-> Evento {trabajo['event_id']} encolado para {trabajo['email']}")
+            anotar(resultado="encolado")
+        else:
+            anotar(resultado="enviado" if procesar_trabajo(trabajo) else "correo_fallido")
+    except DependenciaCaida as e:
+        # Redis o Stripe no responden (del SMTP ya se ocupa el outbox): en vez
+        # de bloquear o mandar un correo a medias, el evento pasa a la cola
+        return diferir_trabajo(event_id, trabajo, e)
+    except Exception as e:
+        print(f"-> ERROR al procesar la sesión de checkout: {e}")
+        liberar_evento(event_id)
+        anotar_error(e)
+        return 500
+
+    marcar_evento_hecho(event_id)
+    return 200
+
+
+def respuesta_evento_reclamado(event_id, estado):
+    """
+    Código HTTP si el evento no hay que procesarlo (ya hecho o en curso en
+    otro worker), o None si lo hemos reclamado nosotros.
+    """
+    if estado == HECHO:
+        print(f"-> Evento {event_id} ya procesado, se ignora el reintento.")
+        contar("eventos_duplicados")
+        anotar(resultado="duplicado")
+        return 200
+    if estado == EN_CURSO:
+        # Otro worker lo tiene entre manos; que Stripe lo reintente más tarde
+        print(f"-> Evento {event_id} en curso en otro worker.")
+        contar("eventos_duplicados")
+        anotar(resultado="en_curso")
+        return 409
+    return None
+
+
+def anotar_error(error):
+    contar("eventos_error")
+    anotar(resultado="error", error=str(error))
+
+
+def se_puede_diferir(event_id, error):
+    """Si el evento puede esperar en la cola a que vuelva la dependencia caída."""
+    anotar(dependencia=error.dependencia)
+    if not hay_consumidor_cola():
+        # Sin worker el evento se quedaría en la cola para siempre: mejor que Stripe lo reintente
+        print(f"-> ERROR: {error}. No hay worker para la cola; Stripe reintentará el evento {event_id}.")
+        return False
+    print(f"-> AVISO: {error}. El evento {event_id} se difiere a la cola.")
+    return True
+
+
+def anotar_diferido():
+    contar("eventos_diferidos")
+    anotar(resultado="diferido")
+
+
+def diferir_trabajo(event_id, trabajo, error):
+    """Camino diferido cuando una dependencia está caída. Devuelve el código HTTP."""
+    if not se_puede_diferir(event_id, error):
+        liberar_evento(event_id)
+        anotar_error(error)
+        return 503
+
+    try:
+        with medir("encolar"):
+            obtener_cola().encolar(trabajo)
+    except Exception as e:
+        # Tampoco hay cola (p. ej. es Redis lo que falla): que Stripe lo reintente
+        print(f"-> ERROR: no se pudo diferir el evento {event_id}: {e}")
+        liberar_evento(event_id)
+        anotar_error(error)
+        return 503
+
+    anotar_diferido()
+    marcar_evento_hecho(event_id)
+    return 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    publicar_profundidad_outbox()
+    return Response(exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def publicar_profundidad_outbox():
+    """Correos esperando en el outbox (webhook_outbox{tienda,cola}), leídos en cada scrape."""
+    try:
+        obtener_outbox().publicar_profundidad(listar_tiendas())
+    except Exception as e:
+        # Sin Redis, /metrics tiene que seguir respondiendo
+        print(f"-> AVISO: no se pudo leer la profundidad del outbox: {e}")
+
+
+if obtener_config().calentar:
+    calentar()
+
+# El resumen de pedidos para la tienda sale aunque este proceso no reciba ninguno
+iniciar_digests()
 
-    return Response(status=200)
+if obtener_config().outbox_despachador_integrado:
+    iniciar_en_segundo_plano(obtener_config().despachador_concurrencia, obtener_config().despachador_lote)
+else:
+    # Sin despachador, lo que no sale en el acto (SMTP caído, sin cupo) no sale nunca
+    print("-> AVISO: OUTBOX_DESPACHADOR_INTEGRADO=0. Los correos que no se envíen en el acto se quedan "
+          "en el outbox hasta que arranque `python -m api.despachador`.")
 
+if obtener_config().worker_integrado:
+    # Aquí y no arriba: api.worker importa este módulo
+    from api.worker import iniciar_en_segundo_plano as iniciar_worker
+    iniciar_worker(obtener_config().worker_concurrencia, obtener_config().worker_max_intentos,
+                   obtener_config().worker_base_retraso)
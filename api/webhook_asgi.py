@@ -0,0 +1,266 @@
+# webhook_asgi.py
+#
+# Variante asyncio (ASGI) de /api/webhook. Misma verificación de firma y la
+# misma lógica de negocio que api/webhook.py, pero sin bloquear un hilo por
+# petición mientras se espera a Stripe, Redis o SMTP:
+#   - Redis con redis.asyncio (idempotencia, outbox, cupo SMTP, cola y resumen)
+#   - SMTP con aiosmtplib (o el pool normal en un hilo si no está instalado;
+#     es un extra opcional, ver requirements.txt)
+#   - Stripe en un hilo con asyncio.to_thread
+#   - La firma y el JSON sin la librería de Stripe (api/eventos_stripe.py)
+#
+# Uso:  uvicorn api.webhook_asgi:app --workers 1
+#
+# La app Flask (api/webhook.py) se mantiene igual para los despliegues actuales.
+
+import asyncio
+
+from api.webhook import (
+    Confirmacion,
+    correo_listo,
+    clasificar_compra,
+    extraer_trabajo,
+    modo_cola_activo,
+    respuesta_evento_reclamado,
+    anotar_error,
+    se_puede_diferir,
+    anotar_diferido,
+    publicar_profundidad_outbox,
+)
+from api.cola_envios import obtener_cola
+from api.smtp_pool import obtener_pool_smtp, obtener_pool_smtp_async, pools_smtp_async
+from api.productos import obtener_resolutor_productos
+from api.mbp_user_manager import get_webhook_redis_client_async
+from api.outbox import encolar_confirmacion_async, obtener_outbox_async, DUPLICADO
+from api.despachador import registrar_envio_async, registrar_fallo_async
+from api.limite_smtp import obtener_limitador_async
+from api.eventos_stripe import leer_checkout_completado, FirmaInvalida, TIPO_CHECKOUT_COMPLETADO
+from api.config import obtener_config
+from api.idempotencia import reclamar_evento_async, marcar_evento_hecho_async, liberar_evento_async
+from api.metricas import medir, contar, anotar, evento, exportar_prometheus
+from api.resiliencia import proteger_async, DependenciaCaida, en_peticion
+from api.tiendas import obtener_tienda
+
+
+# Peticiones procesándose a la vez como máximo, y cuánto espera una por su turno
+MAX_EN_VUELO = obtener_config().asgi_max_en_vuelo
+ESPERA_EN_VUELO = obtener_config().asgi_espera_en_vuelo
+
+_semaforo = None
+
+
+def _obtener_semaforo():
+    # Se crea dentro del bucle que lo usa
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(MAX_EN_VUELO)
+    return _semaforo
+
+
+async def enviar_correo_async(msg, tienda=None):
+    pool_async = obtener_pool_smtp_async(tienda)
+    if pool_async is not None:
+        return await pool_async.enviar(msg)
+    return await asyncio.to_thread(obtener_pool_smtp(tienda).enviar, msg)
+
+
+async def procesar_trabajo_async(trabajo):
+    """
+    Equivalente asyncio de procesar_trabajo(). Las decisiones son las de
+    api/webhook.py (Confirmacion); aquí solo cambia cómo se habla con Stripe,
+    Redis y el SMTP.
+    """
+    tienda = obtener_tienda(trabajo.get('tienda'))
+    if not correo_listo(tienda):
+        return False
+
+    with medir("productos"):
+        line_items = await asyncio.to_thread(obtener_resolutor_productos(tienda).resolver, trabajo)
+    nombre_producto, rutas = clasificar_compra(trabajo, line_items)
+
+    confirmacion = Confirmacion.desde_trabajo(trabajo, nombre_producto, rutas, tienda)
+    msg = confirmacion.preparar()
+    if msg is None:
+        return False
+
+    limitador = obtener_limitador_async()
+    inmediato = obtener_config().outbox_envio_inmediato
+    if inmediato:
+        concedidas, _ = await limitador.tomar(tienda)
+        inmediato = concedidas > 0
+    try:
+        resultado, msg = await encolar_confirmacion_async(get_webhook_redis_client_async(),
+                                                          **confirmacion.entrada_outbox(msg, inmediato))
+    except Exception:
+        if inmediato:
+            await limitador.devolver(tienda)
+        raise
+    if resultado == DUPLICADO and inmediato:
+        await limitador.devolver(tienda)
+    if not confirmacion.tras_encolar(resultado, inmediato):
+        return True
+
+    outbox = obtener_outbox_async()
+    try:
+        with medir("smtp"):
+            await proteger_async("smtp", enviar_correo_async, msg, tienda, tienda=tienda)
+    except Exception as e:
+        # Queda reprogramado en el outbox para el despachador
+        anotar(outbox=await registrar_fallo_async(outbox, confirmacion.id_envio, e, tienda))
+        return True
+
+    print(f"-> Correo con plantilla enviado exitosamente a {confirmacion.destinatario}.")
+    await registrar_envio_async(outbox, confirmacion.id_envio, tienda, confirmacion.pedido)
+    return True
+
+
+async def diferir_trabajo_async(event_id, trabajo, error):
+    """Equivalente asyncio de diferir_trabajo() (api/webhook.py)."""
+    if not se_puede_diferir(event_id, error):
+        await liberar_evento_async(event_id)
+        anotar_error(error)
+        return 503
+
+    try:
+        with medir("encolar"):
+            await obtener_cola().encolar_async(trabajo)
+    except Exception as e:
+        print(f"-> ERROR: no se pudo diferir el evento {event_id}: {e}")
+        await liberar_evento_async(event_id)
+        anotar_error(error)
+        return 503
+
+    anotar_diferido()
+    await marcar_evento_hecho_async(event_id)
+    return 200
+
+
+async def manejar_webhook(payload, sig_header, nombre_tienda=None):
+    """Devuelve el código HTTP de la respuesta."""
+    try:
+        tienda = obtener_tienda(nombre_tienda)
+    except KeyError:
+        print(f"ERROR: Tienda desconocida: {nombre_tienda}")
+        return 404
+    endpoint_secret = tienda.stripe_webhook_secret
+
+    try:
+        with medir("firma"):
+            sesion = leer_checkout_completado(payload, sig_header, endpoint_secret)
+    except ValueError as e:
+        print(f"ERROR: Payload inválido. {e}")
+        contar("firmas_invalidas")
+        return 400
+    except FirmaInvalida as e:
+        print(f"ERROR: Fallo en la verificación de la firma. {e}")
+        contar("firmas_invalidas")
+        return 400
+
+    if sesion is None:
+        contar("eventos_ignorados")
+        return 200
+
+    print(f"Webhook verificado y recibido: {TIPO_CHECKOUT_COMPLETADO}")
+    with evento(sesion.event_id, tipo=TIPO_CHECKOUT_COMPLETADO, origen="asgi", tienda=tienda.nombre), en_peticion():
+        return await manejar_checkout_async(sesion, tienda)
+
+
+async def manejar_checkout_async(sesion, tienda=None):
+    semaforo = _obtener_semaforo()
+    try:
+        await asyncio.wait_for(semaforo.acquire(), timeout=ESPERA_EN_VUELO)
+    except asyncio.TimeoutError:
+        # Demasiado trabajo en curso: Stripe lo reintentará más tarde
+        print("-> AVISO: límite de peticiones en vuelo alcanzado.")
+        contar("eventos_rechazados")
+        return 503
+
+    try:
+        event_id = sesion.event_id
+        with medir("idempotencia"):
+            estado = await reclamar_evento_async(event_id)
+        status = respuesta_evento_reclamado(event_id, estado)
+        if status is not None:
+            return status
+
+        trabajo = None
+        try:
+            trabajo = extraer_trabajo(sesion, tienda)
+            if modo_cola_activo():
+                with medir("encolar"):
+                    await obtener_cola().encolar_async(trabajo)
+                print(f"-> Evento {event_id} encolado para {trabajo['email']}")
+                anotar(resultado="encolado")
+            else:
+                enviado = await procesar_trabajo_async(trabajo)
+                anotar(resultado="enviado" if enviado else "correo_fallido")
+        except DependenciaCaida as e:
+            return await diferir_trabajo_async(event_id, trabajo, e)
+        except Exception as e:
+            print(f"-> ERROR al procesar la sesión de checkout: {e}")
+            await liberar_evento_async(event_id)
+            anotar_error(e)
+            return 500
+
+        await marcar_evento_hecho_async(event_id)
+        return 200
+    finally:
+        semaforo.release()
+
+
+async def _leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body'):
+            return b''.join(partes)
+
+
+async def _responder(send, status, cuerpo=b''):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(cuerpo)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                for pool_async in pools_smtp_async():
+                    await pool_async.cerrar_todo()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    if scope['path'] == '/metrics' and scope['method'] == 'GET':
+        await asyncio.to_thread(publicar_profundidad_outbox)
+        await _responder(send, 200, exportar_prometheus().encode())
+        return
+    # /api/webhook (tienda principal) o /api/webhook/<tienda>
+    ruta = scope['path'].rstrip('/')
+    if ruta == '/api/webhook':
+        nombre_tienda = None
+    elif ruta.startswith('/api/webhook/') and '/' not in ruta[len('/api/webhook/'):]:
+        nombre_tienda = ruta[len('/api/webhook/'):]
+    else:
+        await _responder(send, 404)
+        return
+    if scope['method'] != 'POST':
+        await _responder(send, 405)
+        return
+
+    payload = await _leer_cuerpo(receive)
+    cabeceras = dict(scope.get('headers') or [])
+    sig_header = cabeceras.get(b'stripe-signature', b'').decode('latin-1') or None
+
+    status = await manejar_webhook(payload, sig_header, nombre_tienda)
+    await _responder(send, status)
@@ -12,7 +12,7 @@ app = Flask(__name__)
 
 print("STRIPE VERSION:", stripe.VERSION)
 # 1. Importas únicamente la función encargada del registro
-from api.mbp_user_manager import registrar_cliente_con_password
+from api.mbp_user_manager_orig import registrar_cliente_con_password
 
 # Movemos la función de enviar correo fuera para que sea independiente
 def enviar_correo_confirmacion(destinatario, monto, moneda, nombre_cliente, direccion_envio, nombre_producto,ser):
@@ -0,0 +1,118 @@
+# worker.py
+#
+# Vacía la cola de envíos que llena el webhook en modo cola (WEBHOOK_MODO_COLA=1)
+# y con los eventos que difiere cuando Redis o Stripe no responden.
+# Uso:  python -m api.worker --concurrencia 4 --max-intentos 5
+#
+# Con WORKER_INTEGRADO=1 el propio webhook arranca los hilos del worker, para
+# despliegues sin un proceso aparte.
+
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api.config import obtener_config
+from api.cola_envios import obtener_cola
+from api.webhook import procesar_trabajo
+from api.metricas import evento, anotar, contar
+from api.resiliencia import calcular_retraso
+
+
+def procesar_uno(cola, ref, trabajo, max_intentos, base_retraso):
+    with evento(trabajo.get('event_id'), origen="worker", intento=trabajo.get('intentos', 0) + 1):
+        return _procesar_uno(cola, ref, trabajo, max_intentos, base_retraso)
+
+
+def _procesar_uno(cola, ref, trabajo, max_intentos, base_retraso):
+    try:
+        enviado = procesar_trabajo(trabajo)
+        if not enviado:
+            raise RuntimeError("El correo de confirmación no se pudo enviar.")
+        cola.confirmar(ref)
+        anotar(resultado="enviado")
+        return True
+    except Exception as e:
+        trabajo['intentos'] = trabajo.get('intentos', 0) + 1
+        trabajo['ultimo_error'] = str(e)
+
+        if trabajo['intentos'] >= max_intentos:
+            print(f"-> ERROR: evento {trabajo.get('event_id')} enviado a fallidos tras {trabajo['intentos']} intentos: {e}")
+            cola.mover_a_fallidos(ref, trabajo)
+            contar("trabajos_fallidos")
+            anotar(resultado="fallido", error=str(e))
+        else:
+            retraso = calcular_retraso(trabajo['intentos'], base_retraso)
+            print(f"-> Reintento {trabajo['intentos']} de {trabajo.get('event_id')} en {retraso:.1f}s: {e}")
+            cola.reprogramar(ref, trabajo, retraso)
+            contar("trabajos_reintentados")
+            anotar(resultado="reintento", error=str(e))
+        return False
+
+
+def bucle_worker(cola, parar, max_intentos, base_retraso):
+    while not parar.is_set():
+        try:
+            ref, trabajo = cola.obtener(timeout=1)
+            if trabajo is None:
+                continue
+            procesar_uno(cola, ref, trabajo, max_intentos, base_retraso)
+        except Exception as e:
+            # Un Redis caído un momento no puede dejar el proceso sin hilos; si
+            # el trabajo estaba en curso, vuelve a la cola al vencer su plazo
+            print(f"-> ERROR en el worker: {e}")
+            contar("errores_worker")
+            parar.wait(1)
+
+
+def ejecutar_worker(cola=None, concurrencia=1, max_intentos=5, base_retraso=2.0, parar=None):
+    """
+    Arranca `concurrencia` hilos que vacían la cola hasta que se activa `parar`.
+    """
+    cola = cola or obtener_cola()
+    parar = parar or threading.Event()
+
+    # Solo los de plazo vencido: los que tienen otros workers vivos siguen siendo suyos
+    recuperados = cola.recuperar_procesando()
+    if recuperados:
+        print(f"-> Recuperados {recuperados} trabajos que quedaron a medias.")
+
+    print(f"-> Worker arrancado con {concurrencia} hilos.")
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        for _ in range(concurrencia):
+            pool.submit(bucle_worker, cola, parar, max_intentos, base_retraso)
+        try:
+            while not parar.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("-> Parando worker...")
+            parar.set()
+
+
+def iniciar_en_segundo_plano(concurrencia=1, max_intentos=5, base_retraso=2.0):
+    """Worker en un hilo daemon del propio proceso. Devuelve el Event para pararlo."""
+    parar = threading.Event()
+    hilo = threading.Thread(
+        target=ejecutar_worker,
+        kwargs={"concurrencia": concurrencia, "max_intentos": max_intentos, "base_retraso": base_retraso,
+                "parar": parar},
+        name="worker-cola",
+        daemon=True,
+    )
+    hilo.start()
+    return parar
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de la cola de envíos del webhook.")
+    config = obtener_config()
+    parser.add_argument("--concurrencia", type=int, default=config.worker_concurrencia)
+    parser.add_argument("--max-intentos", type=int, default=config.worker_max_intentos)
+    parser.add_argument("--base-retraso", type=float, default=config.worker_base_retraso)
+    args = parser.parse_args()
+
+    ejecutar_worker(concurrencia=args.concurrencia, max_intentos=args.max_intentos, base_retraso=args.base_retraso)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_arranque.py
+#
+# Mide el arranque en frío del webhook: lanza un intérprete nuevo con
+# `python -X importtime -c "import api.webhook"` y resume el tiempo total de
+# imports y los módulos que más tardan.
+#
+# Uso:
+#   python -m benchmarks.bench_arranque
+#   python -m benchmarks.bench_arranque --modulo api.webhook_asgi --top 15 --salida arranque.json
+#   python -m benchmarks.bench_arranque --limite-ms 400     # sale con código 1 si se pasa
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _parsear_importtime(stderr):
+    """
+    Cada línea de -X importtime es "import time: propio | acumulado | módulo"
+    en microsegundos. Devuelve lista de (módulo, propio_us, acumulado_us).
+    """
+    filas = []
+    for linea in stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        try:
+            propio, acumulado, modulo = linea[len("import time:"):].split("|", 2)
+            filas.append((modulo.strip(), int(propio), int(acumulado)))
+        except ValueError:
+            continue
+    return filas
+
+
+def medir_arranque(modulo="api.webhook", top=10, entorno=None):
+    entorno = dict(os.environ if entorno is None else entorno)
+    # Sin calentar: queremos lo que paga la primera petición sin ayuda
+    entorno.pop("WEBHOOK_CALENTAR", None)
+
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RAIZ, env=entorno, capture_output=True, text=True,
+    )
+    pared = time.perf_counter() - inicio
+
+    filas = _parsear_importtime(proceso.stderr)
+    total = sum(propio for _, propio, _ in filas)
+    lentos = sorted(filas, key=lambda f: f[1], reverse=True)[:top]
+
+    return {
+        "modulo": modulo,
+        "ok": proceso.returncode == 0,
+        "error": proceso.stderr.strip().splitlines()[-1] if proceso.returncode else None,
+        "proceso_ms": round(pared * 1000, 1),
+        "imports_ms": round(total / 1000, 1),
+        "modulos_importados": len(filas),
+        "mas_lentos": [
+            {"modulo": nombre, "propio_ms": round(propio / 1000, 2), "acumulado_ms": round(acumulado / 1000, 2)}
+            for nombre, propio, acumulado in lentos
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío del webhook.")
+    parser.add_argument("--modulo", default="api.webhook")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--repeticiones", type=int, default=3, help="se queda con la más rápida")
+    parser.add_argument("--limite-ms", type=float, help="falla si el tiempo de imports supera este valor")
+    parser.add_argument("--salida", help="fichero JSON donde guardar el resultado")
+    args = parser.parse_args(argv)
+
+    resultados = [medir_arranque(args.modulo, args.top) for _ in range(max(1, args.repeticiones))]
+    resultado = min(resultados, key=lambda r: r["imports_ms"])
+
+    if not resultado["ok"]:
+        print(f"-> ERROR al importar {args.modulo}: {resultado['error']}")
+        return 2
+
+    print(f"{args.modulo}: {resultado['imports_ms']} ms en imports, "
+          f"{resultado['proceso_ms']} ms de proceso, {resultado['modulos_importados']} módulos")
+    for fila in resultado["mas_lentos"]:
+        print(f"  {fila['propio_ms']:>8.2f} ms  {fila['acumulado_ms']:>8.2f} ms  {fila['modulo']}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"-> Resultado guardado en {args.salida}")
+
+    if args.limite_ms is not None and resultado["imports_ms"] > args.limite_ms:
+        print(f"-> El arranque ({resultado['imports_ms']} ms) supera el límite de {args.limite_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
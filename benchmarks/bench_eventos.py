@@ -0,0 +1,132 @@
+# bench_eventos.py
+#
+# Microbenchmark de la lectura del webhook (firma + cuerpo), sin Redis ni SMTP:
+#   - construct_event: stripe.Webhook.construct_event y el árbol de StripeObject
+#   - rapido:          leer_checkout_completado (api/eventos_stripe.py)
+#
+# Mezcla eventos checkout.session.completed con otros tipos que Stripe también
+# manda (--ignorados), que es donde más se nota: esos ya no se decodifican.
+# Antes de medir comprueba que los dos dan el mismo trabajo para cada evento.
+#
+# Uso:
+#   python -m benchmarks.bench_eventos --eventos 5000 --ignorados 0.5
+
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from api.eventos_stripe import leer_checkout_completado, SesionCheckout, TIPO_CHECKOUT_COMPLETADO, cargar_json
+from benchmarks.utilidades import generar_evento, payload_firmado
+
+SECRETO = "whsec_bench"
+TIENDA = "principal"
+OTROS_TIPOS = ("payment_intent.succeeded", "charge.succeeded", "checkout.session.expired", "customer.updated")
+
+
+def generar_peticiones(eventos, ignorados, semilla=0):
+    rnd = random.Random(semilla)
+    peticiones = []
+    for i in range(eventos):
+        tipo = rnd.choice(OTROS_TIPOS) if rnd.random() < ignorados else TIPO_CHECKOUT_COMPLETADO
+        peticiones.append(payload_firmado(generar_evento(i, semilla, tipo), SECRETO))
+    return peticiones
+
+
+def leer_construct_event(payload, cabecera):
+    import stripe
+    event = stripe.Webhook.construct_event(payload, cabecera, SECRETO)
+    if event['type'] != TIPO_CHECKOUT_COMPLETADO:
+        return None
+    return SesionCheckout.desde_evento(event)
+
+
+def leer_rapido(payload, cabecera):
+    return leer_checkout_completado(payload, cabecera, SECRETO)
+
+
+def _trabajo(sesion):
+    return None if sesion is None else sesion.como_trabajo(TIENDA)
+
+
+def comprobar_equivalencia(leer, peticiones):
+    for payload, cabecera in peticiones:
+        esperado = None
+        evento = cargar_json(payload)
+        if evento['type'] == TIPO_CHECKOUT_COMPLETADO:
+            esperado = SesionCheckout.desde_evento(evento).como_trabajo(TIENDA)
+        if _trabajo(leer(payload, cabecera)) != esperado:
+            return False
+    return True
+
+
+def medir(leer, peticiones):
+    # La primera llamada paga imports y cachés, fuera de la medida
+    leer(*peticiones[0])
+
+    inicio_cpu = time.process_time()
+    inicio = time.perf_counter()
+    for payload, cabecera in peticiones:
+        leer(payload, cabecera)
+    pared = time.perf_counter() - inicio
+    cpu = time.process_time() - inicio_cpu
+
+    # Memoria en una pasada aparte: tracemalloc ralentiza mucho
+    muestras = peticiones[:min(500, len(peticiones))]
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        actual_antes, _ = tracemalloc.get_traced_memory()
+        for payload, cabecera in muestras:
+            leer(payload, cabecera)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "eventos": len(peticiones),
+        "us_por_evento": round(pared / len(peticiones) * 1e6, 1),
+        "cpu_us_por_evento": round(cpu / len(peticiones) * 1e6, 1),
+        "pico_kb": round((pico - actual_antes) / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark de la lectura de los webhooks de Stripe.")
+    parser.add_argument("--eventos", type=int, default=5000)
+    parser.add_argument("--ignorados", type=float, default=0.5, help="fracción de eventos de tipos no gestionados")
+    parser.add_argument("--salida", help="fichero JSON donde guardar el resultado")
+    args = parser.parse_args(argv)
+
+    peticiones = generar_peticiones(args.eventos, args.ignorados)
+    lectores = {"rapido": leer_rapido}
+    try:
+        import stripe  # noqa: F401
+        lectores["construct_event"] = leer_construct_event
+    except ImportError:
+        print("-> AVISO: stripe no está instalado; solo se mide la lectura rápida.")
+
+    resultado = {"backend_json": cargar_json.__module__, "ignorados": args.ignorados}
+    for nombre, leer in lectores.items():
+        if not comprobar_equivalencia(leer, peticiones[:200]):
+            print(f"-> ERROR: '{nombre}' no da el mismo trabajo que el evento decodificado")
+            return 1
+        resultado[nombre] = medir(leer, peticiones)
+
+    if "construct_event" in resultado:
+        antes, ahora = resultado["construct_event"], resultado["rapido"]
+        resultado["mejora_cpu"] = round(antes["cpu_us_por_evento"] / ahora["cpu_us_por_evento"], 1) \
+            if ahora["cpu_us_por_evento"] else None
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"-> Resultado guardado en {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# bench_hashing.py
+#
+# Mide cuántos hashes de contraseña por segundo saca el pool de procesos y la
+# latencia p50/p99 de cada hash, para distintos tamaños de pool.
+#
+# Uso:  python -m benchmarks.bench_hashing --perfil produccion --procesos 0 1 2 4 --hashes 200
+
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api.hashing import PoolHashing, PERFILES_HASH
+from benchmarks.utilidades import percentil
+
+
+def medir(procesos, perfil, hashes, concurrencia):
+    pool = PoolHashing(procesos=procesos, perfil=perfil, max_pendientes=max(concurrencia, 1) * 2, espera=60)
+    latencias = []
+    lock = threading.Lock()
+
+    def un_hash(i):
+        inicio = time.perf_counter()
+        pool.generar_hash(f"password{i}")
+        with lock:
+            latencias.append(time.perf_counter() - inicio)
+
+    # Calentamos el pool para no medir el arranque de los procesos
+    pool.generar_hash("calentamiento")
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as hilos:
+        list(hilos.map(un_hash, range(hashes)))
+    total = time.perf_counter() - inicio
+    pool.cerrar()
+
+    return {
+        "procesos": procesos,
+        "hashes_por_segundo": hashes / total,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pool de hashing de contraseñas.")
+    parser.add_argument("--perfil", default="estandar", choices=list(PERFILES_HASH))
+    parser.add_argument("--procesos", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--hashes", type=int, default=100)
+    parser.add_argument("--concurrencia", type=int, default=8, help="hilos que piden hashes a la vez")
+    args = parser.parse_args()
+
+    print(f"Perfil: {args.perfil}  hashes: {args.hashes}  concurrencia: {args.concurrencia}")
+    print(f"{'procesos':>9} {'hashes/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for procesos in args.procesos:
+        r = medir(procesos, args.perfil, args.hashes, args.concurrencia)
+        print(f"{r['procesos']:>9} {r['hashes_por_segundo']:>10.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# bench_mensajes.py
+#
+# Microbenchmark del montaje del correo de confirmación:
+#   - email_message: EmailMessage + add_alternative + aplanado como hace send_message
+#   - preparado:     EsqueletoCorreo (api/mensajes.py), bytes listos para sendmail
+#
+# Antes de medir comprueba que los dos dan el mismo contenido una vez
+# decodificado (cabeceras y partes de texto y HTML).
+#
+# Uso:
+#   python -m benchmarks.bench_mensajes --correos 2000 --plantilla correo_template_metodo_cexiste.html
+
+import sys
+import json
+import time
+import email
+import argparse
+import tracemalloc
+from email import policy
+from email.generator import BytesGenerator
+from io import BytesIO
+
+from api.plantillas import obtener_registro_plantillas
+from api.mensajes import obtener_esqueleto, construir_email_message
+
+REMITENTE = "tienda@example.com"
+NOMBRE = "Mi Cosmética Natural"
+ASUNTO = "Tu pedido en micosmeticanatural.com ha sido confirmado."
+
+
+def valores_pedido(i):
+    return {
+        "NOMBRE_CLIENTE": f"Clienta Número {i}",
+        "MONTO_PAGO": f"{19.9 + i % 50:.2f} EUR",
+        "DIRECCION_ENTREGA": "Calle Mayor 1<br>28001 Madrid, M<br>ES",
+        "NOMBRE_PRODUCTO": "Método Barrera Primero",
+        "CORREO_ACCESO": f"cliente{i}@example.com",
+        "PASSWORD_PLANA": "aB3dE6gH",
+    }
+
+
+def valores_largos(i):
+    """Valores de una línea de más de 76 caracteres y con tildes: obligan a cortar en quoted-printable."""
+    valores = valores_pedido(i)
+    valores["DIRECCION_ENTREGA"] = ("Avenida de la Constitución 123, Escalera B, 4º Izquierda, "
+                                    "Urbanización Los Almendros<br>41004 Sevilla, Andalucía<br>ES")
+    valores["NOMBRE_PRODUCTO"] = ", ".join(["Método Barrera Primero", "Reto Timón 21 días",
+                                            "Sérum Antioxidante Vitamina C", "Jabón artesanal de caléndula"])
+    return valores
+
+
+def montar_email_message(plantilla, valores, destinatario):
+    msg = construir_email_message(REMITENTE, NOMBRE, ASUNTO, True, destinatario, plantilla.renderizar(valores))
+    # Lo mismo que hace smtplib.send_message antes de mandar
+    salida = BytesIO()
+    BytesGenerator(salida, policy=msg.policy.clone(linesep="\r\n")).flatten(msg, linesep="\r\n")
+    return salida.getvalue()
+
+
+def montar_preparado(plantilla, valores, destinatario):
+    esqueleto = obtener_esqueleto(REMITENTE, NOMBRE, ASUNTO, True)
+    return esqueleto.construir(plantilla, valores, destinatario).datos
+
+
+def _contenido(datos):
+    msg = email.message_from_bytes(datos, policy=policy.default)
+    cabeceras = {c: str(msg[c]) for c in ("From", "To", "Cc", "Subject")}
+    partes = [(p.get_content_type(), p.get_content()) for p in msg.iter_parts()]
+    return cabeceras, partes
+
+
+def comprobar_equivalencia(plantilla):
+    for valores in (valores_pedido(7), valores_largos(7)):
+        preparado = montar_preparado(plantilla, valores, "cliente7@example.com")
+        # SMTP exige CRLF: ni un LF suelto, tampoco en los saltos blandos de quoted-printable
+        if preparado.replace(b"\r\n", b"").count(b"\n"):
+            return False
+        if _contenido(montar_email_message(plantilla, valores, "cliente7@example.com")) != _contenido(preparado):
+            return False
+    return True
+
+
+def medir(montar, plantilla, correos):
+    # Calentamos cachés (esqueleto, trozos en QP) fuera de la medida
+    montar(plantilla, valores_pedido(0), "cliente0@example.com")
+    pedidos = [(valores_pedido(i), f"cliente{i}@example.com") for i in range(correos)]
+
+    inicio_cpu = time.process_time()
+    inicio = time.perf_counter()
+    for valores, destinatario in pedidos:
+        montar(plantilla, valores, destinatario)
+    pared = time.perf_counter() - inicio
+    cpu = time.process_time() - inicio_cpu
+
+    # Memoria en una pasada aparte: tracemalloc ralentiza mucho
+    muestras = pedidos[:min(200, correos)]
+    tracemalloc.start()
+    try:
+        bloques_antes = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        actual_antes, _ = tracemalloc.get_traced_memory()
+        for valores, destinatario in muestras:
+            montar(plantilla, valores, destinatario)
+        _, pico = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    asignaciones = sum(stat.count for stat in snapshot.statistics("filename"))
+
+    return {
+        "correos": correos,
+        "us_por_correo": round(pared / correos * 1e6, 1),
+        "cpu_us_por_correo": round(cpu / correos * 1e6, 1),
+        "correos_por_segundo": round(correos / pared, 1) if pared else 0.0,
+        "pico_kb": round((pico - actual_antes) / 1024, 1),
+        "bloques_vivos_al_final": asignaciones,
+        "bloques_netos": sys.getallocatedblocks() - bloques_antes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark del montaje del correo de confirmación.")
+    parser.add_argument("--correos", type=int, default=2000)
+    parser.add_argument("--plantilla", default="correo_template_metodo.html")
+    parser.add_argument("--salida", help="fichero JSON donde guardar el resultado")
+    args = parser.parse_args(argv)
+
+    plantilla = obtener_registro_plantillas().obtener(args.plantilla)
+    if not comprobar_equivalencia(plantilla):
+        print("-> ERROR: el mensaje preparado no tiene el mismo contenido que el de EmailMessage")
+        return 1
+
+    resultado = {
+        "plantilla": args.plantilla,
+        "email_message": medir(montar_email_message, plantilla, args.correos),
+        "preparado": medir(montar_preparado, plantilla, args.correos),
+    }
+    antes, ahora = resultado["email_message"], resultado["preparado"]
+    resultado["mejora_cpu"] = round(antes["cpu_us_por_correo"] / ahora["cpu_us_por_correo"], 1) \
+        if ahora["cpu_us_por_correo"] else None
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"-> Resultado guardado en {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
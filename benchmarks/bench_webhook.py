@@ -0,0 +1,281 @@
+# bench_webhook.py
+#
+# Benchmark reproducible del webhook completo sin salir de la máquina:
+#   - eventos checkout.session.completed sintéticos, firmados de verdad
+#   - Stripe falso (api/stripe_falso.py)
+#   - fakeredis o un Redis local (--redis-url)
+#   - servidor SMTP de pega en local (benchmarks/utilidades.py)
+#
+# Mide el webhook Flask a través del test client y de un servidor WSGI real
+# (y opcionalmente el arranque en frío, ver bench_arranque.py), y guarda el resultado en JSON para poder comparar entre commits.
+#
+# Uso:
+#   python -m benchmarks.bench_webhook --peticiones 500 --salida resultados.json
+#   python -m benchmarks.bench_webhook --redis-url redis://localhost:6379/15 --comparar anterior.json
+#
+# Nota: con fakeredis, los scripts Lua necesitan el paquete `lupa`.
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import contextlib
+import subprocess
+import tracemalloc
+import http.client
+from datetime import datetime, timezone
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from api.hashing import PERFILES_HASH
+from benchmarks.utilidades import (
+    PRODUCTOS,
+    ServidorSMTPFalso,
+    generar_evento,
+    payload_firmado,
+    percentil,
+)
+
+SECRETO_WEBHOOK = "whsec_benchmark"
+
+
+class _ServidorWSGIConHilos(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _ManejadorSilencioso(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def preparar_entorno(args, smtp):
+    """Variables de entorno y dependencias falsas. Se llama antes de importar api.webhook."""
+    os.environ.update({
+        "STRIPE_WEBHOOK_SECRET": SECRETO_WEBHOOK,
+        "STRIPE_SECRET_KEY": "sk_test_benchmark",
+        "CORREO_USER": "tienda@example.com",
+        "CORREO_PASS": "benchmark",
+        "NOMBRE_CORREO": "Benchmark",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp.puerto),
+        "SMTP_SSL": "0",
+        "SMTP_MAX_CONEXIONES": str(args.smtp_conexiones),
+        "HASH_PROCESOS": str(args.procesos_hash),
+    })
+    if args.perfil_hash:
+        os.environ["HASH_PERFIL"] = args.perfil_hash
+    else:
+        # Sin perfil se mide el webhook y no el hash: una sola iteración de pbkdf2
+        from api.hashing import PoolHashing, configurar_pool_hashing
+        configurar_pool_hashing(PoolHashing(procesos=args.procesos_hash, metodo="pbkdf2:sha256:1"))
+
+    from api.mbp_user_manager import configurar_cliente_redis
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        import fakeredis
+        configurar_cliente_redis(fakeredis.FakeRedis(decode_responses=True))
+
+    from api.productos import configurar_cliente_stripe
+    from api.stripe_falso import ClienteStripeFalso
+    configurar_cliente_stripe(ClienteStripeFalso(line_items_por_defecto=[PRODUCTOS[0]]))
+
+    # La configuración se lee al importar api.config; por si algo la importó antes
+    from api.config import recargar_config
+    from api.tiendas import recargar_tiendas
+    recargar_config()
+    recargar_tiendas()
+
+
+def generar_peticiones(n, semilla):
+    return [payload_firmado(generar_evento(i, semilla), SECRETO_WEBHOOK) for i in range(n)]
+
+
+def _lanzar(enviar, peticiones, concurrencia):
+    latencias = []
+    errores = 0
+    lock = threading.Lock()
+
+    def una(peticion):
+        nonlocal errores
+        inicio = time.perf_counter()
+        status = enviar(*peticion)
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+            if status != 200:
+                errores += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as hilos:
+        list(hilos.map(una, peticiones))
+    total = time.perf_counter() - inicio
+    return latencias, errores, total
+
+
+def _resumen(latencias, errores, total):
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "peticiones_por_segundo": round(len(latencias) / total, 2) if total else 0.0,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 3),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 3),
+    }
+
+
+def medir_test_client(app, peticiones, concurrencia):
+    cliente = app.test_client()
+
+    def enviar(payload, firma):
+        return cliente.post('/api/webhook', data=payload, headers={'Stripe-Signature': firma}).status_code
+
+    return _lanzar(enviar, peticiones, concurrencia)
+
+
+def medir_wsgi(app, peticiones, concurrencia):
+    servidor = make_server("127.0.0.1", 0, app, server_class=_ServidorWSGIConHilos, handler_class=_ManejadorSilencioso)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    puerto = servidor.server_address[1]
+
+    def enviar(payload, firma):
+        conexion = http.client.HTTPConnection("127.0.0.1", puerto, timeout=30)
+        try:
+            conexion.request("POST", "/api/webhook", body=payload,
+                             headers={"Stripe-Signature": firma, "Content-Type": "application/json"})
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            return respuesta.status
+        finally:
+            conexion.close()
+
+    try:
+        return _lanzar(enviar, peticiones, concurrencia)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def medir_memoria(app, peticiones):
+    """Memoria pico y bloques netos por petición, de una en una con tracemalloc."""
+    cliente = app.test_client()
+    picos = []
+    bloques = []
+
+    tracemalloc.start()
+    try:
+        for payload, firma in peticiones:
+            bloques_antes = sys.getallocatedblocks()
+            actual_antes, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            cliente.post('/api/webhook', data=payload, headers={'Stripe-Signature': firma})
+            _, pico = tracemalloc.get_traced_memory()
+            picos.append(pico - actual_antes)
+            bloques.append(sys.getallocatedblocks() - bloques_antes)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peticiones": len(peticiones),
+        "pico_kb_medio": round(sum(picos) / len(picos) / 1024, 2) if picos else 0.0,
+        "bloques_netos_medios": round(sum(bloques) / len(bloques), 1) if bloques else 0.0,
+    }
+
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def comparar(actual, anterior):
+    print(f"\nComparación con {anterior.get('commit')} ({anterior.get('fecha')}):")
+    for modo, datos in actual["resultados"].items():
+        previo = anterior.get("resultados", {}).get(modo)
+        if not previo or "peticiones_por_segundo" not in datos:
+            continue
+        for clave in ("peticiones_por_segundo", "p50_ms", "p99_ms"):
+            antes, ahora = previo.get(clave), datos.get(clave)
+            if antes:
+                print(f"  {modo:12} {clave:24} {antes:>10} -> {ahora:>10} ({(ahora - antes) / antes * 100:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del webhook de Stripe.")
+    parser.add_argument("--peticiones", type=int, default=300)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--modos", nargs="+", default=["test_client", "wsgi", "memoria"],
+                        choices=["test_client", "wsgi", "memoria", "arranque"])
+    parser.add_argument("--muestras-memoria", type=int, default=50)
+    parser.add_argument("--redis-url", help="Redis local; si no se indica se usa fakeredis")
+    parser.add_argument("--smtp-conexiones", type=int, default=4)
+    parser.add_argument("--perfil-hash", choices=list(PERFILES_HASH),
+                        help="coste real del hash (HASH_PERFIL); sin él, uno casi gratuito")
+    parser.add_argument("--procesos-hash", type=int, default=0)
+    parser.add_argument("--salida", help="fichero JSON donde guardar el resultado")
+    parser.add_argument("--comparar", help="resultado JSON anterior con el que comparar")
+    parser.add_argument("--verbose", action="store_true", help="mostrar los logs del webhook")
+    args = parser.parse_args(argv)
+
+    smtp = ServidorSMTPFalso().arrancar()
+    preparar_entorno(args, smtp)
+
+    from api import metricas
+    from api.webhook import app
+
+    resultado = {
+        "commit": _commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parametros": vars(args),
+        "resultados": {},
+    }
+
+    # Cada modo usa su propia semilla: si no, la idempotencia los daría por duplicados
+    for semilla, modo in enumerate(args.modos, start=1):
+        metricas.reiniciar()
+        # Los print y las líneas JSON del webhook se tragan salvo con --verbose
+        silencio = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+        if modo == "arranque":
+            from benchmarks.bench_arranque import medir_arranque
+            resultado["resultados"][modo] = medir_arranque()
+            continue
+
+        if modo == "memoria":
+            with silencio:
+                resultado["resultados"][modo] = medir_memoria(app, generar_peticiones(args.muestras_memoria, semilla))
+            continue
+
+        peticiones = generar_peticiones(args.peticiones, semilla)
+        medir = medir_test_client if modo == "test_client" else medir_wsgi
+        with silencio:
+            datos = _resumen(*medir(app, peticiones, args.concurrencia))
+        datos["etapas"] = metricas.instantanea()["etapas"]
+        datos["contadores"] = metricas.instantanea()["contadores"]
+        resultado["resultados"][modo] = datos
+
+    resultado["smtp_mensajes_recibidos"] = smtp.mensajes
+    smtp.parar()
+
+    print(json.dumps(resultado["resultados"], indent=2, ensure_ascii=False))
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"-> Resultado guardado en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
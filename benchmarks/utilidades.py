@@ -0,0 +1,154 @@
+# utilidades.py
+#
+# Piezas comunes de los benchmarks: eventos de Stripe sintéticos firmados,
+# un servidor SMTP de pega y cálculo de percentiles.
+
+import hmac
+import json
+import time
+import random
+import hashlib
+import threading
+import socketserver
+
+
+PRODUCTOS = (
+    {"description": "Sérum Antioxidante Vitamina C", "price_id": "price_antiox"},
+    {"description": "Método Barrera Primero", "price_id": "price_mbp"},
+    {"description": "Reto Timón 21 días", "price_id": "price_timon"},
+    {"description": "Jabón artesanal", "price_id": "price_jabon"},
+)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def firmar_payload(payload, secreto, timestamp=None):
+    """Cabecera Stripe-Signature igual que la que manda Stripe (esquema v1)."""
+    timestamp = int(timestamp or time.time())
+    firmado = f"{timestamp}.".encode() + payload
+    firma = hmac.new(secreto.encode(), firmado, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={firma}"
+
+
+def generar_evento(i, semilla=0, tipo="checkout.session.completed", con_line_items=None):
+    """
+    Evento checkout.session.completed sintético y reproducible. Unos clientes
+    se repiten (para tener clientes existentes) y unas sesiones traen los line
+    items expandidos y otras no.
+    """
+    rnd = random.Random(semilla * 1_000_003 + i)
+    producto = PRODUCTOS[rnd.randrange(len(PRODUCTOS))]
+    if con_line_items is None:
+        con_line_items = rnd.random() < 0.5
+
+    session = {
+        "id": f"cs_bench_{semilla}_{i}",
+        "object": "checkout.session",
+        "amount_total": rnd.randrange(1000, 20000),
+        "currency": "eur",
+        "customer_details": {
+            "email": f"cliente{rnd.randrange(max(1, i // 2 + 1))}@example.com",
+            "name": "cliente de prueba",
+        },
+        "shipping_details": {
+            "name": "cliente de prueba",
+            "address": {
+                "line1": "Calle Mayor 1", "line2": None, "postal_code": "28001",
+                "city": "Madrid", "state": "M", "country": "ES",
+            },
+        },
+    }
+    if con_line_items:
+        session["line_items"] = {
+            "object": "list",
+            "data": [{"description": producto["description"], "price": {"id": producto["price_id"]}}],
+        }
+
+    return {
+        "id": f"evt_bench_{semilla}_{i}",
+        "object": "event",
+        "type": tipo,
+        "created": int(time.time()),
+        "data": {"object": session},
+    }
+
+
+def payload_firmado(evento, secreto):
+    payload = json.dumps(evento, separators=(",", ":")).encode()
+    return payload, firmar_payload(payload, secreto)
+
+
+class _ManejadorSMTP(socketserver.StreamRequestHandler):
+    """
+    Lo justo de SMTP para que smtplib envíe: EHLO, AUTH PLAIN, MAIL, RCPT,
+    DATA, NOOP, RSET y QUIT. Acepta cualquier usuario y descarta los mensajes.
+    """
+
+    def _responder(self, linea):
+        self.wfile.write(linea.encode() + b"\r\n")
+
+    def handle(self):
+        self._responder("220 stub ESMTP")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode("latin-1").strip().upper()
+
+            if comando.startswith(("EHLO", "HELO")):
+                self.wfile.write(b"250-stub\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n")
+            elif comando.startswith("AUTH"):
+                self._responder("235 2.7.0 Autenticado")
+            elif comando.startswith("DATA"):
+                self._responder("354 Adelante")
+                tamaño = 0
+                while True:
+                    datos = self.rfile.readline()
+                    if not datos or datos == b".\r\n":
+                        break
+                    tamaño += len(datos)
+                self.server.registrar(tamaño)
+                self._responder("250 2.0.0 Recibido")
+            elif comando.startswith("QUIT"):
+                self._responder("221 Hasta luego")
+                return
+            else:
+                # MAIL, RCPT, NOOP, RSET...
+                self._responder("250 OK")
+
+
+class ServidorSMTPFalso(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", puerto=0):
+        super().__init__((host, puerto), _ManejadorSMTP)
+        self.mensajes = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    @property
+    def puerto(self):
+        return self.server_address[1]
+
+    def registrar(self, tamaño):
+        with self._lock:
+            self.mensajes += 1
+            self.bytes += tamaño
+
+    def arrancar(self):
+        self._hilo = threading.Thread(target=self.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        self.shutdown()
+        self.server_close()
+
@@ -0,0 +1,72 @@
+# conftest.py
+#
+# Entorno común de las pruebas: variables mínimas para que api.config no avise,
+# hashing rápido y Redis en memoria (fakeredis con lupa para los scripts Lua).
+
+import os
+
+import pytest
+
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_pruebas")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_pruebas")
+os.environ.setdefault("CORREO_USER", "tienda@example.com")
+os.environ.setdefault("CORREO_PASS", "pruebas")
+os.environ.setdefault("SMTP_SERVER", "127.0.0.1")
+os.environ.setdefault("SMTP_PORT", "2525")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+# Sin servidor SMTP en las pruebas: los correos se quedan en el outbox
+os.environ.setdefault("OUTBOX_ENVIO_INMEDIATO", "0")
+
+# Hash de una sola iteración: ningún perfil de HASH_PERFIL es tan barato, a propósito
+METODO_HASH_PRUEBAS = "pbkdf2:sha256:1"
+
+from api.hashing import PoolHashing, configurar_pool_hashing  # noqa: E402
+
+configurar_pool_hashing(PoolHashing(metodo=METODO_HASH_PRUEBAS))
+
+
+@pytest.fixture
+def redis_falso():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from api.mbp_user_manager import configurar_cliente_redis, configurar_cliente_redis_async
+
+    # El cliente asyncio (webhook ASGI) ve los mismos datos que el normal
+    servidor = fakeredis.FakeServer()
+    cliente = fakeredis.FakeRedis(server=servidor, decode_responses=True)
+    configurar_cliente_redis(cliente)
+    configurar_cliente_redis_async(fakeredis.FakeAsyncRedis(server=servidor, decode_responses=True))
+    yield cliente
+    configurar_cliente_redis(None)
+    configurar_cliente_redis_async(None)
+
+
+def sesion_checkout(session_id, email="cliente@example.com", descripcion="Método Barrera Primero", **campos):
+    """Sesión de checkout pagada, con los line items expandidos (no hace falta Stripe)."""
+    session = {
+        "id": session_id,
+        "object": "checkout.session",
+        "status": "complete",
+        "payment_status": "paid",
+        "amount_total": 4900,
+        "currency": "eur",
+        "customer_details": {"email": email, "name": "cliente de prueba"},
+        "line_items": {"data": [{"description": descripcion, "price": {"id": "price_mbp"}}]},
+    }
+    session.update(campos)
+    return session
+
+
+@pytest.fixture
+def entorno(monkeypatch):
+    """Cambia variables de entorno y recarga la configuración; al terminar se deja como estaba."""
+    from api.config import recargar_config
+
+    def cambiar(**variables):
+        for nombre, valor in variables.items():
+            monkeypatch.setenv(nombre, valor)
+        return recargar_config()
+
+    yield cambiar
+    monkeypatch.undo()
+    recargar_config()
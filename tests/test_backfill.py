@@ -0,0 +1,80 @@
+import pytest
+
+from api.backfill import Checkpoint, ejecutar_backfill, _fecha_a_timestamp
+from api.outbox import PREFIJO_ENTRADA
+from api.webhook import extraer_trabajo, procesar_trabajo
+from tests.conftest import sesion_checkout
+
+
+def entradas(r):
+    return sorted(r.scan_iter(f"{PREFIJO_ENTRADA}*"))
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    ruta = tmp_path / "backfill.ckpt"
+    abiertos = []
+
+    def abrir():
+        abiertos.append(Checkpoint(str(ruta)))
+        return abiertos[-1]
+
+    yield abrir
+    for ckpt in abiertos:
+        ckpt.cerrar()
+
+
+def test_reanuda_desde_el_checkpoint(redis_falso, checkpoint):
+    sesiones = [sesion_checkout(f"cs_{i}", email=f"cliente{i}@example.com") for i in range(3)]
+
+    resumen = ejecutar_backfill(sesiones[:2], paralelo=2, checkpoint=checkpoint())
+    assert (resumen["procesadas"], resumen["saltadas"]) == (2, 0)
+
+    # Se relanza con la lista entera: solo falta la tercera
+    segundo = checkpoint()
+    resumen = ejecutar_backfill(sesiones, paralelo=2, checkpoint=segundo)
+    assert (resumen["procesadas"], resumen["saltadas"]) == (1, 2)
+    assert segundo.hechas == {"cs_0", "cs_1", "cs_2"}
+    assert len(entradas(redis_falso)) == 3
+
+
+def test_las_fallidas_no_se_marcan(redis_falso, checkpoint):
+    sin_email = sesion_checkout("cs_roto", customer_details={})
+    ckpt = checkpoint()
+
+    resumen = ejecutar_backfill([sin_email], checkpoint=ckpt)
+
+    assert resumen["fallidas"] == 1
+    assert "cs_roto" not in ckpt
+
+
+def test_solo_sesiones_completadas_y_pagadas(redis_falso):
+    sesiones = [
+        sesion_checkout("cs_pagada"),
+        sesion_checkout("cs_sin_pagar", email="otro@example.com", payment_status="unpaid"),
+        sesion_checkout("cs_abierta", email="otro2@example.com", status="open"),
+    ]
+
+    resumen = ejecutar_backfill(sesiones)
+
+    assert (resumen["procesadas"], resumen["no_pagadas"]) == (1, 2)
+    assert entradas(redis_falso) == [f"{PREFIJO_ENTRADA}backfill:cs_pagada"]
+
+
+def test_no_repite_el_correo_que_ya_mando_el_webhook(redis_falso):
+    session = sesion_checkout("cs_1")
+    assert procesar_trabajo(extraer_trabajo({"id": "evt_1", "data": {"object": session}}))
+
+    resumen = ejecutar_backfill([session])
+
+    assert resumen["procesadas"] == 1
+    assert entradas(redis_falso) == [f"{PREFIJO_ENTRADA}evt_1"]
+
+
+def test_fechas_con_y_sin_zona_horaria():
+    # 2024-01-01T00:00:00Z
+    assert _fecha_a_timestamp("2024-01-01T00:00:00") == 1704067200
+    assert _fecha_a_timestamp("2024-01-01T00:00:00+00:00") == 1704067200
+    assert _fecha_a_timestamp("2024-01-01T01:00:00+01:00") == 1704067200
+    assert _fecha_a_timestamp("2023-12-31T19:00:00-05:00") == 1704067200
+    assert _fecha_a_timestamp(None) is None
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+from api.cola_envios import ColaRedis, ColaSQLite, CLAVE_FALLIDOS, CLAVE_PENDIENTES, obtener_cola
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def crear_cola(request):
+    if request.param == "sqlite":
+        return lambda plazo=300: ColaSQLite(plazo=plazo)
+    cliente = request.getfixturevalue("redis_falso")
+    return lambda plazo=300: ColaRedis(cliente, plazo=plazo)
+
+
+def test_obtener_y_confirmar(crear_cola):
+    cola = crear_cola()
+    cola.encolar({"event_id": "evt_1"})
+
+    ref, trabajo = cola.obtener(timeout=0)
+    assert trabajo == {"event_id": "evt_1"}
+    cola.confirmar(ref)
+
+    assert cola.obtener(timeout=0) == (None, None)
+    assert cola.recuperar_procesando() == 0
+
+
+def test_reprogramar_espera_el_retraso(crear_cola):
+    cola = crear_cola()
+    cola.encolar({"event_id": "evt_1"})
+    ref, trabajo = cola.obtener(timeout=0)
+
+    trabajo["intentos"] = 1
+    cola.reprogramar(ref, trabajo, 0.3)
+    assert cola.obtener(timeout=0) == (None, None)
+
+    time.sleep(0.35)
+    _, de_nuevo = cola.obtener(timeout=0)
+    assert de_nuevo == {"event_id": "evt_1", "intentos": 1}
+
+
+def test_mover_a_fallidos(crear_cola):
+    cola = crear_cola()
+    cola.encolar({"event_id": "evt_1"})
+    ref, trabajo = cola.obtener(timeout=0)
+
+    cola.mover_a_fallidos(ref, dict(trabajo, ultimo_error="boom"))
+
+    assert cola.fallidos() == [{"event_id": "evt_1", "ultimo_error": "boom"}]
+    assert cola.obtener(timeout=0) == (None, None)
+
+
+def test_no_recupera_trabajos_de_otro_worker_vivo(crear_cola):
+    cola = crear_cola(plazo=300)
+    cola.encolar({"event_id": "evt_1"})
+    assert cola.obtener(timeout=0)[1] is not None
+
+    # Arranca otro worker mientras el primero sigue con el trabajo
+    assert cola.recuperar_procesando() == 0
+    assert cola.obtener(timeout=0) == (None, None)
+
+
+def test_recupera_trabajos_con_plazo_vencido(crear_cola):
+    cola = crear_cola(plazo=0.2)
+    cola.encolar({"event_id": "evt_1"})
+    assert cola.obtener(timeout=0)[1] is not None
+
+    time.sleep(0.25)
+    assert cola.recuperar_procesando() == 1
+    ref, trabajo = cola.obtener(timeout=0)
+    assert trabajo == {"event_id": "evt_1"}
+    cola.confirmar(ref)
+
+
+def test_obtener_retoma_plazos_vencidos_sin_reiniciar(crear_cola):
+    cola = crear_cola(plazo=0.2)
+    cola.encolar({"event_id": "evt_1"})
+    assert cola.obtener(timeout=0)[1] is not None
+
+    time.sleep(0.25)
+    assert cola.obtener(timeout=0)[1] == {"event_id": "evt_1"}
+
+
+def test_trabajo_ilegible_va_a_fallidos(redis_falso):
+    cola = ColaRedis(redis_falso)
+    redis_falso.lpush(CLAVE_PENDIENTES, "{no es json")
+
+    assert cola.obtener(timeout=0) == (None, None)
+    assert cola.fallidos() == [{"ilegible": "{no es json"}]
+    assert redis_falso.llen(CLAVE_FALLIDOS) == 1
+
+
+def test_obtener_cola_reutiliza_la_instancia(redis_falso, entorno, tmp_path):
+    entorno(COLA_BACKEND="sqlite", COLA_SQLITE_PATH=str(tmp_path / "cola.sqlite3"))
+    cola = obtener_cola()
+
+    assert isinstance(cola, ColaSQLite)
+    assert obtener_cola() is cola
+
+    # Cambia la configuración: otra cola
+    entorno(COLA_BACKEND="redis")
+    cola_redis = obtener_cola()
+    assert isinstance(cola_redis, ColaRedis)
+    assert obtener_cola() is cola_redis
+
+
+def test_obtener_cola_sigue_al_cliente_de_redis(redis_falso):
+    from api.mbp_user_manager import configurar_cliente_redis
+    fakeredis = pytest.importorskip("fakeredis")
+    cola = obtener_cola()
+    assert obtener_cola() is cola
+
+    configurar_cliente_redis(fakeredis.FakeRedis(decode_responses=True))
+
+    assert obtener_cola() is not cola
@@ -0,0 +1,134 @@
+import time
+import threading
+
+import pytest
+
+from api import correo_lotes
+from api.correo_lotes import LoteCorreos, DigestComerciante, iniciar_digests
+from api.tiendas import listar_tiendas
+from api.smtp_pool import EnvioIncierto
+
+
+class PoolFalso:
+
+    def __init__(self, fallar=False):
+        self.fallar = fallar
+        self.enviados = []
+        self.soltar = threading.Event()
+        self.soltar.set()
+
+    def enviar(self, msg):
+        if self.fallar:
+            raise ConnectionError("smtp caído")
+        self.enviados.append(msg)
+        return True
+
+    def enviar_lote(self, mensajes):
+        self.soltar.wait(5)
+        self.enviados.extend(mensajes)
+        return [None] * len(mensajes)
+
+
+def test_lote_cancela_lo_que_no_llego_a_salir():
+    pool = PoolFalso()
+    lote = LoteCorreos(pool, tamaño_lote=10, espera_max=1)
+
+    with pytest.raises(TimeoutError):
+        lote.enviar("correo", timeout=0.05)
+    lote.cerrar()
+
+    assert pool.enviados == []
+
+
+def test_lote_avisa_si_ya_se_estaba_enviando():
+    pool = PoolFalso()
+    pool.soltar.clear()
+    lote = LoteCorreos(pool, tamaño_lote=1, espera_max=0)
+
+    with pytest.raises(EnvioIncierto) as error:
+        lote.enviar("correo", timeout=0.2)
+    pool.soltar.set()
+
+    assert error.value.futuro.result(timeout=5) is True
+    lote.cerrar()
+    assert pool.enviados == ["correo"]
+
+
+def digest(pool, cada_pedidos=2):
+    return DigestComerciante(pool, "tienda@example.com", "tienda@example.com",
+                             cada_pedidos=cada_pedidos, cada_segundos=3600)
+
+
+def test_digest_guarda_los_pedidos_en_redis(redis_falso):
+    pool = PoolFalso(fallar=True)
+    d = digest(pool, cada_pedidos=50)
+    d.añadir_pedido("a@example.com", "A", "MBP", "49.00 eur")
+
+    # Otro proceso (u otro arranque) ve el mismo pedido
+    assert redis_falso.llen("digest_pedidos:principal") == 1
+    assert not digest(pool, cada_pedidos=50).enviar_resumen()
+    assert redis_falso.llen("digest_pedidos:principal") == 1
+
+    pool.fallar = False
+    assert d.enviar_resumen()
+    assert len(pool.enviados) == 1
+    assert redis_falso.llen("digest_pedidos:principal") == 0
+
+
+def test_digest_no_envia_en_el_hilo_del_pedido(redis_falso):
+    pool = PoolFalso()
+    d = digest(pool)
+    pool.fallar = True
+    d.añadir_pedido("a@example.com", "A", "MBP", "49.00 eur")
+    d.añadir_pedido("b@example.com", "B", "MBP", "49.00 eur")
+    # añadir_pedido no lanzó aunque el SMTP esté caído: el envío es del hilo del digest
+    assert redis_falso.llen("digest_pedidos:principal") == 2
+    d.cerrar()
+
+
+def test_digest_no_suelta_el_bloqueo_de_otro(redis_falso):
+    class PoolLento(PoolFalso):
+        def enviar(self, msg):
+            # El primer resumen tarda tanto que el bloqueo caduca y otro proceso lo coge
+            if not self.enviados:
+                redis_falso.set("digest_pedidos:principal:envio", "otro")
+            return super().enviar(msg)
+
+    d = digest(PoolLento(), cada_pedidos=50)
+    d.añadir_pedido("a@example.com", "A", "MBP", "49.00 eur")
+
+    assert d.enviar_resumen()
+    assert redis_falso.get("digest_pedidos:principal:envio") == "otro"
+
+    redis_falso.delete("digest_pedidos:principal:envio")
+    d.añadir_pedido("b@example.com", "B", "MBP", "49.00 eur")
+    assert d.enviar_resumen()
+    # El nuestro sí se suelta
+    assert not redis_falso.exists("digest_pedidos:principal:envio")
+
+
+def test_digest_al_cerrar_envia_aunque_no_toque(redis_falso):
+    pool = PoolFalso()
+    d = digest(pool, cada_pedidos=50)
+    redis_falso.set("digest_pedidos:principal:ultimo", time.time())
+    d.añadir_pedido("a@example.com", "A", "MBP", "49.00 eur")
+    assert not d.toca_resumen()
+
+    d.cerrar()
+
+    assert len(pool.enviados) == 1
+    assert redis_falso.llen("digest_pedidos:principal") == 0
+
+
+def test_los_digests_arrancan_con_la_app(redis_falso, entorno, monkeypatch):
+    monkeypatch.setattr(correo_lotes, "_digests", {})
+    entorno(DIGEST_COMERCIANTE="1")
+
+    digests = iniciar_digests()
+
+    assert [d.clave for d in digests] == [f"digest_pedidos:{t.nombre}" for t in listar_tiendas()
+                                          if t.correo_configurado]
+    assert all(d._hilo.is_alive() for d in digests)
+    for d in digests:
+        d._parar.set()
+        d._despertar.set()
@@ -0,0 +1,70 @@
+import smtplib
+
+import pytest
+
+from api.despachador import registrar_fallo, REINTENTO, APLAZADO
+from api.outbox import PREFIJO_ENTRADA, obtener_outbox
+from api.resiliencia import DependenciaCaida
+from api.tiendas import obtener_tienda
+from tests.test_outbox import encolar
+
+
+def caida(causa):
+    error = DependenciaCaida("smtp", str(causa))
+    error.__cause__ = causa
+    return error
+
+
+def fallar(r, error):
+    encolar("evt_1", cursos=())
+    tienda = obtener_tienda()
+    outbox = obtener_outbox()
+    (id_entrada, entrada), = outbox.reclamar(tienda, cantidad=1)[0]
+    resultado = registrar_fallo(outbox, id_entrada, error, tienda, int(entrada.get('intentos') or 0))
+    return resultado, r.hgetall(f"{PREFIJO_ENTRADA}evt_1")
+
+
+@pytest.mark.parametrize("error", [
+    caida(None),
+    caida(smtplib.SMTPServerDisconnected("conexión cerrada")),
+    caida(smtplib.SMTPAuthenticationError(535, b"login incorrecto")),
+    caida(TimeoutError("sin respuesta")),
+])
+def test_sin_conexion_no_gasta_intento(redis_falso, error):
+    resultado, entrada = fallar(redis_falso, error)
+    assert resultado == REINTENTO
+    assert entrada["intentos"] == "0"
+
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPResponseException(554, b"mensaje rechazado"),
+    caida(smtplib.SMTPResponseException(554, b"mensaje rechazado")),
+    caida(smtplib.SMTPDataError(552, b"demasiado grande")),
+])
+def test_un_5xx_al_mensaje_gasta_intento(redis_falso, error):
+    resultado, entrada = fallar(redis_falso, error)
+    assert resultado == REINTENTO
+    assert entrada["intentos"] == "1"
+
+
+def test_un_4xx_es_aplazamiento(redis_falso):
+    resultado, entrada = fallar(redis_falso, caida(smtplib.SMTPResponseException(450, b"buzon ocupado")))
+    assert resultado == APLAZADO
+    assert (entrada["intentos"], entrada["aplazamientos"]) == ("0", "1")
+
+
+def test_el_envio_incierto_se_anota_al_terminar(redis_falso):
+    from concurrent.futures import Future
+    from api.despachador import anotar_incierto
+
+    encolar("evt_1", cursos=())
+    tienda = obtener_tienda()
+    outbox = obtener_outbox()
+    (id_entrada, _), = outbox.reclamar(tienda, cantidad=1)[0]
+    futuro = Future()
+    anotar_incierto(outbox, id_entrada, tienda, futuro)
+    assert redis_falso.hget(f"{PREFIJO_ENTRADA}evt_1", "estado") != "enviado"
+
+    futuro.set_result(True)
+
+    assert redis_falso.hget(f"{PREFIJO_ENTRADA}evt_1", "estado") == "enviado"
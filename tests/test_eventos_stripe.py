@@ -0,0 +1,110 @@
+import json
+import time
+
+import pytest
+
+from api.eventos_stripe import leer_checkout_completado, verificar_firma, FirmaInvalida
+from tests.conftest import sesion_checkout
+
+stripe = pytest.importorskip("stripe")
+
+SECRETO = "whsec_pruebas_firma"
+
+
+def evento(tipo="checkout.session.completed"):
+    return json.dumps({"id": "evt_firma", "object": "event", "type": tipo,
+                       "data": {"object": sesion_checkout("cs_firma")}}).encode()
+
+
+def firma(payload, timestamp=None, secreto=SECRETO):
+    """Firma v1 calculada con el propio SDK de Stripe."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return timestamp, stripe.WebhookSignature._compute_signature(f"{timestamp}.{payload.decode()}", secreto)
+
+
+def cabecera(payload, timestamp=None, secreto=SECRETO):
+    timestamp, v1 = firma(payload, timestamp, secreto)
+    return f"t={timestamp},v1={v1}"
+
+
+def test_firma_valida():
+    payload = evento()
+    sesion = leer_checkout_completado(payload, cabecera(payload), SECRETO)
+
+    assert sesion.event_id == "evt_firma"
+    assert sesion.session_id == "cs_firma"
+    assert sesion.email == "cliente@example.com"
+
+
+def test_coincide_con_construct_event():
+    payload = evento()
+    cab = cabecera(payload)
+    assert stripe.Webhook.construct_event(payload, cab, SECRETO)["id"] == leer_checkout_completado(payload, cab, SECRETO).event_id
+
+
+def test_cuerpo_alterado():
+    payload = evento()
+    cab = cabecera(payload)
+    with pytest.raises(FirmaInvalida):
+        leer_checkout_completado(payload.replace(b"4900", b"1"), cab, SECRETO)
+
+
+def test_otro_secreto():
+    payload = evento()
+    with pytest.raises(FirmaInvalida):
+        leer_checkout_completado(payload, cabecera(payload, secreto="whsec_otro"), SECRETO)
+
+
+def test_timestamp_fuera_de_tolerancia():
+    payload = evento()
+    with pytest.raises(FirmaInvalida, match="caducado"):
+        leer_checkout_completado(payload, cabecera(payload, int(time.time()) - 301), SECRETO)
+
+
+def test_varias_firmas_v1():
+    # Al rotar el secreto, Stripe manda una firma con cada uno
+    payload = evento()
+    timestamp, buena = firma(payload)
+    _, vieja = firma(payload, timestamp, "whsec_viejo")
+    cab = f"t={timestamp},v1={vieja},v0=abc,v1={buena}"
+    assert leer_checkout_completado(payload, cab, SECRETO) is not None
+
+
+@pytest.mark.parametrize("cab", [
+    "v1=abc",
+    "t=,v1=abc",
+    "t=ayer,v1=abc",
+    "t=1700000000",
+    "t=1700000000,v1=",
+    "t=1700000000;v1=abc",
+    "basura",
+])
+def test_cabecera_mal_formada(cab):
+    with pytest.raises(FirmaInvalida):
+        verificar_firma(evento(), cab, SECRETO)
+
+
+@pytest.mark.parametrize("cab", [None, ""])
+def test_sin_cabecera(cab):
+    with pytest.raises(FirmaInvalida, match="Falta"):
+        leer_checkout_completado(evento(), cab, SECRETO)
+
+
+@pytest.mark.parametrize("secreto", [None, ""])
+def test_sin_secreto(secreto):
+    payload = evento()
+    with pytest.raises(FirmaInvalida):
+        leer_checkout_completado(payload, cabecera(payload), secreto)
+
+
+@pytest.mark.parametrize("tipo", ["payment_intent.succeeded", "checkout.session.expired"])
+def test_otro_tipo_de_evento(tipo):
+    payload = evento(tipo)
+    assert leer_checkout_completado(payload, cabecera(payload), SECRETO) is None
+
+
+def test_tipo_solo_en_el_cuerpo():
+    # La cadena aparece (en la descripción) pero el evento es de otro tipo
+    payload = json.dumps({"id": "evt_x", "type": "customer.updated",
+                          "data": {"object": {"description": "checkout.session.completed"}}}).encode()
+    assert leer_checkout_completado(payload, cabecera(payload), SECRETO) is None
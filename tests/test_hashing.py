@@ -0,0 +1,40 @@
+import pytest
+from werkzeug.security import check_password_hash
+
+from api import hashing
+from api.hashing import PoolHashing
+from tests.conftest import METODO_HASH_PRUEBAS
+
+
+def test_por_defecto_calcula_en_el_hilo():
+    pool = PoolHashing(metodo=METODO_HASH_PRUEBAS)
+
+    assert not pool.usa_procesos()
+    assert check_password_hash(pool.generar_hash("secreto"), "secreto")
+
+
+def test_sin_procesos_disponibles_calcula_en_el_hilo(monkeypatch):
+    def sin_semaforos(*args, **kwargs):
+        raise OSError(38, "Function not implemented")
+
+    monkeypatch.setattr(hashing, "ProcessPoolExecutor", sin_semaforos)
+    pool = PoolHashing(procesos=2, metodo=METODO_HASH_PRUEBAS)
+
+    assert check_password_hash(pool.generar_hash("secreto"), "secreto")
+    assert check_password_hash(pool.enviar("otro").result(), "otro")
+    assert pool.procesos == 0
+
+
+def test_pool_de_procesos():
+    pool = PoolHashing(procesos=1, metodo=METODO_HASH_PRUEBAS)
+    try:
+        assert pool.usa_procesos()
+        assert check_password_hash(pool.generar_hash("secreto"), "secreto")
+    finally:
+        pool.cerrar()
+
+
+def test_no_hay_perfil_de_pruebas():
+    # El hash de una iteración no se puede elegir por configuración
+    with pytest.raises(ValueError):
+        PoolHashing(perfil="test")
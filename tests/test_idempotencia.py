@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+import redis
+
+from api import resiliencia
+from api.idempotencia import (
+    reclamar_evento, marcar_evento_hecho, liberar_evento,
+    reclamar_evento_async, marcar_evento_hecho_async, liberar_evento_async,
+    NUEVO, EN_CURSO, HECHO, TTL_EVENTO_EN_CURSO, TTL_EVENTO_HECHO,
+)
+
+
+class RedisCaido:
+    def __getattr__(self, nombre):
+        def fallar(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+        return fallar
+
+
+class RedisCaidoAsync:
+    def __getattr__(self, nombre):
+        async def fallar(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+        return fallar
+
+
+@pytest.fixture
+def circuitos_nuevos(monkeypatch):
+    # Los fallos de estas pruebas no deben abrir el circuito de Redis de las demás
+    monkeypatch.setattr(resiliencia, "_circuitos", {})
+
+
+def test_nuevo_en_curso_hecho(redis_falso):
+    assert reclamar_evento("evt_idem_1") == NUEVO
+    assert redis_falso.get("stripe_evento:evt_idem_1") == EN_CURSO
+    assert 0 < redis_falso.ttl("stripe_evento:evt_idem_1") <= TTL_EVENTO_EN_CURSO
+    # Otro worker mientras tanto
+    assert reclamar_evento("evt_idem_1") == EN_CURSO
+
+    marcar_evento_hecho("evt_idem_1")
+
+    assert redis_falso.get("stripe_evento:evt_idem_1") == HECHO
+    assert TTL_EVENTO_EN_CURSO < redis_falso.ttl("stripe_evento:evt_idem_1") <= TTL_EVENTO_HECHO
+    assert reclamar_evento("evt_idem_1") == HECHO
+
+
+def test_hecho_en_otro_worker(redis_falso):
+    # Solo Redis lo sabe (la caché local es de otro proceso)
+    redis_falso.set("stripe_evento:evt_idem_2", HECHO)
+
+    assert reclamar_evento("evt_idem_2") == HECHO
+    redis_falso.delete("stripe_evento:evt_idem_2")
+    # Ya está en la caché local
+    assert reclamar_evento("evt_idem_2") == HECHO
+
+
+def test_liberar_tras_un_fallo(redis_falso):
+    assert reclamar_evento("evt_idem_3") == NUEVO
+
+    liberar_evento("evt_idem_3")
+
+    assert not redis_falso.exists("stripe_evento:evt_idem_3")
+    assert reclamar_evento("evt_idem_3") == NUEVO
+
+
+def test_liberar_quita_la_cache_local(redis_falso):
+    marcar_evento_hecho("evt_idem_4")
+    liberar_evento("evt_idem_4")
+
+    assert reclamar_evento("evt_idem_4") == NUEVO
+
+
+def test_sin_redis_solo_la_cache_local(circuitos_nuevos):
+    r = RedisCaido()
+
+    assert reclamar_evento("evt_idem_5", r) == NUEVO
+    marcar_evento_hecho("evt_idem_5", r)
+    assert reclamar_evento("evt_idem_5", r) == HECHO
+
+    liberar_evento("evt_idem_5", r)
+    assert reclamar_evento("evt_idem_5", r) == NUEVO
+
+
+def test_sin_event_id_siempre_es_nuevo(redis_falso):
+    assert reclamar_evento(None) == NUEVO
+    marcar_evento_hecho(None)
+    assert reclamar_evento(None) == NUEVO
+
+
+def test_async_nuevo_en_curso_hecho(redis_falso):
+    async def recorrido():
+        estados = [await reclamar_evento_async("evt_idem_a1"), await reclamar_evento_async("evt_idem_a1")]
+        ttl_en_curso = redis_falso.ttl("stripe_evento:evt_idem_a1")
+        await marcar_evento_hecho_async("evt_idem_a1")
+        return estados, ttl_en_curso
+
+    estados, ttl_en_curso = asyncio.run(recorrido())
+
+    assert estados == [NUEVO, EN_CURSO]
+    assert 0 < ttl_en_curso <= TTL_EVENTO_EN_CURSO
+    assert redis_falso.get("stripe_evento:evt_idem_a1") == HECHO
+    assert TTL_EVENTO_EN_CURSO < redis_falso.ttl("stripe_evento:evt_idem_a1") <= TTL_EVENTO_HECHO
+    assert asyncio.run(reclamar_evento_async("evt_idem_a1")) == HECHO
+
+
+def test_async_liberar_tras_un_fallo(redis_falso):
+    async def recorrido():
+        await reclamar_evento_async("evt_idem_a2")
+        await liberar_evento_async("evt_idem_a2")
+        return await reclamar_evento_async("evt_idem_a2")
+
+    assert asyncio.run(recorrido()) == NUEVO
+
+
+def test_async_sin_redis_solo_la_cache_local(circuitos_nuevos):
+    r = RedisCaidoAsync()
+
+    async def recorrido():
+        estados = [await reclamar_evento_async("evt_idem_a3", r)]
+        await marcar_evento_hecho_async("evt_idem_a3", r)
+        estados.append(await reclamar_evento_async("evt_idem_a3", r))
+        await liberar_evento_async("evt_idem_a3", r)
+        estados.append(await reclamar_evento_async("evt_idem_a3", r))
+        return estados
+
+    assert asyncio.run(recorrido()) == [NUEVO, HECHO, NUEVO]
@@ -0,0 +1,34 @@
+import dataclasses
+
+from api.limite_smtp import obtener_limitador
+from api.tiendas import obtener_tienda
+
+
+def tienda_limitada(por_minuto=60, rafaga=2):
+    return dataclasses.replace(obtener_tienda(), smtp_por_minuto=por_minuto, smtp_rafaga=rafaga)
+
+
+def test_devolver_repone_la_ficha(redis_falso):
+    tienda = tienda_limitada()
+    limitador = obtener_limitador()
+    assert limitador.tomar(tienda, 2)[0] == 2
+    assert limitador.tomar(tienda)[0] == 0
+
+    limitador.devolver(tienda)
+
+    assert limitador.tomar(tienda)[0] == 1
+
+
+def test_devolver_no_pasa_de_la_capacidad(redis_falso):
+    tienda = tienda_limitada()
+    limitador = obtener_limitador()
+    limitador.tomar(tienda)
+
+    limitador.devolver(tienda, 5)
+
+    assert limitador.tomar(tienda, 5)[0] == 2
+
+
+def test_devolver_sin_cubo_no_lo_crea(redis_falso):
+    obtener_limitador().devolver(tienda_limitada())
+    assert redis_falso.keys("limite_smtp:*") == []
@@ -0,0 +1,39 @@
+import email
+import quopri
+from email import policy
+
+from api.mensajes import codificar_qp, obtener_esqueleto
+from api.plantillas import obtener_registro_plantillas
+
+LARGO = "Avenida de la Constitución 123, Escalera B, 4º Izquierda, Urbanización Los Almendros, 41004 Sevilla"
+
+
+def sin_lf_sueltos(datos):
+    return b"\n" not in datos.replace(b"\r\n", b"")
+
+
+def test_codificar_qp_corta_con_crlf():
+    datos = codificar_qp(LARGO)
+
+    assert b"=\r\n" in datos
+    assert sin_lf_sueltos(datos)
+    assert all(len(linea) <= 76 for linea in datos.split(b"\r\n"))
+
+
+def test_codificar_qp_respeta_el_texto():
+    for texto in (LARGO, "línea 1\nlínea 2", "a" * 200 + "\r\n" + "ñ" * 50, "", "=?"):
+        assert quopri.decodestring(codificar_qp(texto)).decode("utf-8") == texto.replace("\r\n", "\n").replace("\n", "\r\n")
+
+
+def test_correo_con_valores_largos():
+    plantilla = obtener_registro_plantillas().obtener("correo_template_simple.html")
+    valores = {"NOMBRE_CLIENTE": "Clienta", "MONTO_PAGO": "49.00 EUR", "DIRECCION_ENTREGA": LARGO,
+               "NOMBRE_PRODUCTO": ", ".join(["Método Barrera Primero", "Reto Timón 21 días", "Jabón de caléndula"])}
+    esqueleto = obtener_esqueleto("tienda@example.com", "Mi Cosmética Natural", "Pedido confirmado", True)
+
+    datos = esqueleto.construir(plantilla, valores, "cliente@example.com").datos
+
+    assert sin_lf_sueltos(datos)
+    msg = email.message_from_bytes(datos, policy=policy.default)
+    html = msg.get_body(("html",)).get_content()
+    assert LARGO in html
@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+from api import metricas
+from api.metricas import Histograma, medir, contar, fijar, anotar, evento, exportar_prometheus, instantanea
+
+
+@pytest.fixture
+def metricas_vacias():
+    metricas.reiniciar()
+    yield
+    metricas.reiniciar()
+
+
+def test_histograma_buckets():
+    h = Histograma(buckets=(0.01, 0.1, 1.0))
+    for valor in (0.005, 0.01, 0.05, 0.5, 3.0):
+        h.observar(valor)
+
+    # El límite entra en su bucket; lo que pasa del último va a +Inf
+    assert h.cuentas == [2, 1, 1, 1]
+    assert h.total == 5
+    assert h.suma == pytest.approx(3.565)
+    assert h.percentil(40) == 0.01
+    assert h.percentil(60) == 0.1
+    assert h.percentil(100) == float("inf")
+    assert Histograma().percentil(99) == 0.0
+
+
+def test_prometheus_con_etiquetas(metricas_vacias):
+    contar("correos_enviados")
+    contar("correos_enviados", 2)
+    contar("reintentos", dependencia="smtp")
+    contar("reintentos", dependencia="redis")
+    fijar("outbox", 3, tienda="principal", cola="pedidos")
+    fijar("outbox", 1, cola="pedidos", tienda="principal")  # la misma serie
+    fijar("outbox", 0, cola="fallidos")
+
+    lineas = exportar_prometheus().splitlines()
+
+    assert "webhook_correos_enviados_total 3" in lineas
+    assert lineas.count("# TYPE webhook_reintentos_total counter") == 1
+    assert 'webhook_reintentos_total{dependencia="redis"} 1' in lineas
+    assert 'webhook_reintentos_total{dependencia="smtp"} 1' in lineas
+    assert lineas.count("# TYPE webhook_outbox gauge") == 1
+    assert 'webhook_outbox{cola="pedidos",tienda="principal"} 1' in lineas
+    assert 'webhook_outbox{cola="fallidos"} 0' in lineas
+    assert instantanea()["indicadores"]['outbox{cola="pedidos",tienda="principal"}'] == 1
+
+
+def test_prometheus_escapa_las_etiquetas(metricas_vacias):
+    fijar("outbox", 1, tienda='mi "tienda"\\\n')
+
+    assert 'webhook_outbox{tienda="mi \\"tienda\\"\\\\\\n"} 1' in exportar_prometheus().splitlines()
+
+
+def test_prometheus_histograma(metricas_vacias):
+    metricas.observar("smtp", 0.02)
+    metricas.observar("smtp", 20.0)
+
+    lineas = exportar_prometheus().splitlines()
+
+    assert "# TYPE webhook_etapa_segundos histogram" in lineas
+    assert 'webhook_etapa_segundos_bucket{etapa="smtp",le="0.01"} 0' in lineas
+    assert 'webhook_etapa_segundos_bucket{etapa="smtp",le="0.025"} 1' in lineas
+    assert 'webhook_etapa_segundos_bucket{etapa="smtp",le="10.0"} 1' in lineas
+    assert 'webhook_etapa_segundos_bucket{etapa="smtp",le="+Inf"} 2' in lineas
+    assert 'webhook_etapa_segundos_count{etapa="smtp"} 2' in lineas
+
+
+def test_circuito_con_etiquetas(metricas_vacias):
+    from api.resiliencia import Circuito
+    circuito = Circuito("smtp_principal", umbral_fallos=1, etiquetas={"dependencia": "smtp", "tienda": "principal"})
+    try:
+        circuito.llamar(lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+
+    texto = exportar_prometheus()
+
+    assert 'webhook_circuito_estado{dependencia="smtp",tienda="principal"} 2' in texto
+    assert 'webhook_circuito_transiciones_total{dependencia="smtp",estado="abierto",tienda="principal"} 1' in texto
+    assert "smtp_principal" not in texto
+
+
+def test_linea_del_evento(metricas_vacias, capsys):
+    with evento("evt_metricas_1", tipo="checkout.session.completed"):
+        with medir("firma"):
+            pass
+        anotar(resultado="enviado")
+    # Fuera del evento anotar no hace nada
+    anotar(resultado="perdido")
+
+    linea = json.loads(capsys.readouterr().out.strip())
+
+    assert linea["event_id"] == "evt_metricas_1"
+    assert linea["tipo"] == "checkout.session.completed"
+    assert linea["resultado"] == "enviado"
+    assert set(linea["etapas_ms"]) == {"firma"}
+    assert linea["total_ms"] >= 0
+    assert instantanea()["etapas"]["total"]["total"] == 1
+
+
+def test_eventos_concurrentes_no_se_mezclan(metricas_vacias, capsys):
+    async def procesar(event_id):
+        with evento(event_id):
+            await asyncio.sleep(0.01)
+            anotar(quien=event_id)
+
+    async def dos():
+        await asyncio.gather(procesar("evt_metricas_a"), procesar("evt_metricas_b"))
+
+    asyncio.run(dos())
+
+    lineas = [json.loads(linea) for linea in capsys.readouterr().out.strip().splitlines()]
+    assert sorted((linea["event_id"], linea["quien"]) for linea in lineas) == [
+        ("evt_metricas_a", "evt_metricas_a"), ("evt_metricas_b", "evt_metricas_b")]
+
+
+def test_profundidad_del_outbox(metricas_vacias, redis_falso):
+    from api.outbox import obtener_outbox, clave_pendientes
+    from api.tiendas import obtener_tienda
+    tienda = obtener_tienda()
+    redis_falso.rpush(clave_pendientes(tienda.nombre, "pedidos"), "a", "b")
+
+    profundidad = obtener_outbox().publicar_profundidad([tienda])
+
+    assert profundidad[f"{tienda.nombre}_pedidos"] == 2
+    texto = exportar_prometheus()
+    assert f'webhook_outbox{{cola="pedidos",tienda="{tienda.nombre}"}} 2' in texto
+    assert 'webhook_outbox{cola="fallidos"} 0' in texto
@@ -0,0 +1,74 @@
+from datetime import datetime
+
+from api.migrar_cursos import main, migrar
+from api.mbp_user_manager import (
+    cursos_de_cliente,
+    clientes_con_curso,
+    numero_clientes_con_curso,
+    clientes_creados_entre,
+)
+
+
+def cliente_antiguo(r, email, cursos, created_at):
+    # Esquema anterior: los cursos solo en el campo 'curso' del hash
+    r.hset(f"cliente_mbp:{email}", mapping={"email": email, "curso": cursos, "status": "activo",
+                                            "created_at": created_at})
+
+
+def poblar(r):
+    cliente_antiguo(r, "ana@example.com", "MBP;TIMON", "2024-01-10T09:00:00")
+    cliente_antiguo(r, "luis@example.com", "MBP", "2024-02-05T12:30:00")
+    cliente_antiguo(r, "eva@example.com", " TIMON ; ", "2024-03-01T08:00:00")
+    cliente_antiguo(r, "sin_fecha@example.com", "TIMON", "")
+    # Empieza igual pero no es un cliente: la migración no la toca
+    r.set("cliente_mbp:contador", "3")
+
+
+def test_migracion_y_consultas(redis_falso, capsys):
+    poblar(redis_falso)
+
+    main(["--lote", "2"])
+    assert "4 clientes, 5 cursos, 1 sin created_at" in capsys.readouterr().out
+
+    assert cursos_de_cliente("ana@example.com") == {"MBP", "TIMON"}
+    assert cursos_de_cliente(" ANA@example.com ") == {"MBP", "TIMON"}
+    assert cursos_de_cliente("eva@example.com") == {"TIMON"}
+    assert sorted(clientes_con_curso("MBP")) == ["ana@example.com", "luis@example.com"]
+    assert sorted(clientes_con_curso("TIMON")) == ["ana@example.com", "eva@example.com", "sin_fecha@example.com"]
+    assert numero_clientes_con_curso("TIMON") == 3
+    assert numero_clientes_con_curso("OTRO") == 0
+    # [desde, hasta): el del 1 de marzo a las 8:00 justas queda fuera
+    assert clientes_creados_entre(datetime(2024, 1, 1), datetime(2024, 3, 1, 8)) == [
+        "ana@example.com", "luis@example.com"]
+    assert redis_falso.zscore("clientes_mbp_por_fecha", "sin_fecha@example.com") is None
+
+
+def test_relanzar_la_migracion_no_cambia_nada(redis_falso):
+    poblar(redis_falso)
+    migrar(lote=3)
+    antes = {clave: redis_falso.dump(clave) for clave in redis_falso.keys("*")}
+
+    migrar(lote=3)
+
+    assert {clave: redis_falso.dump(clave) for clave in redis_falso.keys("*")} == antes
+    assert numero_clientes_con_curso("MBP") == 2
+
+
+def test_simulacion_no_escribe(redis_falso):
+    poblar(redis_falso)
+
+    assert migrar(simulacion=True) == {"clientes": 4, "cursos": 5, "sin_fecha": 1}
+    assert redis_falso.keys("curso_mbp:*") == []
+    assert cursos_de_cliente("ana@example.com") == set()
+
+
+def test_prefijo_de_tienda(redis_falso):
+    cliente_antiguo(redis_falso, "ana@example.com", "MBP", "2024-01-10T09:00:00")
+    redis_falso.hset("otra:cliente_mbp:luis@example.com", mapping={"email": "luis@example.com", "curso": "TIMON",
+                                                                   "created_at": "2024-01-11T09:00:00"})
+
+    migrar(prefijo="otra:")
+
+    assert cursos_de_cliente("luis@example.com", prefijo="otra:") == {"TIMON"}
+    assert numero_clientes_con_curso("MBP", prefijo="otra:") == 0
+    assert numero_clientes_con_curso("MBP") == 0
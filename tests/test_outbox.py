@@ -0,0 +1,96 @@
+from api.limite_smtp import obtener_limitador
+from api.outbox import (
+    PREFIJO_ENTRADA, DUPLICADO, NUEVO, EXISTENTE, encolar_confirmacion, campos_entrada, obtener_outbox,
+)
+from api.mensajes import MensajePreparado
+from api.tiendas import obtener_tienda
+
+
+def mensaje(email="cliente@example.com"):
+    return MensajePreparado("tienda@example.com", [email], b"Subject: prueba\r\n\r\nhola\r\n")
+
+
+def encolar(id_entrada, id_sesion=None, email="cliente@example.com", cursos=("MBP",)):
+    tienda = obtener_tienda()
+    msg = mensaje(email)
+    return encolar_confirmacion(id_entrada, tienda, campos_entrada(msg, tienda), msg,
+                                renderizar_nuevo=lambda password: mensaje(email),
+                                email=email, cursos=cursos, id_sesion=id_sesion)
+
+
+def entradas(r):
+    return sorted(r.scan_iter(f"{PREFIJO_ENTRADA}*"))
+
+
+def test_el_mismo_evento_no_se_repite(redis_falso):
+    assert encolar("evt_1", "cs_1")[0] == NUEVO
+
+    resultado, msg = encolar("evt_1", "cs_1")
+    assert (resultado, msg) == (DUPLICADO, None)
+    assert entradas(redis_falso) == [f"{PREFIJO_ENTRADA}evt_1"]
+
+
+def test_la_misma_sesion_con_otro_id_no_se_repite(redis_falso):
+    assert encolar("evt_1", "cs_1")[0] == NUEVO
+
+    assert encolar("backfill:cs_1", "cs_1")[0] == DUPLICADO
+    assert entradas(redis_falso) == [f"{PREFIJO_ENTRADA}evt_1"]
+
+
+def test_otra_sesion_del_mismo_cliente_si_se_envia(redis_falso):
+    assert encolar("evt_1", "cs_1")[0] == NUEVO
+
+    assert encolar("evt_2", "cs_2")[0] == EXISTENTE
+    assert len(entradas(redis_falso)) == 2
+
+
+def test_correos_sin_sesion(redis_falso):
+    assert encolar("manual:1", cursos=())[0] == EXISTENTE
+    assert encolar("manual:2", cursos=())[0] == EXISTENTE
+    assert len(entradas(redis_falso)) == 2
+
+
+def test_reclamar_credenciales_primero(redis_falso):
+    encolar("evt_existente", cursos=())
+    encolar("evt_nuevo", "cs_nuevo", email="nuevo@example.com")
+    outbox = obtener_outbox()
+
+    reclamadas, espera = outbox.reclamar(obtener_tienda(), cantidad=10)
+
+    assert [id_entrada for id_entrada, _ in reclamadas] == ["evt_nuevo", "evt_existente"]
+    assert reclamadas[0][1]["credenciales"] == "1"
+    assert espera == 0
+    assert outbox.reclamar(obtener_tienda(), cantidad=10)[0] == []
+
+
+def test_reintento_y_plazo_vencido_vuelven_a_la_cola(redis_falso):
+    encolar("evt_1", cursos=())
+    encolar("evt_2", cursos=())
+    tienda = obtener_tienda()
+    outbox = obtener_outbox()
+    (primero, _), (segundo, _) = outbox.reclamar(tienda, cantidad=10, plazo=-1)[0]
+
+    outbox.reprogramar(tienda, primero, -1, intentos=1)
+    reclamadas, _ = outbox.reclamar(tienda, cantidad=10)
+
+    assert sorted(id_entrada for id_entrada, _ in reclamadas) == ["evt_1", "evt_2"]
+    assert dict(reclamadas)[primero]["intentos"] == "1"
+
+
+def test_confirmar_borra_el_correo(redis_falso):
+    encolar("evt_1", cursos=())
+    tienda = obtener_tienda()
+    outbox = obtener_outbox()
+    [(id_entrada, _)] = outbox.reclamar(tienda)[0]
+
+    outbox.confirmar(tienda, id_entrada)
+
+    entrada = redis_falso.hgetall(f"{PREFIJO_ENTRADA}{id_entrada}")
+    assert entrada["estado"] == "enviado" and "datos" not in entrada
+    assert outbox.profundidad([tienda])[f"{tienda.nombre}_procesando"] == 0
+
+
+def test_outbox_y_limitador_se_reutilizan(redis_falso):
+    assert obtener_outbox() is obtener_outbox()
+    assert obtener_limitador() is obtener_limitador()
+    assert obtener_outbox().r is redis_falso
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from api.plantillas import Plantilla, RegistroPlantillas, CAMPOS_POR_PLANTILLA, CAMPOS_PEDIDO
+
+
+def test_renderiza_los_huecos():
+    plantilla = Plantilla("p.html", "<p>Hola {{NOMBRE_CLIENTE}}, {{MONTO_PAGO}}</p>", CAMPOS_PEDIDO)
+
+    assert plantilla.campos == {"NOMBRE_CLIENTE", "MONTO_PAGO"}
+    assert plantilla.renderizar({"NOMBRE_CLIENTE": "Ana", "MONTO_PAGO": "10.00 EUR"}) == "<p>Hola Ana, 10.00 EUR</p>"
+
+
+def test_un_hueco_que_nadie_rellena_falla_al_cargar():
+    with pytest.raises(ValueError, match="PASSWORD_PLANA"):
+        Plantilla("p.html", "Tu clave: {{PASSWORD_PLANA}}", CAMPOS_PEDIDO)
+
+
+def test_un_valor_que_falta_falla_al_renderizar():
+    plantilla = Plantilla("p.html", "{{NOMBRE_CLIENTE}} {{MONTO_PAGO}}", CAMPOS_PEDIDO)
+
+    with pytest.raises(ValueError, match="MONTO_PAGO"):
+        plantilla.renderizar({"NOMBRE_CLIENTE": "Ana"})
+
+
+def test_el_registro_valida_al_cargar(tmp_path):
+    (tmp_path / "correo_template_simple.html").write_text("{{CORREO_ACCESO}}", encoding="utf-8")
+
+    with pytest.raises(ValueError, match="CORREO_ACCESO"):
+        RegistroPlantillas(tmp_path).obtener("correo_template_simple.html")
+
+
+def test_recarga_si_cambia_la_fecha_del_fichero(tmp_path):
+    ruta = tmp_path / "p.html"
+    ruta.write_text("Hola {{NOMBRE_CLIENTE}}", encoding="utf-8")
+    registro = RegistroPlantillas(tmp_path, {"p.html": CAMPOS_PEDIDO})
+    primera = registro.obtener("p.html")
+
+    assert registro.obtener("p.html") is primera
+
+    ruta.write_text("Adiós {{NOMBRE_CLIENTE}}", encoding="utf-8")
+    mtime = os.stat(ruta).st_mtime_ns + 1_000_000_000
+    os.utime(ruta, ns=(mtime, mtime))
+
+    assert registro.renderizar("p.html", {"NOMBRE_CLIENTE": "Ana"}) == "Adiós Ana"
+
+
+def test_sin_comprobar_cambios_se_queda_con_la_primera(tmp_path):
+    ruta = tmp_path / "p.html"
+    ruta.write_text("Hola {{NOMBRE_CLIENTE}}", encoding="utf-8")
+    registro = RegistroPlantillas(tmp_path, {"p.html": CAMPOS_PEDIDO}, comprobar_cambios=False)
+    registro.obtener("p.html")
+
+    ruta.write_text("Adiós {{NOMBRE_CLIENTE}}", encoding="utf-8")
+    mtime = os.stat(ruta).st_mtime_ns + 1_000_000_000
+    os.utime(ruta, ns=(mtime, mtime))
+
+    assert registro.renderizar("p.html", {"NOMBRE_CLIENTE": "Ana"}) == "Hola Ana"
+
+
+def test_las_plantillas_del_proyecto_cargan():
+    registro = RegistroPlantillas()
+    registro.precargar()
+
+    assert set(registro._cache) == set(CAMPOS_POR_PLANTILLA)
@@ -0,0 +1,35 @@
+from api.productos import ResolutorProductos
+from api.stripe_falso import ClienteStripeFalso
+
+ROSA = {"description": "Curso de jabones", "price_id": "price_rosa"}
+LAVANDA = {"description": "Curso de cremas", "price_id": "price_lavanda"}
+
+
+def crear(**kwargs):
+    cliente = ClienteStripeFalso(**kwargs)
+    return cliente, ResolutorProductos(cliente)
+
+
+def test_usa_los_line_items_del_evento():
+    cliente, resolutor = crear()
+    trabajo = {"session_id": "cs_1", "line_items": [dict(ROSA)]}
+
+    assert resolutor.resolver(trabajo) == [ROSA]
+    assert cliente.llamadas == []
+
+
+def test_sin_descripcion_pregunta_a_stripe():
+    cliente, resolutor = crear(line_items_por_sesion={"cs_2": [LAVANDA]})
+    trabajo = {"session_id": "cs_2", "line_items": [{"description": None, "price_id": "price_lavanda"}]}
+
+    assert resolutor.resolver(trabajo) == [LAVANDA]
+    assert cliente.llamadas == [("listar_line_items", "cs_2")]
+
+
+def test_cada_compra_sin_line_items_pregunta_a_stripe():
+    # Lo normal en el webhook: el evento no trae line items y nada se reutiliza entre compras
+    cliente, resolutor = crear(line_items_por_sesion={"cs_1": [ROSA], "cs_2": [LAVANDA]})
+
+    assert resolutor.resolver({"session_id": "cs_1"}) == [ROSA]
+    assert resolutor.resolver({"session_id": "cs_2"}) == [LAVANDA]
+    assert len(cliente.llamadas) == 2
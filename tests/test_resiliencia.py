@@ -0,0 +1,131 @@
+import time
+import smtplib
+import dataclasses
+
+import pytest
+from redis.exceptions import ResponseError
+
+from api.resiliencia import Circuito, CircuitoAbierto, DependenciaCaida, proteger, en_peticion, _ignorar
+from api.tiendas import obtener_tienda
+
+
+def test_los_rechazos_smtp_no_abren_el_circuito():
+    aiosmtplib = pytest.importorskip("aiosmtplib")
+    circuito = Circuito("smtp_prueba", umbral_fallos=1, ignorar=_ignorar("smtp"))
+    rechazos = [
+        smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no existe")}),
+        aiosmtplib.SMTPRecipientsRefused([aiosmtplib.SMTPRecipientRefused(550, "no existe", "a@example.com")]),
+        aiosmtplib.SMTPSenderRefused(553, "remitente", "tienda@example.com"),
+        aiosmtplib.SMTPDataError(554, "mensaje rechazado"),
+    ]
+
+    for error in rechazos:
+        def fallar():
+            raise error
+        with pytest.raises(type(error)):
+            circuito.llamar(fallar)
+
+    assert circuito.estado == "cerrado"
+
+
+def test_el_circuito_smtp_es_de_cada_tienda(entorno):
+    entorno(CIRCUITO_UMBRAL="1")
+    principal = obtener_tienda()
+    otra = dataclasses.replace(principal, nombre="otra_circuito")
+
+    def caido(*args):
+        raise ConnectionError("smtp caído")
+
+    with pytest.raises(DependenciaCaida):
+        proteger("smtp", caido, reintentos=0, tienda=otra)
+    # Abierto para "otra": ya ni se intenta
+    with pytest.raises(DependenciaCaida, match="circuito abierto"):
+        proteger("smtp", caido, reintentos=0, tienda=otra)
+
+    assert proteger("smtp", lambda: "enviado", reintentos=0, tienda=principal) == "enviado"
+
+
+def fallar_con(error):
+    def fallar(*args):
+        raise error
+    return fallar
+
+
+def test_abierto_semiabierto_cerrado():
+    circuito = Circuito("prueba_estados", umbral_fallos=2, segundos_abierto=0.05)
+    caido = fallar_con(ConnectionError("caído"))
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            circuito.llamar(caido)
+    assert circuito.estado == "abierto"
+    # Abierto: ni se llama
+    with pytest.raises(CircuitoAbierto):
+        circuito.llamar(lambda: "no debería llamarse")
+
+    time.sleep(0.06)
+    assert circuito.llamar(lambda: "ok") == "ok"
+    assert circuito.estado == "cerrado"
+
+
+def test_la_prueba_en_semiabierto_que_falla_vuelve_a_abrir():
+    circuito = Circuito("prueba_semiabierto", umbral_fallos=1, segundos_abierto=0.05)
+    with pytest.raises(ConnectionError):
+        circuito.llamar(fallar_con(ConnectionError("caído")))
+    time.sleep(0.06)
+
+    with pytest.raises(ConnectionError):
+        circuito.llamar(fallar_con(ConnectionError("sigue caído")))
+    assert circuito.estado == "abierto"
+
+
+def test_numero_de_reintentos():
+    llamadas = []
+
+    def caido():
+        llamadas.append(1)
+        raise ConnectionError("caído")
+
+    with pytest.raises(DependenciaCaida):
+        proteger("prueba_reintentos", caido, reintentos=2)
+    assert len(llamadas) == 3
+
+
+def test_en_la_peticion_no_se_reintenta(entorno):
+    entorno(RESILIENCIA_REINTENTOS="3", RESILIENCIA_REINTENTOS_PETICION="0")
+    llamadas = []
+
+    def caido():
+        llamadas.append(1)
+        raise ConnectionError("caído")
+
+    with en_peticion(), pytest.raises(DependenciaCaida):
+        proteger("prueba_peticion", caido)
+    assert len(llamadas) == 1
+
+    with pytest.raises(DependenciaCaida):
+        proteger("prueba_peticion_worker", caido)
+    assert len(llamadas) == 1 + 4
+
+
+@pytest.mark.parametrize("dependencia, error", [
+    ("smtp", smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no existe")})),
+    ("smtp", ValueError("mensaje mal formado")),
+    ("redis", ResponseError("Error running script")),
+])
+def test_errores_ignorados_ni_se_reintentan_ni_abren(dependencia, error):
+    circuito = Circuito(f"prueba_{dependencia}", umbral_fallos=1, ignorar=_ignorar(dependencia))
+    llamadas = []
+
+    def fallar():
+        llamadas.append(1)
+        raise error
+
+    for _ in range(3):
+        with pytest.raises(type(error)):
+            circuito.llamar(fallar)
+    assert circuito.estado == "cerrado"
+
+    with pytest.raises(type(error)):
+        proteger(dependencia, fallar, reintentos=2)
+    assert len(llamadas) == 4
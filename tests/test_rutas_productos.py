@@ -0,0 +1,72 @@
+from api.eventos_stripe import SesionCheckout
+from api.rutas_productos import Ruta, TablaRutas, RUTAS, RUTA_POR_DEFECTO
+
+KIT = Ruta(nombre="kit", plantilla="correo_template_simple.html", product_ids=("prod_kit",))
+
+
+def evento_con_precio(precio):
+    return {
+        "id": "evt_1",
+        "data": {"object": {
+            "id": "cs_1",
+            "line_items": {"data": [{"description": "Pack sin palabra clave", "price": precio}]},
+        }},
+    }
+
+
+def test_la_regla_por_producto_encaja_con_el_evento():
+    sesion = SesionCheckout.desde_evento(evento_con_precio({"id": "price_1", "product": "prod_kit"}))
+
+    assert sesion.line_items == [{"description": "Pack sin palabra clave", "price_id": "price_1",
+                                  "product_id": "prod_kit"}]
+    assert TablaRutas([KIT]).clasificar(sesion.line_items) == [KIT]
+
+
+def test_producto_expandido():
+    sesion = SesionCheckout.desde_evento(evento_con_precio({"id": "price_1", "product": {"id": "prod_kit"}}))
+
+    assert sesion.line_items[0]["product_id"] == "prod_kit"
+
+
+def nombres(line_items, tabla=None):
+    return [ruta.nombre for ruta in (tabla or TablaRutas()).clasificar(line_items)]
+
+
+def test_palabra_clave_con_y_sin_tildes():
+    assert nombres([{"description": "Reto Timón 21 días"}]) == ["reto_timon"]
+    assert nombres([{"description": "RETO TIMON 21 DIAS"}]) == ["reto_timon"]
+    assert nombres([{"description": "método barrera primero"}]) == ["metodo_barrera"]
+
+
+def test_sin_palabra_clave_va_a_la_ruta_por_defecto():
+    assert TablaRutas().clasificar([{"description": "Jabón de avena"}]) == [RUTA_POR_DEFECTO]
+    assert TablaRutas().clasificar([]) == [RUTA_POR_DEFECTO]
+
+
+def test_varios_productos_dan_varias_rutas_sin_repetir():
+    items = [{"description": "Método Barrera Primero"}, {"description": "Reto Timón"},
+             {"description": "Barrera (regalo)"}]
+
+    assert nombres(items) == ["metodo_barrera", "reto_timon"]
+
+
+def test_las_rutas_con_portal_van_primero():
+    # El antioxidante va antes en la tabla, pero no da cuenta del portal
+    items = [{"description": "Sérum Antioxidante"}, {"description": "Reto Timón"}]
+
+    assert nombres(items) == ["reto_timon", "antioxidante"]
+
+
+def test_los_ids_mandan_sobre_las_palabras_clave():
+    tabla = TablaRutas(RUTAS + (
+        Ruta(nombre="por_precio", plantilla="correo_template_simple.html", price_ids=("price_regalo",)),
+        Ruta(nombre="por_producto", plantilla="correo_template_simple.html", product_ids=("prod_regalo",)),
+    ))
+
+    assert nombres([{"description": "Reto Timón", "price_id": "price_regalo"}], tabla) == ["por_precio"]
+    assert nombres([{"description": "Reto Timón", "product_id": "prod_regalo"}], tabla) == ["por_producto"]
+    # El price_id va antes que el product_id
+    assert nombres([{"description": "Reto Timón", "price_id": "price_regalo", "product_id": "prod_regalo"}],
+                   tabla) == ["por_precio"]
+    # Con un id que no está en la tabla se mira la descripción
+    assert nombres([{"description": "Reto Timón", "price_id": "price_otro"}], tabla) == ["reto_timon"]
@@ -0,0 +1,229 @@
+import asyncio
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+from api import smtp_pool
+from api.smtp_pool import PoolSMTP, PoolSMTPAsync
+
+
+class SMTPFalso:
+    """Lo justo de smtplib.SMTP; `vivas` cuenta las sesiones abiertas a la vez."""
+
+    creadas = []
+    vivas = 0
+    max_vivas = 0
+    lock = threading.Lock()
+
+    def __init__(self, servidor, puerto, timeout=None):
+        self.enviados = []
+        self.noop_ok = True
+        self.caer_en = None  # número de envío en el que "se cae" la conexión
+        self.cerrada = False
+        SMTPFalso.creadas.append(self)
+        with SMTPFalso.lock:
+            SMTPFalso.vivas += 1
+            SMTPFalso.max_vivas = max(SMTPFalso.max_vivas, SMTPFalso.vivas)
+
+    def login(self, usuario, password):
+        pass
+
+    def noop(self):
+        if not self.noop_ok:
+            raise smtplib.SMTPServerDisconnected("cerrada por el servidor")
+        return 250, b"OK"
+
+    def send_message(self, mensaje):
+        if self.caer_en is not None and len(self.enviados) == self.caer_en:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        time.sleep(0.01)
+        self.enviados.append(mensaje["To"])
+
+    def rset(self):
+        pass
+
+    def quit(self):
+        self.close()
+
+    def close(self):
+        if not self.cerrada:
+            self.cerrada = True
+            with SMTPFalso.lock:
+                SMTPFalso.vivas -= 1
+
+
+@pytest.fixture
+def smtp_falso(monkeypatch):
+    SMTPFalso.creadas, SMTPFalso.vivas, SMTPFalso.max_vivas = [], 0, 0
+    monkeypatch.setattr(smtp_pool.smtplib, "SMTP", SMTPFalso)
+    return SMTPFalso
+
+
+def mensaje(destinatario):
+    msg = EmailMessage()
+    msg["From"], msg["To"], msg["Subject"] = "tienda@example.com", destinatario, "Tu compra"
+    msg.set_content("Gracias")
+    return msg
+
+
+def pool(**opciones):
+    return PoolSMTP("127.0.0.1", 2525, "usuario", "clave", usar_ssl=False, **opciones)
+
+
+def test_reutiliza_la_conexion_si_responde_al_noop(smtp_falso):
+    p = pool()
+    p.enviar(mensaje("a@example.com"))
+    p.enviar(mensaje("b@example.com"))
+
+    assert len(smtp_falso.creadas) == 1
+    assert smtp_falso.creadas[0].enviados == ["a@example.com", "b@example.com"]
+
+
+def test_cambia_la_conexion_muerta(smtp_falso):
+    p = pool()
+    p.enviar(mensaje("a@example.com"))
+    smtp_falso.creadas[0].noop_ok = False
+
+    p.enviar(mensaje("b@example.com"))
+
+    assert len(smtp_falso.creadas) == 2
+    assert smtp_falso.creadas[0].cerrada
+    assert smtp_falso.creadas[1].enviados == ["b@example.com"]
+
+
+def test_cambia_la_conexion_inactiva_sin_noop(smtp_falso):
+    p = pool(max_inactividad=0)
+    p.enviar(mensaje("a@example.com"))
+    p.enviar(mensaje("b@example.com"))
+
+    assert len(smtp_falso.creadas) == 2
+
+
+def test_no_pasa_del_maximo_de_conexiones(smtp_falso):
+    p = pool(max_conexiones=2)
+    hilos = [threading.Thread(target=p.enviar, args=(mensaje(f"c{i}@example.com"),)) for i in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert smtp_falso.max_vivas == 2
+    assert sum(len(s.enviados) for s in smtp_falso.creadas) == 8
+
+
+def test_enviar_lote_reconecta_una_vez(smtp_falso, monkeypatch):
+    p = pool()
+    conectar = p._conectar
+
+    def conectar_y_caer():
+        server = conectar()
+        if len(smtp_falso.creadas) == 1:
+            server.caer_en = 1
+        return server
+
+    monkeypatch.setattr(p, "_conectar", conectar_y_caer)
+    resultados = p.enviar_lote([mensaje(f"c{i}@example.com") for i in range(3)])
+
+    assert resultados == [None, None, None]
+    assert smtp_falso.creadas[0].enviados == ["c0@example.com"]
+    assert smtp_falso.creadas[1].enviados == ["c1@example.com", "c2@example.com"]
+
+
+def test_enviar_lote_no_reconecta_dos_veces(smtp_falso, monkeypatch):
+    p = pool()
+    conectar = p._conectar
+
+    def conectar_y_caer():
+        server = conectar()
+        server.caer_en = 0 if len(smtp_falso.creadas) > 1 else 1
+        return server
+
+    monkeypatch.setattr(p, "_conectar", conectar_y_caer)
+    resultados = p.enviar_lote([mensaje(f"c{i}@example.com") for i in range(3)])
+
+    assert resultados[0] is None
+    assert all(isinstance(r, smtplib.SMTPServerDisconnected) for r in resultados[1:])
+    assert len(smtp_falso.creadas) == 2
+    # La sesión rota no vuelve al pool
+    assert p._libres == []
+
+
+class RespuestaFalsa:
+    def __init__(self, code):
+        self.code = code
+
+
+class SMTPAsyncFalso:
+    """Lo justo de aiosmtplib.SMTP."""
+
+    creadas = []
+    vivas = 0
+    max_vivas = 0
+
+    def __init__(self, **opciones):
+        self.enviados = []
+        self.noop_ok = True
+        self.cerrada = False
+        SMTPAsyncFalso.creadas.append(self)
+
+    async def connect(self):
+        SMTPAsyncFalso.vivas += 1
+        SMTPAsyncFalso.max_vivas = max(SMTPAsyncFalso.max_vivas, SMTPAsyncFalso.vivas)
+
+    async def login(self, usuario, password):
+        pass
+
+    async def noop(self):
+        return RespuestaFalsa(250 if self.noop_ok else 421)
+
+    async def send_message(self, mensaje):
+        await asyncio.sleep(0.01)
+        self.enviados.append(mensaje["To"])
+
+    async def quit(self):
+        self.close()
+
+    def close(self):
+        if not self.cerrada:
+            self.cerrada = True
+            SMTPAsyncFalso.vivas -= 1
+
+
+@pytest.fixture
+def smtp_async_falso(monkeypatch):
+    aiosmtplib = pytest.importorskip("aiosmtplib")
+    SMTPAsyncFalso.creadas, SMTPAsyncFalso.vivas, SMTPAsyncFalso.max_vivas = [], 0, 0
+    monkeypatch.setattr(aiosmtplib, "SMTP", SMTPAsyncFalso)
+    return SMTPAsyncFalso
+
+
+def pool_async(**opciones):
+    return PoolSMTPAsync("127.0.0.1", 2525, "usuario", "clave", usar_ssl=False, **opciones)
+
+
+def test_async_reutiliza_y_cambia_la_conexion_muerta(smtp_async_falso):
+    async def enviar():
+        p = pool_async()
+        await p.enviar(mensaje("a@example.com"))
+        await p.enviar(mensaje("b@example.com"))
+        smtp_async_falso.creadas[0].noop_ok = False
+        await p.enviar(mensaje("c@example.com"))
+
+    asyncio.run(enviar())
+
+    assert [s.enviados for s in smtp_async_falso.creadas] == [["a@example.com", "b@example.com"], ["c@example.com"]]
+    assert smtp_async_falso.creadas[0].cerrada
+
+
+def test_async_no_pasa_del_maximo_de_conexiones(smtp_async_falso):
+    async def enviar():
+        p = pool_async(max_conexiones=2)
+        await asyncio.gather(*(p.enviar(mensaje(f"c{i}@example.com")) for i in range(8)))
+
+    asyncio.run(enviar())
+
+    assert smtp_async_falso.max_vivas == 2
+    assert sum(len(s.enviados) for s in smtp_async_falso.creadas) == 8
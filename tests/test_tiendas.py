@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from api.config import cargar_config
+from api.tiendas import cargar_tiendas
+
+
+def cargar(tmp_path, declaradas):
+    ruta = tmp_path / "tiendas.json"
+    ruta.write_text(json.dumps(declaradas), encoding="utf-8")
+    entorno = {"TIENDAS_CONFIG": str(ruta), "OTRA_SECRETO": "whsec_otra", "OTRA_CLAVE": "sk_test_otra"}
+    return cargar_tiendas(cargar_config(entorno), entorno)
+
+
+def test_tienda_con_su_dominio(tmp_path):
+    tiendas = cargar(tmp_path, {"otra": {"stripe_secret_key": "${OTRA_CLAVE}", "stripe_webhook_secret": "${OTRA_SECRETO}",
+                                       "dominio": "otra.com"}})
+
+    assert tiendas["otra"].asunto == "Tu pedido en otra.com ha sido confirmado."
+    assert tiendas["otra"].stripe_webhook_secret == "whsec_otra"
+    assert tiendas["otra"].stripe_secret_key == "sk_test_otra"
+    assert tiendas["otra"].prefijo_redis == "otra:"
+
+
+def test_tienda_sin_dominio_no_carga(tmp_path):
+    with pytest.raises(ValueError, match="dominio"):
+        cargar(tmp_path, {"otra": {"stripe_secret_key": "${OTRA_CLAVE}", "stripe_webhook_secret": "${OTRA_SECRETO}"}})
+
+
+def test_tienda_sin_clave_de_stripe_no_carga(tmp_path):
+    with pytest.raises(ValueError, match="stripe_secret_key"):
+        cargar(tmp_path, {"otra": {"stripe_webhook_secret": "${OTRA_SECRETO}", "dominio": "otra.com"}})
+
+
+def test_variable_sin_definir_no_carga(tmp_path):
+    with pytest.raises(ValueError, match="OTRA_CLAVE_NUEVA"):
+        cargar(tmp_path, {"otra": {"stripe_secret_key": "${OTRA_CLAVE_NUEVA}", "stripe_webhook_secret": "${OTRA_SECRETO}",
+                                   "dominio": "otra.com"}})
@@ -0,0 +1,34 @@
+import pytest
+
+from api.cola_envios import obtener_cola
+from api.idempotencia import reclamar_evento, NUEVO, HECHO
+from api.resiliencia import DependenciaCaida
+from api.webhook import diferir_trabajo, extraer_trabajo
+from tests.conftest import sesion_checkout
+
+
+def trabajo(event_id):
+    return extraer_trabajo({"id": event_id, "data": {"object": sesion_checkout("cs_1")}})
+
+
+def test_sin_worker_no_se_difiere(redis_falso, entorno, tmp_path):
+    entorno(COLA_BACKEND="sqlite", COLA_SQLITE_PATH=str(tmp_path / "cola.sqlite3"))
+    assert reclamar_evento("evt_1") == NUEVO
+
+    assert diferir_trabajo("evt_1", trabajo("evt_1"), DependenciaCaida("stripe", "timeout")) == 503
+
+    assert obtener_cola().obtener(timeout=0) == (None, None)
+    # Liberado: el reintento de Stripe vuelve a entrar
+    assert reclamar_evento("evt_1") == NUEVO
+
+
+@pytest.mark.parametrize("variable", ["WEBHOOK_MODO_COLA", "WORKER_INTEGRADO"])
+def test_con_worker_se_difiere(redis_falso, entorno, tmp_path, variable):
+    entorno(**{variable: "1", "COLA_BACKEND": "sqlite", "COLA_SQLITE_PATH": str(tmp_path / "cola.sqlite3")})
+    event_id = f"evt_{variable}"
+    assert reclamar_evento(event_id) == NUEVO
+
+    assert diferir_trabajo(event_id, trabajo(event_id), DependenciaCaida("stripe", "timeout")) == 200
+
+    assert obtener_cola().obtener(timeout=0)[1]["event_id"] == event_id
+    assert reclamar_evento(event_id) == HECHO
@@ -0,0 +1,68 @@
+import asyncio
+import dataclasses
+import smtplib
+
+import pytest
+
+from api.eventos_stripe import SesionCheckout
+from api.idempotencia import reclamar_evento, NUEVO
+from api.outbox import PREFIJO_ENTRADA, obtener_outbox, obtener_outbox_async
+from api.despachador import registrar_fallo_async, REINTENTO
+from api.resiliencia import DependenciaCaida
+from api.tiendas import obtener_tienda
+import api.webhook
+from api.webhook import procesar_trabajo
+import api.webhook_asgi
+from api.webhook_asgi import manejar_checkout_async, diferir_trabajo_async, procesar_trabajo_async
+from tests.conftest import sesion_checkout
+from tests.test_webhook import trabajo
+
+
+def sesion(event_id, session_id):
+    return SesionCheckout.desde_evento({"id": event_id, "data": {"object": sesion_checkout(session_id)}})
+
+
+def test_checkout_queda_en_el_outbox(redis_falso):
+    assert asyncio.run(manejar_checkout_async(sesion("evt_asgi_1", "cs_asgi_1"), obtener_tienda())) == 200
+
+    assert redis_falso.exists(f"{PREFIJO_ENTRADA}evt_asgi_1")
+    assert redis_falso.get("stripe_evento:evt_asgi_1") == "hecho"
+    # El reintento de Stripe no vuelve a encolar el correo
+    assert asyncio.run(manejar_checkout_async(sesion("evt_asgi_1", "cs_asgi_1"), obtener_tienda())) == 200
+    assert len(redis_falso.keys(f"{PREFIJO_ENTRADA}*")) == 1
+
+
+def test_sin_worker_no_se_difiere(redis_falso, entorno, tmp_path):
+    entorno(COLA_BACKEND="sqlite", COLA_SQLITE_PATH=str(tmp_path / "cola.sqlite3"))
+    assert reclamar_evento("evt_asgi_2") == NUEVO
+
+    error = DependenciaCaida("stripe", "timeout")
+    assert asyncio.run(diferir_trabajo_async("evt_asgi_2", trabajo("evt_asgi_2"), error)) == 503
+
+    assert reclamar_evento("evt_asgi_2") == NUEVO
+
+
+def test_registrar_fallo_async_reprograma(redis_falso):
+    asyncio.run(manejar_checkout_async(sesion("evt_asgi_3", "cs_asgi_3"), obtener_tienda()))
+    tienda = obtener_tienda()
+    (id_entrada, _), = obtener_outbox().reclamar(tienda, cantidad=1)[0]
+    error = smtplib.SMTPResponseException(554, b"mensaje rechazado")
+
+    async def fallar():
+        return await registrar_fallo_async(obtener_outbox_async(), id_entrada, error, tienda)
+
+    assert asyncio.run(fallar()) == REINTENTO
+    assert redis_falso.hget(f"{PREFIJO_ENTRADA}{id_entrada}", "intentos") == "1"
+    assert redis_falso.zscore(f"outbox_correos:programados:{tienda.nombre}", id_entrada) is not None
+
+
+def test_sin_correo_no_se_pregunta_a_stripe(monkeypatch):
+    # Igual que procesar_trabajo(): sin datos de correo no se llega a llamar a Stripe
+    sin_correo = dataclasses.replace(obtener_tienda(), correo_pass="")
+    monkeypatch.setattr(api.webhook_asgi, "obtener_tienda", lambda nombre=None: sin_correo)
+    monkeypatch.setattr(api.webhook_asgi, "obtener_resolutor_productos", lambda tienda: pytest.fail("llamó a Stripe"))
+
+    assert asyncio.run(procesar_trabajo_async(trabajo("evt_asgi_4"))) is False
+    monkeypatch.setattr(api.webhook, "obtener_tienda", lambda nombre=None: sin_correo)
+    monkeypatch.setattr(api.webhook, "obtener_resolutor_productos", lambda tienda: pytest.fail("llamó a Stripe"))
+    assert procesar_trabajo(trabajo("evt_asgi_4")) is False
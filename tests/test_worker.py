@@ -0,0 +1,65 @@
+import threading
+
+from api import worker
+from api.cola_envios import ColaSQLite
+
+
+def test_reintenta_y_acaba_en_fallidos(monkeypatch):
+    def falla(trabajo):
+        raise RuntimeError("SMTP caído")
+
+    monkeypatch.setattr(worker, "procesar_trabajo", falla)
+    monkeypatch.setattr(worker, "calcular_retraso", lambda intentos, base: 0)
+    cola = ColaSQLite()
+    cola.encolar({"event_id": "evt_1"})
+
+    for _ in range(3):
+        ref, trabajo = cola.obtener(timeout=1)
+        assert not worker.procesar_uno(cola, ref, trabajo, max_intentos=3, base_retraso=0)
+
+    assert cola.obtener(timeout=0) == (None, None)
+    [fallido] = cola.fallidos()
+    assert fallido["intentos"] == 3
+    assert fallido["ultimo_error"] == "SMTP caído"
+
+
+def test_confirma_cuando_se_envia(monkeypatch):
+    monkeypatch.setattr(worker, "procesar_trabajo", lambda trabajo: True)
+    cola = ColaSQLite()
+    cola.encolar({"event_id": "evt_1"})
+
+    ref, trabajo = cola.obtener(timeout=1)
+    assert worker.procesar_uno(cola, ref, trabajo, max_intentos=3, base_retraso=0)
+    assert cola.obtener(timeout=0) == (None, None)
+    assert cola.fallidos() == []
+
+
+def test_el_bucle_sobrevive_a_un_error_de_la_cola(monkeypatch):
+    procesados = []
+    parar = threading.Event()
+
+    class ColaInestable(ColaSQLite):
+        fallos = 1
+
+        def obtener(self, timeout=1):
+            if self.fallos:
+                self.fallos -= 1
+                raise ConnectionError("Redis no responde")
+            return super().obtener(timeout=0.05)
+
+    def procesar(trabajo):
+        procesados.append(trabajo["event_id"])
+        parar.set()
+        return True
+
+    monkeypatch.setattr(worker, "procesar_trabajo", procesar)
+    monkeypatch.setattr(parar, "wait", lambda segundos: None)
+    cola = ColaInestable()
+    cola.encolar({"event_id": "evt_1"})
+
+    hilo = threading.Thread(target=worker.bucle_worker, args=(cola, parar, 3, 0), daemon=True)
+    hilo.start()
+    hilo.join(timeout=5)
+
+    assert not hilo.is_alive()
+    assert procesados == ["evt_1"]